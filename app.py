@@ -3,7 +3,7 @@ eventlet.monkey_patch()
 
 import os
 import json
-import glob
+import atexit
 import shutil
 import subprocess
 import threading
@@ -18,11 +18,18 @@ from flask import Flask, render_template, request, jsonify, send_from_directory,
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 from retrieval_engine import RetrievalEngine
-from tools.crawl_site import crawl_site
-from tools.index_kb import index_kb
-from tools.process_docs import process_uploaded_documents
+from tools.crawl_site import crawl_site, reextract_site
+from tools.index_kb import index_kb, index_documents, EmbeddingPipeline
+from tools.index_segments import compact_segments
+from tools.index_checkpoint import CHECKPOINT_DIR
+from tools.process_docs import SpooledUpload, process_uploaded_documents, spool_upload, discard_uploads, require_spooled
+from tools.doc_store import DocumentStore
 from tools.profile_builder import build_company_profile
-from models import db, Conversation, Intent, Bot
+from tools.workflow import StageGraph
+from tools.jobs import JobQueue, JobCancelled, parse_limits, JOB_POLL_INTERVAL, SUCCEEDED as JOB_SUCCEEDED
+from tools.hub import HubLatencyMonitor
+from tools.write_behind import WriteBehindQueue
+from models import db, Conversation, Intent, Bot, IdBlock
 from bot_manager import (
     rasa_available,
     slugify_name,
@@ -40,8 +47,8 @@ from openai_service import (
     get_company_name_from_url,
     generate_fallback_response,
 )
-from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'dev-secret-key')
@@ -70,7 +77,8 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     "pool_pre_ping": True,
 }
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# A message queue lets a separate job worker process emit progress to clients.
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
 
 db.init_app(app)
 
@@ -91,6 +99,103 @@ RASA_SERVICE_PORT_WINDOW = int(os.environ.get('RASA_SERVICE_PORT_WINDOW', '200')
 _rasa_services = {}
 _rasa_lock = threading.Lock()
 
+# Crawl, index and training work runs as persistent jobs. With JOB_WORKER_MODE
+# set to "external" this process only queues them and scripts/job_worker.py
+# runs them.
+JOBS_PATH = os.environ.get('JOBS_DB', os.path.join(BASE_DIR, 'kb', 'jobs.sqlite'))
+JOB_WORKER_MODE = os.environ.get('JOB_WORKER_MODE', 'inprocess').lower()
+IS_JOB_WORKER = os.environ.get('INTELLIBOT_JOB_WORKER') == '1'
+job_queue = JobQueue(JOBS_PATH, limits=parse_limits(os.environ.get('JOB_LIMITS')))
+database_ready = threading.Event()
+
+# Every Socket.IO client shares one eventlet hub; CPU-heavy work is offloaded
+# to native threads (tools/hub.py) and this monitor reports anything that still
+# holds the hub longer than the threshold. 0 disables it.
+HUB_STALL_THRESHOLD = float(os.environ.get('HUB_STALL_THRESHOLD', '0.1'))
+hub_monitor = HubLatencyMonitor(
+    HUB_STALL_THRESHOLD,
+    on_stall=lambda lag: app.logger.warning("Event loop stalled for %.0f ms", lag * 1000)
+).start()
+
+# Chat turns queue their Conversation rows instead of committing them inline;
+# rows are inserted in batches of CONVERSATION_LOG_BATCH or every
+# CONVERSATION_LOG_INTERVAL_MS. Ids are assigned up front so the answer can
+# carry one for feedback; each process reserves them from the database in
+# blocks of CONVERSATION_ID_BLOCK, so no two processes hand out the same id.
+# A full queue makes chat turns wait for the writer, up to
+# CONVERSATION_LOG_PUT_TIMEOUT seconds, before the row is dropped.
+CONVERSATION_LOG_BATCH = int(os.environ.get('CONVERSATION_LOG_BATCH', '50'))
+CONVERSATION_LOG_INTERVAL_MS = int(os.environ.get('CONVERSATION_LOG_INTERVAL_MS', '200'))
+CONVERSATION_LOG_MAX_PENDING = int(os.environ.get('CONVERSATION_LOG_MAX_PENDING', '2000'))
+CONVERSATION_LOG_PUT_TIMEOUT = float(os.environ.get('CONVERSATION_LOG_PUT_TIMEOUT', '5'))
+CONVERSATION_ID_BLOCK = int(os.environ.get('CONVERSATION_ID_BLOCK', '100'))
+
+# Ids reserved by this process: the next one to hand out and the end of its block.
+_conversation_ids = {'next': 0, 'end': 0}
+_conversation_ids_lock = threading.Lock()
+
+
+def reserve_conversation_ids(count):
+    """Reserve ``count`` consecutive conversation ids in the database and return the first."""
+    with app.app_context():
+        while True:
+            # The UPDATE locks the counter row, so concurrent reservations queue up.
+            updated = IdBlock.query.filter_by(name='conversations').update(
+                {IdBlock.next_id: IdBlock.next_id + count}
+            )
+            if updated:
+                end = db.session.get(IdBlock, 'conversations', populate_existing=True).next_id
+                db.session.commit()
+                return end - count
+            # First reservation: continue after the highest stored conversation id.
+            start = (db.session.query(db.func.max(Conversation.id)).scalar() or 0) + 1
+            db.session.add(IdBlock(name='conversations', next_id=start + count))
+            try:
+                db.session.commit()
+                return start
+            except IntegrityError:
+                # Another process created the counter first; reserve from it.
+                db.session.rollback()
+
+
+def next_conversation_id():
+    with _conversation_ids_lock:
+        if _conversation_ids['next'] >= _conversation_ids['end']:
+            count = max(1, CONVERSATION_ID_BLOCK)
+            start = reserve_conversation_ids(count)
+            _conversation_ids.update(next=start, end=start + count)
+        conversation_id = _conversation_ids['next']
+        _conversation_ids['next'] = conversation_id + 1
+        return conversation_id
+
+
+def write_conversations(rows):
+    """Insert queued conversations in one transaction, falling back to one row at a time."""
+    with app.app_context():
+        try:
+            db.session.add_all([Conversation(**row) for row in rows])
+            db.session.commit()
+            return
+        except SQLAlchemyError as exc:
+            db.session.rollback()
+            app.logger.warning("Batched conversation insert failed, retrying row by row: %s", exc)
+        for row in rows:
+            db.session.add(Conversation(**row))
+            ok, err = safe_commit()
+            if not ok:
+                app.logger.warning("Error logging conversation %s: %s", row.get('id'), err)
+
+
+conversation_log = WriteBehindQueue(
+    write_conversations,
+    batch_size=CONVERSATION_LOG_BATCH,
+    max_delay=CONVERSATION_LOG_INTERVAL_MS / 1000.0,
+    max_pending=CONVERSATION_LOG_MAX_PENDING,
+    on_error=lambda rows, exc: app.logger.warning("Dropped %s conversation rows: %s", len(rows), exc),
+    name='conversation-log'
+)
+atexit.register(conversation_log.close)
+
 
 def ensure_column_exists(table_name, column_name, ddl):
     """Ensure a specific column exists on a table (light-weight migration)."""
@@ -146,6 +251,7 @@ def get_storage_paths(bot=None):
     raw_dir = os.path.join(base_abs, 'raw')
     index_dir = os.path.join(base_abs, 'index')
     uploads_dir = os.path.join(base_abs, 'uploads')
+    spool_dir = os.path.join(base_abs, 'spool')
     profile_path = os.path.join(base_abs, 'profile.yaml')
 
     return {
@@ -153,6 +259,7 @@ def get_storage_paths(bot=None):
         'raw_dir': raw_dir,
         'index_dir': index_dir,
         'uploads_dir': uploads_dir,
+        'spool_dir': spool_dir,
         'config_path': config_abs,
         'profile_path': profile_path,
     }
@@ -169,6 +276,19 @@ def ensure_storage_dirs(paths):
         os.makedirs(config_dir, exist_ok=True)
 
 
+def clear_directory(path, keep=()):
+    """Remove everything inside ``path`` except the entries named in ``keep``."""
+    os.makedirs(path, exist_ok=True)
+    for entry in os.listdir(path):
+        if entry in keep:
+            continue
+        entry_path = os.path.join(path, entry)
+        if os.path.isdir(entry_path):
+            shutil.rmtree(entry_path)
+        else:
+            os.remove(entry_path)
+
+
 def run_background_task(target, *args, **kwargs):
     """Helper to start daemonised background work."""
     thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
@@ -176,6 +296,64 @@ def run_background_task(target, *args, **kwargs):
     return thread
 
 
+def compact_index(bot, index_dir):
+    """Merge small index segments in the background and reload the retrieval engine."""
+    try:
+        result = compact_segments(index_dir)
+    except Exception as exc:
+        app.logger.warning("Index compaction failed for %s: %s", index_dir, exc)
+        return
+    if result.get('compacted'):
+        app.logger.info("Compacted %s index segments in %s", result.get('merged_segments'), index_dir)
+        get_retrieval(bot)._loaded = False
+
+
+def kb_resource(bot):
+    """Jobs that change one knowledge base never run side by side."""
+    return f"kb:{bot.id if bot else 'default'}"
+
+
+def bot_resource(bot_id):
+    return f"bot:{bot_id}"
+
+
+def submit_job(kind, params, resource, **extra):
+    """Queue a job and answer the request; a duplicate of an active job returns that job."""
+    job_id, created = job_queue.submit(kind, params, resource)
+    payload = {"status": "started", "job_id": job_id, "deduplicated": not created}
+    payload.update(extra)
+    return jsonify(payload)
+
+
+def submit_compaction(bot):
+    job_queue.submit('compact', {'bot_id': bot.id if bot else None}, kb_resource(bot))
+
+
+def job_bot(job):
+    bot_id = job.params.get('bot_id')
+    bot = resolve_bot(bot_id)
+    if bot_id and bot is None:
+        raise RuntimeError(f"Bot {bot_id} not found")
+    return bot
+
+
+def job_progress(job, event, bot):
+    """
+    Emit progress for a job. Reporting is also where a cancelled job stops;
+    errors are exempt so a job can still report its failure on the way out.
+    """
+    def progress(status_type, message):
+        socketio.emit(event, {
+            'type': status_type,
+            'message': message,
+            'bot_id': bot.id if bot else None,
+            'job_id': job.id
+        })
+        if status_type != 'error':
+            job.raise_if_cancelled()
+    return progress
+
+
 def find_available_port(preferred=None):
     """Find a free local port for a Rasa service."""
     start_port = preferred or RASA_SERVICE_BASE_PORT
@@ -466,8 +644,12 @@ def run_rasa_turn(bot, message, sender_id=None):
     }
 
 
-def initialize_bot_project(bot_id, project_path):
-    """Background task to create the filesystem structure for a bot."""
+def initialize_bot_project(bot_id, project_path, start_service=True):
+    """
+    Background task to create the filesystem structure for a bot. With
+    ``start_service`` False the Rasa service is left for the web process to
+    start; returns True when it should be.
+    """
     with app.app_context():
         try:
             abs_path = ensure_absolute_project_path(project_path)
@@ -496,29 +678,33 @@ def initialize_bot_project(bot_id, project_path):
                 bot.updated_at = datetime.utcnow()
                 safe_commit()
             emit_bot_update(bot)
-            return
+            return False
 
         bot = Bot.query.get(bot_id)
         if not bot:
-            return
+            return False
         bot.status = BOT_STATUS_READY
         bot.last_error = ''
         bot.last_trained_at = datetime.utcnow()
         bot.updated_at = datetime.utcnow()
-        start_ok, start_err, port = start_rasa_service(bot, force_restart=True)
-        if not start_ok:
-            bot.status = BOT_STATUS_IDLE
-            bot.last_error = f"Starter model not running: {start_err}"
+        if start_service:
+            start_ok, start_err, port = start_rasa_service(bot, force_restart=True)
+            if not start_ok:
+                bot.status = BOT_STATUS_IDLE
+                bot.last_error = f"Starter model not running: {start_err}"
         ok, db_err = safe_commit()
         if not ok:
             bot = Bot.query.get(bot_id)
             if not bot:
-                return
+                return False
             bot.status = BOT_STATUS_ERROR
             bot.last_error = f"Database error after init: {db_err}"
             bot.updated_at = datetime.utcnow()
             safe_commit()
+            emit_bot_update(bot)
+            return False
         emit_bot_update(bot)
+        return not start_service
 
 def build_rasa_training_files(bot, include_conversations=False):
     """Render Rasa training files from stored intents and recent conversations."""
@@ -607,6 +793,7 @@ def build_rasa_training_files(bot, include_conversations=False):
         add_example_intent(base_name, "", payload.get("examples"), payload.get("responses"))
 
     if include_conversations:
+        conversation_log.flush()
         conversations = Conversation.query.filter(Conversation.bot_id == bot.id) \
             .order_by(Conversation.timestamp.desc()).limit(50).all()
         oos_queries = []
@@ -685,8 +872,12 @@ def build_rasa_training_files(bot, include_conversations=False):
         yaml.safe_dump(rules_payload, rules_file, sort_keys=False, allow_unicode=True, width=200)
 
 
-def train_bot_project(bot_id, project_path, include_conversations=True):
-    """Background task to run rasa train for a bot."""
+def train_bot_project(bot_id, project_path, include_conversations=True, start_service=True):
+    """
+    Background task to run rasa train for a bot. With ``start_service`` False
+    the retrained service is left for the web process to start; returns True
+    when it should be.
+    """
     with app.app_context():
         abs_path = ensure_absolute_project_path(project_path)
         bot = Bot.query.get(bot_id)
@@ -699,15 +890,16 @@ def train_bot_project(bot_id, project_path, include_conversations=True):
         success, error = train_rasa_project(abs_path)
         bot = Bot.query.get(bot_id)
         if not bot:
-            return
+            return False
 
         if success:
             bot.status = BOT_STATUS_READY
             bot.last_error = ''
             bot.last_trained_at = datetime.utcnow()
-            start_ok, start_err, port = start_rasa_service(bot, force_restart=True)
-            if not start_ok:
-                bot.last_error = f"Training succeeded but Rasa service failed: {start_err}"
+            if start_service:
+                start_ok, start_err, port = start_rasa_service(bot, force_restart=True)
+                if not start_ok:
+                    bot.last_error = f"Training succeeded but Rasa service failed: {start_err}"
         else:
             bot.status = BOT_STATUS_ERROR
             bot.last_error = error or 'Training failed'
@@ -717,13 +909,80 @@ def train_bot_project(bot_id, project_path, include_conversations=True):
         if not ok:
             bot = Bot.query.get(bot_id)
             if not bot:
-                return
+                return False
             bot.status = BOT_STATUS_ERROR
             bot.last_error = f"Database error after training: {db_err}"
             bot.updated_at = datetime.utcnow()
             safe_commit()
+            emit_bot_update(bot)
+            return False
+        emit_bot_update(bot)
+        return success and not start_service
+
+def start_deferred_service(bot_id):
+    """Start the Rasa service a job in the external worker trained, and record any failure."""
+    with app.app_context():
+        bot = Bot.query.get(bot_id)
+        if not bot or bot.status != BOT_STATUS_READY:
+            return
+        start_ok, start_err, port = start_rasa_service(bot, force_restart=True)
+        if start_ok:
+            return
+        bot.last_error = f"Model ready but Rasa service failed: {start_err}"
+        bot.updated_at = datetime.utcnow()
+        safe_commit()
         emit_bot_update(bot)
 
+
+# Jobs that change the index or documents a bot answers from.
+INDEX_JOB_KINDS = ('index', 'documents', 'index_all', 'reextract', 'compact')
+
+
+def reload_bot_knowledge(bot_id):
+    """Drop the retrieval engine and context cached for a bot whose index another process changed."""
+    with app.app_context():
+        bot = resolve_bot(bot_id)
+        if bot_id and bot is None:
+            return
+        _retrieval_cache.pop(get_retrieval_cache_key(bot), None)
+        if bot is not None:
+            invalidate_bot_context(bot.id)
+
+
+def watch_worker_jobs():
+    """
+    Rasa services and retrieval engines belong to the web process, which
+    chats with them. Jobs run by scripts/job_worker.py therefore only report
+    a bot to start (``start_service`` in their result), and this loop starts
+    it here; after an index job it drops the bot's cached engine so the next
+    chat turn loads the new segments.
+    """
+    since = time.time()
+    while True:
+        time.sleep(JOB_POLL_INTERVAL)
+        try:
+            finished = job_queue.finished_since(since, ('train', 'init_bot') + INDEX_JOB_KINDS)
+        except Exception as exc:
+            app.logger.warning("Unable to read finished jobs: %s", exc)
+            continue
+        for job in finished:
+            since = max(since, job['finished_at'])
+            if job['kind'] in INDEX_JOB_KINDS:
+                # Even a failed or cancelled job may have installed segments.
+                try:
+                    reload_bot_knowledge(job['params'].get('bot_id'))
+                except Exception as exc:
+                    app.logger.warning("Unable to reload index for bot %s: %s", job['params'].get('bot_id'), exc)
+                continue
+            bot_id = (job['result'] or {}).get('start_service')
+            if job['state'] != JOB_SUCCEEDED or not bot_id:
+                continue
+            try:
+                start_deferred_service(bot_id)
+            except Exception as exc:
+                app.logger.warning("Unable to start Rasa service for bot %s: %s", bot_id, exc)
+
+
 def start_ready_bot_services():
     """Preload Rasa services for all bots marked READY."""
     if not DB_AVAILABLE or not rasa_available():
@@ -741,12 +1000,20 @@ def init_database():
             db.create_all()
             DB_AVAILABLE = True
             ensure_schema_columns()
+            conversation_log.start()
             print("Database initialized successfully")
         except Exception as e:
             print(f"❌ Database initialization error: {e}")
             print("⚠️  Conversation logging is DISABLED. Chat will work but conversations won't be saved.")
         else:
-            run_background_task(start_ready_bot_services)
+            if not IS_JOB_WORKER:
+                run_background_task(start_ready_bot_services)
+    database_ready.set()
+    # Jobs look bots up in the database, so they only start once it is ready.
+    if JOB_WORKER_MODE != 'external' and not IS_JOB_WORKER:
+        job_queue.start()
+    elif not IS_JOB_WORKER:
+        run_background_task(watch_worker_jobs)
 
 # Start database initialization in background
 threading.Thread(target=init_database, daemon=True).start()
@@ -764,6 +1031,14 @@ DEFAULT_CONFIG = {
 # Lazy-loaded retrieval engines per bot/default
 _retrieval_cache = {}
 
+# Per-bot runtime context (bot row, config, profile, paths) for the chat path.
+# Endpoints and jobs that change any of it invalidate the entry; otherwise it
+# is revalidated against file mtimes and the bot's updated_at at most every
+# BOT_CONTEXT_REFRESH seconds, which also picks up an external job worker's
+# changes.
+BOT_CONTEXT_REFRESH = float(os.environ.get('BOT_CONTEXT_REFRESH', '5'))
+_bot_contexts = {}
+
 def normalize_url(url, default=None):
     """Ensure URLs include a scheme and strip whitespace."""
     if url is None:
@@ -822,11 +1097,92 @@ def save_config(config, bot=None):
     ensure_storage_dirs(storage)
     with open(storage['config_path'], 'w') as f:
         json.dump(config, f, indent=2)
+    invalidate_bot_context(bot.id if bot else None)
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def contact_block_for(profile):
+    contact = profile.get('contact') or {}
+    contact_lines = []
+    for key in ('phone', 'email', 'website', 'address'):
+        value = contact.get(key)
+        if value:
+            contact_lines.append(f"{key.title()}: {value}")
+    return "\n".join(contact_lines)
+
+def build_bot_context(bot):
+    """Everything a chat turn needs about a bot, read once."""
+    storage = get_storage_paths(bot)
+    config = load_config(bot)
+    profile = load_profile_data(bot)
+    return {
+        'bot': bot,
+        'storage': storage,
+        'config': config,
+        'profile': profile,
+        'company_name': profile.get('company_name') or get_company_name_from_url(config.get('url')),
+        'contact_block': contact_block_for(profile),
+        'updated_at': bot.updated_at,
+        'mtimes': {path: file_mtime(path) for path in (storage['config_path'], storage['profile_path'])},
+        'checked_at': time.monotonic(),
+    }
+
+def bot_context_current(context):
+    if any(file_mtime(path) != mtime for path, mtime in context['mtimes'].items()):
+        return False
+    updated_at = db.session.query(Bot.updated_at).filter(Bot.id == context['bot'].id).scalar()
+    return updated_at == context['updated_at']
+
+def get_bot_context(bot_id):
+    """
+    Cached runtime context for a bot, or None if it does not exist. The bot is
+    a detached snapshot: read it freely, but merge it into the session before
+    changing it.
+    """
+    if not DB_AVAILABLE:
+        return None
+    try:
+        key = int(bot_id)
+    except (TypeError, ValueError):
+        return None
+    context = _bot_contexts.get(key)
+    if context is not None:
+        now = time.monotonic()
+        if now - context['checked_at'] < BOT_CONTEXT_REFRESH:
+            return context
+        if bot_context_current(context):
+            context['checked_at'] = now
+            return context
+    bot = Bot.query.get(key)
+    if bot is None:
+        _bot_contexts.pop(key, None)
+        return None
+    # Detach the snapshot so it outlives this session without lazy reloads.
+    db.session.expunge(bot)
+    context = build_bot_context(bot)
+    _bot_contexts[key] = context
+    return context
+
+def invalidate_bot_context(bot_id=None):
+    """Drop one bot's cached context, or every bot's when ``bot_id`` is None."""
+    if bot_id is None:
+        _bot_contexts.clear()
+    else:
+        _bot_contexts.pop(bot_id, None)
+
+@event.listens_for(Bot, 'after_update')
+@event.listens_for(Bot, 'after_delete')
+def _bot_row_changed(mapper, connection, target):
+    invalidate_bot_context(target.id)
 
 @app.route('/health')
 def health():
     """Fast health check endpoint for deployment"""
-    return jsonify({"status": "ok"}), 200
+    return jsonify({"status": "ok", "hub": hub_monitor.stats(), "conversation_log": conversation_log.stats()}), 200
 
 @app.route('/')
 def index():
@@ -873,30 +1229,26 @@ def get_stats():
 
     stats = get_retrieval(bot).get_stats()
     
-    # Get raw document count and sources
-    raw_files = glob.glob(os.path.join(storage['raw_dir'], "*.json"))
-    stats['raw_documents'] = len(raw_files)
-    
+    # Raw document count and sources come from the document store's index alone
+    with DocumentStore(storage['raw_dir']) as store:
+        stats['raw_documents'] = len(store)
+        raw_sources = list(store.sources())
+
     # Extract document sources (URLs)
     sources = []
     seen_sources = set()
-    for raw_file in raw_files:
-        try:
-            with open(raw_file, 'r') as f:
-                doc = json.load(f)
-                url = doc.get('url', 'Unknown')
-                label = doc.get('label') or url
-                if not url:
-                    continue
-                if url in seen_sources:
-                    continue
-                seen_sources.add(url)
-                sources.append({
-                    "url": url,
-                    "label": label
-                })
-        except Exception:
-            pass
+    for url, label in raw_sources:
+        url = 'Unknown' if url is None else url
+        label = label or url
+        if not url:
+            continue
+        if url in seen_sources:
+            continue
+        seen_sources.add(url)
+        sources.append({
+            "url": url,
+            "label": label
+        })
     
     stats['document_sources'] = sorted(
         sources,
@@ -960,48 +1312,17 @@ def start_crawl():
     bot = resolve_bot(data.get('bot_id'))
     if data.get('bot_id') and bot is None:
         return jsonify({"error": "Bot not found"}), 404
-    storage = get_storage_paths(bot)
-    ensure_storage_dirs(storage)
     url = normalize_url(data.get('url'), default='https://www.officems.co.za/')
     max_pages = data.get('max_pages', 500)
-    
-    def crawl_progress(status_type, message):
-        socketio.emit('crawl_progress', {
-            'type': status_type,
-            'message': message,
-            'bot_id': bot.id if bot else None
-        })
-    
-    def crawl_task():
-        try:
-            socketio.emit('crawl_status', {
-                'status': 'started',
-                'message': f'Starting crawl of {url}...',
-                'bot_id': bot.id if bot else None
-            })
-            result = crawl_site(
-                url,
-                max_pages,
-                progress_callback=crawl_progress,
-                output_dir=storage['raw_dir']
-            )
-            socketio.emit('crawl_status', {
-                'status': 'completed',
-                'result': result,
-                'bot_id': bot.id if bot else None
-            })
-        except Exception as e:
-            socketio.emit('crawl_status', {
-                'status': 'error',
-                'message': str(e),
-                'bot_id': bot.id if bot else None
-            })
-    
-    thread = threading.Thread(target=crawl_task)
-    thread.daemon = True
-    thread.start()
-    
-    return jsonify({"status": "started"})
+    return submit_job('crawl', {'bot_id': bot.id if bot else None, 'url': url, 'max_pages': max_pages}, kb_resource(bot))
+
+@app.route('/api/reextract', methods=['POST'])
+def start_reextract():
+    data = request.json or {}
+    bot = resolve_bot(data.get('bot_id'))
+    if data.get('bot_id') and bot is None:
+        return jsonify({"error": "Bot not found"}), 404
+    return submit_job('reextract', {'bot_id': bot.id if bot else None}, kb_resource(bot))
 
 @app.route('/api/index', methods=['POST'])
 def start_indexing():
@@ -1009,43 +1330,40 @@ def start_indexing():
     bot = resolve_bot(data.get('bot_id'))
     if data.get('bot_id') and bot is None:
         return jsonify({"error": "Bot not found"}), 404
+    params = {
+        'bot_id': bot.id if bot else None,
+        'chunk_size': data.get('chunk_size', 900),
+        'chunk_overlap': data.get('chunk_overlap', 150),
+    }
+    return submit_job('index', params, kb_resource(bot))
+
+@app.route('/api/documents', methods=['POST'])
+def add_documents():
+    """Process uploaded documents and append them to the live index without a rebuild."""
+    bot_id = request.form.get('bot_id')
+    bot = resolve_bot(bot_id)
+    if bot_id and bot is None:
+        return jsonify({"error": "Bot not found"}), 404
+
     storage = get_storage_paths(bot)
     ensure_storage_dirs(storage)
-    chunk_size = data.get('chunk_size', 900)
-    chunk_overlap = data.get('chunk_overlap', 150)
-    
-    def index_progress(status_type, message):
-        socketio.emit('index_progress', {
-            'type': status_type,
-            'message': message,
-            'bot_id': bot.id if bot else None
-        })
+    url_prefix = f"/uploads/{bot.slug}" if bot else "/uploads"
 
-    def index_task():
-        try:
-            socketio.emit('index_status', {
-                'status': 'started',
-                'message': 'Building vector index...',
-                'bot_id': bot.id if bot else None
-            })
-            result = index_kb(
-                chunk_size,
-                chunk_overlap,
-                progress_callback=index_progress,
-                raw_dir=storage['raw_dir'],
-                index_dir=storage['index_dir'],
-                config_path=storage['config_path'],
-            )
-            get_retrieval(bot)._loaded = False
-            socketio.emit('index_status', {'status': 'completed', 'result': result, 'bot_id': bot.id if bot else None})
-        except Exception as e:
-            socketio.emit('index_status', {'status': 'error', 'message': str(e), 'bot_id': bot.id if bot else None})
-    
-    thread = threading.Thread(target=index_task)
-    thread.daemon = True
-    thread.start()
-    
-    return jsonify({"status": "started"})
+    # Spool each upload to disk while hashing it; the job only holds paths.
+    uploaded_files = [
+        spool_upload(file.filename, file.stream, spool_dir=storage['spool_dir'])
+        for file in request.files.getlist('documents')
+        if file.filename
+    ]
+    if not uploaded_files:
+        return jsonify({"error": "No documents uploaded"}), 400
+
+    params = {
+        'bot_id': bot.id if bot else None,
+        'url_prefix': url_prefix,
+        'uploads': [upload._asdict() for upload in uploaded_files],
+    }
+    return submit_job('documents', params, kb_resource(bot), documents=len(uploaded_files))
 
 @app.route('/api/index_all', methods=['POST'])
 def index_all():
@@ -1085,13 +1403,12 @@ def index_all():
     )
     top_k = parse_int(request.form.get('top_k'), current_config.get('top_k', 4))
 
-    uploaded_files_raw = request.files.getlist('documents')
-    uploaded_files = []
-    for file in uploaded_files_raw:
-        uploaded_files.append({
-            'filename': file.filename,
-            'content': file.read()
-        })
+    # Spool each upload to disk while hashing it; the job only holds paths.
+    uploaded_files = [
+        spool_upload(file.filename, file.stream, spool_dir=storage['spool_dir'])
+        for file in request.files.getlist('documents')
+        if file.filename
+    ]
 
     new_config = current_config.copy()
     new_config.update({
@@ -1110,204 +1427,395 @@ def index_all():
 
     url_prefix = f"/uploads/{bot.slug}" if bot else "/uploads"
 
-    def progress(status_type, message):
-        socketio.emit('index_progress', {
-            'type': status_type,
-            'message': message,
+    params = {
+        'bot_id': bot.id if bot else None,
+        'url': url,
+        'max_pages': max_pages,
+        'chunk_size': chunk_size,
+        'chunk_overlap': chunk_overlap,
+        'similarity_threshold': similarity_threshold,
+        'top_k': top_k,
+        'url_prefix': url_prefix,
+        'uploads': [upload._asdict() for upload in uploaded_files],
+    }
+    return submit_job('index_all', params, kb_resource(bot))
+
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Recent background jobs for a bot (or the default knowledge base)."""
+    bot_id = request.args.get('bot_id')
+    bot = resolve_bot(bot_id)
+    if bot_id and bot is None:
+        return jsonify({"error": "Bot not found", "jobs": []}), 404
+    limit = request.args.get('limit', 50, type=int)
+    resources = {kb_resource(bot)}
+    if bot:
+        resources.add(bot_resource(bot.id))
+    jobs = [job for job in job_queue.list(limit=limit * 4) if job['resource'] in resources]
+    return jsonify({"jobs": jobs[:limit]})
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued job, or ask a running one to stop at its next progress report."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    state = job_queue.cancel(job_id)
+    return jsonify({"status": state, "job_id": job_id})
+
+
+def crawl_job(job):
+    bot = job_bot(job)
+    storage = get_storage_paths(bot)
+    ensure_storage_dirs(storage)
+    url = job.params['url']
+    crawl_progress = job_progress(job, 'crawl_progress', bot)
+    try:
+        socketio.emit('crawl_status', {
+            'status': 'started',
+            'message': f'Starting crawl of {url}...',
             'bot_id': bot.id if bot else None
         })
+        result = crawl_site(
+            url,
+            job.params['max_pages'],
+            progress_callback=crawl_progress,
+            output_dir=storage['raw_dir']
+        )
+        socketio.emit('crawl_status', {
+            'status': 'completed',
+            'result': result,
+            'bot_id': bot.id if bot else None
+        })
+        return {'pages': result.get('pages')}
+    except Exception as e:
+        socketio.emit('crawl_status', {
+            'status': 'error',
+            'message': str(e),
+            'bot_id': bot.id if bot else None
+        })
+        raise
 
-    def combined_task():
-        try:
-            profile_generated = False
-            profile_data = {}
-            detection_result = {}
-            progress('info', 'Clearing previous knowledge base...')
-            for path in (storage['raw_dir'], storage['index_dir'], storage['uploads_dir']):
-                if os.path.exists(path):
-                    shutil.rmtree(path)
-                os.makedirs(path, exist_ok=True)
-            if os.path.exists(storage['profile_path']):
-                try:
-                    os.remove(storage['profile_path'])
-                except OSError:
-                    pass
-
-            if url:
-                progress('info', f'Learning from website: {url}...')
-                socketio.emit('index_status', {
-                    'status': 'started',
-                    'message': f'Learning from {url}...',
-                    'bot_id': bot.id if bot else None
-                })
-
-                def crawl_progress(status_type, msg):
-                    progress(status_type, msg)
-
-                crawl_result = crawl_site(
-                    url,
-                    max_pages,
-                    progress_callback=crawl_progress,
-                    output_dir=storage['raw_dir']
-                )
-                progress('success', f"✓ Learned from {crawl_result['pages']} pages")
 
-            if uploaded_files:
-                progress('info', f'Processing {len(uploaded_files)} uploaded documents...')
-                processed = process_uploaded_documents(
-                    uploaded_files,
-                    raw_dir=storage['raw_dir'],
-                    upload_dir=storage['uploads_dir'],
-                    url_prefix=url_prefix,
-                )
-                progress('success', f"Processed {len(processed)} documents")
+def reextract_job(job):
+    bot = job_bot(job)
+    storage = get_storage_paths(bot)
+    ensure_storage_dirs(storage)
+    reextract_progress = job_progress(job, 'crawl_progress', bot)
+    try:
+        socketio.emit('crawl_status', {
+            'status': 'started',
+            'message': 'Re-extracting archived pages...',
+            'bot_id': bot.id if bot else None
+        })
+        result = reextract_site(
+            output_dir=storage['raw_dir'],
+            progress_callback=reextract_progress
+        )
+        socketio.emit('crawl_status', {
+            'status': 'completed',
+            'result': result,
+            'bot_id': bot.id if bot else None
+        })
+        return {'pages': result.get('pages')}
+    except Exception as e:
+        socketio.emit('crawl_status', {
+            'status': 'error',
+            'message': str(e),
+            'bot_id': bot.id if bot else None
+        })
+        raise
 
-            knowledge_docs = glob.glob(os.path.join(storage['raw_dir'], "*.json"))
-            if knowledge_docs:
-                try:
-                    profile_data = build_company_profile(
-                        raw_dir=storage['raw_dir'],
-                        output_path=storage['profile_path'],
-                        brand_voice='professional',
-                        progress_callback=progress
-                    )
-                    profile_generated = True
-                    progress('success', f"Profile ready for {profile_data.get('company_name', 'company')}")
-                except Exception as exc:
-                    progress('warning', f"Profile generation skipped: {exc}")
-            else:
-                progress('warning', 'No knowledge documents available for profile generation.')
 
-            progress('info', 'Building knowledge index...')
+def index_job(job):
+    bot = job_bot(job)
+    storage = get_storage_paths(bot)
+    ensure_storage_dirs(storage)
+    index_progress = job_progress(job, 'index_progress', bot)
+    try:
+        socketio.emit('index_status', {
+            'status': 'started',
+            'message': 'Building vector index...',
+            'bot_id': bot.id if bot else None
+        })
+        result = index_kb(
+            job.params['chunk_size'],
+            job.params['chunk_overlap'],
+            progress_callback=index_progress,
+            raw_dir=storage['raw_dir'],
+            index_dir=storage['index_dir'],
+            config_path=storage['config_path'],
+        )
+        get_retrieval(bot)._loaded = False
+        # Indexing retunes similarity_threshold in the bot's config.
+        invalidate_bot_context(bot.id if bot else None)
+        submit_compaction(bot)
+        socketio.emit('index_status', {'status': 'completed', 'result': result, 'bot_id': bot.id if bot else None})
+        return {'total_chunks': result['total_chunks']}
+    except Exception as e:
+        socketio.emit('index_status', {'status': 'error', 'message': str(e), 'bot_id': bot.id if bot else None})
+        raise
+
+
+def discard_job_uploads(params, state):
+    """Spooled uploads outlive interrupted runs and go only once their job is final."""
+    discard_uploads(SpooledUpload(**upload) for upload in params.get('uploads', []))
+
+
+def documents_job(job):
+    bot = job_bot(job)
+    storage = get_storage_paths(bot)
+    ensure_storage_dirs(storage)
+    config = load_config(bot)
+    uploaded_files = [SpooledUpload(**upload) for upload in job.params['uploads']]
+    progress = job_progress(job, 'index_progress', bot)
+    try:
+        require_spooled(uploaded_files)
+        processed = process_uploaded_documents(
+            uploaded_files,
+            raw_dir=storage['raw_dir'],
+            upload_dir=storage['uploads_dir'],
+            url_prefix=job.params['url_prefix'],
+            keep_spooled=True,
+        )
+        with DocumentStore(storage['raw_dir']) as store:
+            documents = [store.get(item['hash']) for item in processed]
+        documents = [document for document in documents if document]
+        result = index_documents(
+            documents,
+            config.get('chunk_size', 900),
+            config.get('chunk_overlap', 150),
+            progress_callback=progress,
+            index_dir=storage['index_dir'],
+        )
+        get_retrieval(bot)._loaded = False
+        submit_compaction(bot)
+        result['documents'] = processed
+        socketio.emit('index_status', {'status': 'completed', 'result': result, 'bot_id': bot.id if bot else None})
+        return {'documents': len(processed)}
+    except Exception as e:
+        socketio.emit('index_status', {'status': 'error', 'message': str(e), 'bot_id': bot.id if bot else None})
+        raise
 
-            def index_progress_cb(status_type, msg):
-                progress(status_type, msg)
 
+def index_all_job(job):
+    """Combined workflow: clear the knowledge base, crawl and process uploads, then index everything."""
+    params = job.params
+    bot = job_bot(job)
+    storage = get_storage_paths(bot)
+    ensure_storage_dirs(storage)
+    url = params['url']
+    max_pages = params['max_pages']
+    chunk_size = params['chunk_size']
+    chunk_overlap = params['chunk_overlap']
+    similarity_threshold = params['similarity_threshold']
+    top_k = params['top_k']
+    url_prefix = params['url_prefix']
+    uploaded_files = [SpooledUpload(**upload) for upload in params['uploads']]
+    progress = job_progress(job, 'index_progress', bot)
+    pipeline = None
+    try:
+        # A resumed run clears uploads/ below, so it must still have every
+        # spooled file; never quietly rebuild without them.
+        require_spooled(uploaded_files)
+        progress('info', 'Clearing previous knowledge base...')
+        for path in (storage['raw_dir'], storage['uploads_dir']):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.makedirs(path, exist_ok=True)
+        # Keep the embedding checkpoint so an interrupted build can resume.
+        clear_directory(storage['index_dir'], keep=(CHECKPOINT_DIR,))
+        if os.path.exists(storage['profile_path']):
+            try:
+                os.remove(storage['profile_path'])
+            except OSError:
+                pass
+
+        # Documents are chunked and embedded as they are saved, while the
+        # crawl and upload processing carry on; the index stage publishes.
+        pipeline = EmbeddingPipeline(
+            storage['index_dir'],
+            chunk_size,
+            chunk_overlap,
+            progress_callback=progress
+        ).start()
+
+        def crawl_stage():
+            progress('info', f'Learning from website: {url}...')
+            socketio.emit('index_status', {
+                'status': 'started',
+                'message': f'Learning from {url}...',
+                'bot_id': bot.id if bot else None
+            })
+            crawl_result = crawl_site(
+                url,
+                max_pages,
+                progress_callback=progress,
+                output_dir=storage['raw_dir'],
+                document_callback=pipeline.add
+            )
+            progress('success', f"✓ Learned from {crawl_result['pages']} pages")
+            return crawl_result
+
+        def uploads_stage():
+            progress('info', f'Processing {len(uploaded_files)} uploaded documents...')
+            processed = process_uploaded_documents(
+                uploaded_files,
+                raw_dir=storage['raw_dir'],
+                upload_dir=storage['uploads_dir'],
+                url_prefix=url_prefix,
+                document_callback=pipeline.add,
+                keep_spooled=True
+            )
+            progress('success', f"Processed {len(processed)} documents")
+            return processed
+
+        def profile_stage():
+            with DocumentStore(storage['raw_dir']) as store:
+                knowledge_docs = len(store)
+            if not knowledge_docs:
+                raise ValueError('No knowledge documents available for profile generation.')
+            profile_data = build_company_profile(
+                raw_dir=storage['raw_dir'],
+                output_path=storage['profile_path'],
+                brand_voice='professional',
+                progress_callback=progress
+            )
+            invalidate_bot_context(bot.id if bot else None)
+            progress('success', f"Profile ready for {profile_data.get('company_name', 'company')}")
+            return profile_data
+
+        def index_stage():
+            progress('info', 'Building knowledge index...')
+            pipeline_result = pipeline.finish()
+            progress(
+                'info',
+                f"Embedded {pipeline_result['embedded_chunks']} chunks from "
+                f"{pipeline_result['documents']} documents while learning"
+            )
             index_result = index_kb(
                 chunk_size,
                 chunk_overlap,
-                progress_callback=index_progress_cb,
+                progress_callback=progress,
                 raw_dir=storage['raw_dir'],
                 index_dir=storage['index_dir'],
                 config_path=storage['config_path'],
             )
+            index_result['pipeline'] = pipeline_result
             get_retrieval(bot)._loaded = False
-            index_result['profile_generated'] = profile_generated
-            if profile_generated:
-                index_result['profile_summary'] = {
-                    'company_name': profile_data.get('company_name'),
-                    'summary': profile_data.get('summary'),
-                    'brand_voice': profile_data.get('brand_voice')
-                }
+            invalidate_bot_context(bot.id if bot else None)
+            submit_compaction(bot)
+            return index_result
+
+        def intents_stage():
+            progress('info', 'Detecting intents from knowledge documents...')
+            from tools.detect_intents import auto_detect_intents
+            from actions import ActionHandler
+            from sqlalchemy.exc import SQLAlchemyError
 
             intents_detected = 0
-            detection_result = {}
-            rasa_summary = {}
-            training_started = False
-            if DB_AVAILABLE:
-                progress('info', 'Detecting intents from indexed knowledge...')
-                from tools.detect_intents import auto_detect_intents
-                from actions import ActionHandler
-                from sqlalchemy.exc import SQLAlchemyError
-
-                with app.app_context():
-                    try:
-                        detection_result = auto_detect_intents(
-                            raw_dir=storage['raw_dir'],
-                            profile_path=storage['profile_path'],
-                            brand_voice='professional'
-                        )
-                    except Exception as e:
-                        progress('warning', f"Intent detection failed: {e}")
-                        detection_result = {'status': 'error', 'error': str(e)}
-
-                    if detection_result.get('status') == 'success':
-                        suggested_intents = detection_result.get('intents', []) or []
-                        if detection_result.get('profile_used'):
-                            progress('info', 'Company profile applied to intent drafting.')
-                        if suggested_intents:
-                            try:
-                                Intent.query.filter_by(auto_detected=True, bot_id=bot.id if bot else None).delete(synchronize_session=False)
-                                db.session.commit()
-                            except SQLAlchemyError as e:
-                                db.session.rollback()
-                                progress('warning', f"Could not clear previous auto intents: {e}")
-
-                            for intent_data in suggested_intents:
-                                name = (intent_data.get('name') or '').strip()
-                                if not name:
-                                    continue
+            with app.app_context():
+                detection_result = auto_detect_intents(
+                    raw_dir=storage['raw_dir'],
+                    profile_path=storage['profile_path'],
+                    brand_voice='professional'
+                )
 
-                                existing_intent = Intent.query.filter_by(name=name, bot_id=bot.id if bot else None).first()
-                                if existing_intent:
-                                    if not existing_intent.auto_detected:
-                                        continue
-                                    db.session.delete(existing_intent)
-                                    db.session.flush()
-
-                                description = intent_data.get('description', '')
-                                notes = intent_data.get('required_context')
-                                if notes:
-                                    description = f"{description}\nNotes: {notes}".strip()
-
-                                patterns = intent_data.get('patterns') or []
-                                if isinstance(patterns, str):
-                                    patterns = [p.strip() for p in patterns.split(',') if p.strip()]
-
-                                examples = intent_data.get('examples') or []
-                                if isinstance(examples, str):
-                                    examples = [line.strip() for line in examples.splitlines() if line.strip()]
-
-                                defaults = ActionHandler.get_default_responses_for_intent(name, description)
-                                canonical_response = (intent_data.get('canonical_response') or '').strip()
-                                source_urls = intent_data.get('source_urls') or []
-                                if isinstance(source_urls, str):
-                                    source_urls = [source_urls]
-                                cleaned_sources = [s for s in source_urls if s]
-
-                                responses = []
-                                action_type = 'static'
-                                if canonical_response:
-                                    response_text = canonical_response
-                                    if cleaned_sources:
-                                        joined_sources = "\n".join(f"- {src}" for src in cleaned_sources)
-                                        response_text = f"{response_text}\n\nSources:\n{joined_sources}"
-                                    responses = [response_text]
-                                else:
-                                    responses = defaults['responses']
-                                    action_type = defaults['action_type']
-
-                                intent = Intent(
-                                    bot_id=bot.id if bot else None,
-                                    name=name,
-                                    description=description,
-                                    patterns=patterns,
-                                    examples=examples,
-                                    auto_detected=True,
-                                    enabled=True,
-                                    action_type=action_type,
-                                    responses=responses
-                                )
-                                db.session.add(intent)
-                                intents_detected += 1
-
-                            try:
-                                db.session.commit()
-                                progress('success', f"✓ Auto-detected {intents_detected} intents")
-                            except SQLAlchemyError as e:
-                                db.session.rollback()
-                                progress('warning', f"Failed to save auto intents: {e}")
-                                intents_detected = 0
-                        else:
-                                progress('warning', 'No intents detected from content.')
-                    elif detection_result.get('error'):
-                        progress('warning', detection_result['error'])
-            else:
-                progress('warning', 'Database unavailable: skipping intent detection.')
-                intents_detected = 0
-                detection_result = {}
+                if detection_result.get('status') == 'success':
+                    suggested_intents = detection_result.get('intents', []) or []
+                    if detection_result.get('profile_used'):
+                        progress('info', 'Company profile applied to intent drafting.')
+                    if suggested_intents:
+                        try:
+                            Intent.query.filter_by(auto_detected=True, bot_id=bot.id if bot else None).delete(synchronize_session=False)
+                            db.session.commit()
+                        except SQLAlchemyError as e:
+                            db.session.rollback()
+                            progress('warning', f"Could not clear previous auto intents: {e}")
+
+                        for intent_data in suggested_intents:
+                            name = (intent_data.get('name') or '').strip()
+                            if not name:
+                                continue
+
+                            existing_intent = Intent.query.filter_by(name=name, bot_id=bot.id if bot else None).first()
+                            if existing_intent:
+                                if not existing_intent.auto_detected:
+                                    continue
+                                db.session.delete(existing_intent)
+                                db.session.flush()
+
+                            description = intent_data.get('description', '')
+                            notes = intent_data.get('required_context')
+                            if notes:
+                                description = f"{description}\nNotes: {notes}".strip()
+
+                            patterns = intent_data.get('patterns') or []
+                            if isinstance(patterns, str):
+                                patterns = [p.strip() for p in patterns.split(',') if p.strip()]
+
+                            examples = intent_data.get('examples') or []
+                            if isinstance(examples, str):
+                                examples = [line.strip() for line in examples.splitlines() if line.strip()]
+
+                            defaults = ActionHandler.get_default_responses_for_intent(name, description)
+                            canonical_response = (intent_data.get('canonical_response') or '').strip()
+                            source_urls = intent_data.get('source_urls') or []
+                            if isinstance(source_urls, str):
+                                source_urls = [source_urls]
+                            cleaned_sources = [s for s in source_urls if s]
+
+                            responses = []
+                            action_type = 'static'
+                            if canonical_response:
+                                response_text = canonical_response
+                                if cleaned_sources:
+                                    joined_sources = "\n".join(f"- {src}" for src in cleaned_sources)
+                                    response_text = f"{response_text}\n\nSources:\n{joined_sources}"
+                                responses = [response_text]
+                            else:
+                                responses = defaults['responses']
+                                action_type = defaults['action_type']
+
+                            intent = Intent(
+                                bot_id=bot.id if bot else None,
+                                name=name,
+                                description=description,
+                                patterns=patterns,
+                                examples=examples,
+                                auto_detected=True,
+                                enabled=True,
+                                action_type=action_type,
+                                responses=responses
+                            )
+                            db.session.add(intent)
+                            intents_detected += 1
 
-            builder_profile = profile_data or {}
+                        try:
+                            db.session.commit()
+                            progress('success', f"✓ Auto-detected {intents_detected} intents")
+                        except SQLAlchemyError as e:
+                            db.session.rollback()
+                            progress('warning', f"Failed to save auto intents: {e}")
+                            intents_detected = 0
+                    else:
+                            progress('warning', 'No intents detected from content.')
+                elif detection_result.get('error'):
+                    progress('warning', detection_result['error'])
+            return {'intents_detected': intents_detected, 'detection_result': detection_result}
+
+        def rasa_stage():
+            builder_profile = graph.value('profile') or {}
             if not builder_profile and os.path.exists(storage['profile_path']):
                 try:
                     with open(storage['profile_path'], 'r', encoding='utf-8') as pf:
@@ -1316,76 +1824,124 @@ def index_all():
                     progress('warning', f"Could not load profile for Rasa assets: {exc}")
                     builder_profile = {}
 
-            auto_train_enabled = os.environ.get('INDEX_AUTO_TRAIN', '0').lower() in ('1', 'true', 'yes')
+            with app.app_context():
+                intent_records = Intent.query.filter_by(bot_id=bot.id, enabled=True).all()
+                project_abs = ensure_absolute_project_path(bot.project_path)
+                from tools.rasa_builder import build_rasa_assets
+                rasa_summary = build_rasa_assets(
+                    project_path=project_abs,
+                    intents=intent_records,
+                    profile=builder_profile,
+                    similarity_threshold=similarity_threshold,
+                    top_k=top_k,
+                )
+            progress('success', f"Rasa assets updated ({rasa_summary.get('knowledge_intents', 0)} knowledge intents).")
+            return rasa_summary
 
-            if bot and DB_AVAILABLE:
+        def train_stage():
+            with app.app_context():
                 try:
-                    with app.app_context():
-                        intent_records = Intent.query.filter_by(bot_id=bot.id, enabled=True).all()
-                        project_abs = ensure_absolute_project_path(bot.project_path)
-                        from tools.rasa_builder import build_rasa_assets
-                        rasa_summary = build_rasa_assets(
-                            project_path=project_abs,
-                            intents=intent_records,
-                            profile=builder_profile,
-                            similarity_threshold=similarity_threshold,
-                            top_k=top_k,
-                        )
-                    progress('success', f"Rasa assets updated ({rasa_summary.get('knowledge_intents', 0)} knowledge intents).")
-                except Exception as exc:
-                    rasa_summary = {'error': str(exc)}
-                    progress('warning', f"Failed to build Rasa assets: {exc}")
-
-                if auto_train_enabled and rasa_summary and not rasa_summary.get('error'):
-                    with app.app_context():
-                        try:
-                            bot_entry = Bot.query.get(bot.id)
-                            if bot_entry:
-                                app.logger.info("Starting training for bot %s", bot_entry.id)
-                                bot_entry.status = BOT_STATUS_TRAINING
-                                bot_entry.last_error = ''
-                                bot_entry.updated_at = datetime.utcnow()
-                                db.session.commit()
-                                emit_bot_update(bot_entry)
-                                train_bot_project(bot_entry.id, bot_entry.project_path)
-                                training_started = True
-                                progress('info', 'Training Rasa model completed.')
-                            else:
-                                progress('warning', 'Bot record missing; skipping training trigger.')
-                        except Exception as exc:
-                            training_started = False
-                            db.session.rollback()
-                            progress('warning', f"Failed to start Rasa training: {exc}")
-                elif not auto_train_enabled:
-                    app.logger.info("Skipping automatic training for bot %s (INDEX_AUTO_TRAIN disabled)", bot.id)
-
-            index_result['intents_detected'] = intents_detected
-            index_result['profile_used_for_intents'] = bool(detection_result.get('profile_used')) if isinstance(detection_result, dict) else False
-            index_result['rasa_assets'] = rasa_summary
-            index_result['rasa_training_started'] = training_started
-            index_result['bot_id'] = bot.id if bot else None
-            progress('success', f"✓ Knowledge base ready! {index_result['total_chunks']} chunks indexed")
-            socketio.emit('index_status', {
-                'status': 'completed',
-                'result': index_result,
-                'bot_id': bot.id if bot else None
-            })
+                    bot_entry = Bot.query.get(bot.id)
+                    if not bot_entry:
+                        progress('warning', 'Bot record missing; skipping training trigger.')
+                        return False
+                    app.logger.info("Queueing training for bot %s", bot_entry.id)
+                    bot_entry.status = BOT_STATUS_TRAINING
+                    bot_entry.last_error = ''
+                    bot_entry.updated_at = datetime.utcnow()
+                    db.session.commit()
+                    emit_bot_update(bot_entry)
+                    # Training goes through the train job so it holds the bot's
+                    # resource; this job only holds the knowledge base's.
+                    train_job_id, _ = job_queue.submit(
+                        'train',
+                        {'bot_id': bot_entry.id, 'project_path': bot_entry.project_path, 'include_conversations': True},
+                        bot_resource(bot_entry.id)
+                    )
+                    progress('info', f'Rasa training queued as job {train_job_id}.')
+                    return {'job_id': train_job_id}
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+        # Stages start as soon as what they need is done: the profile LLM
+        # call and intent detection run alongside embedding.
+        graph = StageGraph(progress_callback=progress, abort_on=(JobCancelled,))
+        sources = []
+        if url:
+            graph.add('crawl', crawl_stage)
+            sources.append('crawl')
+        if uploaded_files:
+            graph.add('uploads', uploads_stage)
+            sources.append('uploads')
+        graph.add('profile', profile_stage, requires=sources, retries=1, optional=True)
+        graph.add('index', index_stage, requires=sources, retries=1)
+        if DB_AVAILABLE:
+            graph.add('intents', intents_stage, requires=sources + ['profile'], retries=1, optional=True)
+        else:
+            progress('warning', 'Database unavailable: skipping intent detection.')
+        auto_train_enabled = os.environ.get('INDEX_AUTO_TRAIN', '0').lower() in ('1', 'true', 'yes')
+        if bot and DB_AVAILABLE:
+            graph.add('rasa', rasa_stage, requires=['profile', 'intents'], optional=True)
+            if auto_train_enabled:
+                graph.add('train', train_stage, requires=['rasa'], optional=True)
+            else:
+                app.logger.info("Skipping automatic training for bot %s (INDEX_AUTO_TRAIN disabled)", bot.id)
+        results = graph.run()
+
+        failed_stages = graph.failures()
+        if 'index' in failed_stages:
+            raise graph.error('index') or RuntimeError('Index stage did not run')
+
+        index_result = graph.value('index')
+        profile_data = graph.value('profile')
+        index_result['profile_generated'] = bool(profile_data)
+        if profile_data:
+            index_result['profile_summary'] = {
+                'company_name': profile_data.get('company_name'),
+                'summary': profile_data.get('summary'),
+                'brand_voice': profile_data.get('brand_voice')
+            }
+        intents_result = graph.value('intents', {})
+        detection_result = intents_result.get('detection_result') or {}
+        rasa_summary = graph.value('rasa', {})
+        if 'rasa' in results and results['rasa'].error:
+            rasa_summary = {'error': str(results['rasa'].error)}
+        index_result['intents_detected'] = intents_result.get('intents_detected', 0)
+        index_result['profile_used_for_intents'] = bool(detection_result.get('profile_used')) if isinstance(detection_result, dict) else False
+        index_result['rasa_assets'] = rasa_summary
+        index_result['rasa_training_started'] = bool(graph.value('train'))
+        index_result['training_job_id'] = (graph.value('train') or {}).get('job_id')
+        index_result['bot_id'] = bot.id if bot else None
+        index_result['stages'] = graph.report()
+        if failed_stages:
+            progress('warning', f"Completed with {len(failed_stages)} stage(s) not done: {', '.join(failed_stages)}")
+        progress('success', f"✓ Knowledge base ready! {index_result['total_chunks']} chunks indexed")
+        socketio.emit('index_status', {
+            'status': 'completed',
+            'result': index_result,
+            'bot_id': bot.id if bot else None
+        })
+        return {'total_chunks': index_result['total_chunks'], 'stages': index_result['stages']}
 
-        except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            app.logger.error("Indexing error: %s", error_details)
-            progress('error', str(e))
-            socketio.emit('index_status', {
-                'status': 'error',
-                'message': str(e),
-                'bot_id': bot.id if bot else None
-            })
+    except Exception as e:
+        if pipeline is not None:
+            pipeline.finish()
+        import traceback
+        error_details = traceback.format_exc()
+        app.logger.error("Indexing error: %s", error_details)
+        progress('error', str(e))
+        socketio.emit('index_status', {
+            'status': 'error',
+            'message': str(e),
+            'bot_id': bot.id if bot else None
+        })
+        raise
 
-    thread = threading.Thread(target=combined_task, daemon=True)
-    thread.start()
 
-    return jsonify({"status": "started"})
+def compact_job(job):
+    bot = job_bot(job)
+    compact_index(bot, get_storage_paths(bot)['index_dir'])
 
 
 @app.route('/api/conversations', methods=['GET'])
@@ -1399,6 +1955,7 @@ def get_conversations():
         return jsonify({"error": "Bot not found", "conversations": []}), 404
 
     try:
+        conversation_log.flush()
         query = Conversation.query.order_by(Conversation.timestamp.desc())
         if bot:
             query = query.filter(Conversation.bot_id == bot.id)
@@ -1418,6 +1975,8 @@ def add_feedback(conv_id):
     feedback = data.get('feedback', '')
     
     try:
+        # The row may still be waiting in the write-behind log.
+        conversation_log.flush()
         conversation = Conversation.query.get(conv_id)
         if conversation:
             conversation.feedback = feedback
@@ -1441,6 +2000,8 @@ def delete_conversation(conv_id):
         return jsonify({"status": "error", "message": "Bot not found"}), 404
 
     try:
+        # The row may still be waiting in the write-behind log.
+        conversation_log.flush()
         conversation = Conversation.query.get(conv_id)
         if not conversation:
             return jsonify({"status": "error", "message": "Conversation not found"}), 404
@@ -1465,6 +2026,7 @@ def clear_conversations():
         return jsonify({"status": "error", "message": "Bot not found"}), 404
 
     try:
+        conversation_log.flush()
         query = db.session.query(Conversation)
         if bot:
             query = query.filter(Conversation.bot_id == bot.id)
@@ -1492,6 +2054,7 @@ def clear_bot():
         # Clear database data if database is available
         if DB_AVAILABLE:
             try:
+                conversation_log.flush()
                 query_conv = db.session.query(Conversation)
                 query_intents = db.session.query(Intent)
                 if bot:
@@ -1580,7 +2143,7 @@ def manage_bots():
     save_config(DEFAULT_CONFIG.copy(), bot)
 
     emit_bot_update(bot)
-    run_background_task(initialize_bot_project, bot.id, project_path)
+    job_queue.submit('init_bot', {'bot_id': bot.id, 'project_path': project_path}, bot_resource(bot.id))
 
     return jsonify(bot.to_dict()), 202
 
@@ -1612,9 +2175,13 @@ def train_bot(bot_id):
         return jsonify({"error": f"Failed to update bot: {err}"}), 500
 
     emit_bot_update(bot)
-    run_background_task(train_bot_project, bot.id, bot.project_path, include_conversations)
+    job_id, _ = job_queue.submit(
+        'train',
+        {'bot_id': bot.id, 'project_path': bot.project_path, 'include_conversations': include_conversations},
+        bot_resource(bot.id)
+    )
 
-    return jsonify({"status": "started", "bot": bot.to_dict()}), 202
+    return jsonify({"status": "started", "job_id": job_id, "bot": bot.to_dict()}), 202
 
 
 @app.route('/api/bots/<int:bot_id>/restart-service', methods=['POST'])
@@ -1675,6 +2242,7 @@ def delete_bot(bot_id):
         return jsonify({"error": f"Failed to remove bot assets: {exc}"}), 500
 
     try:
+        conversation_log.flush()
         Conversation.query.filter_by(bot_id=bot.id).delete(synchronize_session=False)
         Intent.query.filter_by(bot_id=bot.id).delete(synchronize_session=False)
         db.session.delete(bot)
@@ -1689,20 +2257,12 @@ def delete_bot(bot_id):
     socketio.emit('bot_update', {'id': bot_id, 'deleted': True})
     return jsonify({"status": "deleted", "bot_id": bot_id}), 200
 
-def retrieval_fallback_response(bot, query):
+def retrieval_fallback_response(context, query):
     """Return a retrieval-based answer, enriched with company/contact info."""
-    retrieval_engine = get_retrieval(bot)
+    retrieval_engine = get_retrieval(context['bot'])
     retrieval_result = retrieval_engine.get_answer(query)
-    profile = load_profile_data(bot)
-    config = load_config(bot)
-    company_name = profile.get('company_name') or get_company_name_from_url(config.get('url'))
-    contact = profile.get('contact') or {}
-    contact_lines = []
-    for key in ('phone', 'email', 'website', 'address'):
-        value = contact.get(key)
-        if value:
-            contact_lines.append(f"{key.title()}: {value}")
-    contact_block = "\n".join(contact_lines)
+    company_name = context['company_name']
+    contact_block = context['contact_block']
 
     answer_text = retrieval_result.get('answer') or ''
     if not answer_text or "couldn't find anything relevant" in answer_text.lower():
@@ -1727,12 +2287,11 @@ def handle_chat_message(data):
         return
 
     bot_id = data.get('bot_id')
-    active_bot = None
     result = None
     rasa_used = False
 
-    if bot_id and DB_AVAILABLE:
-        active_bot = Bot.query.get(bot_id)
+    context = get_bot_context(bot_id) if bot_id else None
+    active_bot = context['bot'] if context else None
 
     if active_bot is None:
         emit('chat_response', {
@@ -1744,7 +2303,9 @@ def handle_chat_message(data):
 
     if active_bot.status == BOT_STATUS_READY:
         sender_id = data.get('sender_id') or getattr(request, 'sid', None) or f"socket-{bot_id}"
-        rasa_payload = run_rasa_turn(active_bot, query, sender_id=str(sender_id))
+        # Starting the service may record a new port, so it gets a session-bound copy.
+        rasa_bot = db.session.merge(active_bot, load=False)
+        rasa_payload = run_rasa_turn(rasa_bot, query, sender_id=str(sender_id))
         if rasa_payload.get('status') == 'success':
             responses = rasa_payload.get('responses', []) or []
             text_parts = []
@@ -1767,14 +2328,14 @@ def handle_chat_message(data):
                     'rasa': True,
                 }
             else:
-                result = retrieval_fallback_response(active_bot, query)
+                result = retrieval_fallback_response(context, query)
         else:
             app.logger.warning(
                 "Rasa error for bot %s: %s", active_bot.id, rasa_payload.get('message', 'unknown error')
             )
-            result = retrieval_fallback_response(active_bot, query)
+            result = retrieval_fallback_response(context, query)
     else:
-        result = retrieval_fallback_response(active_bot, query)
+        result = retrieval_fallback_response(context, query)
 
     if rasa_used:
         result.setdefault('rasa', True)
@@ -1784,28 +2345,28 @@ def handle_chat_message(data):
     elapsed = (time.time() - start_time) if start_time else None
     result['response_time'] = elapsed
 
-    # Log conversation to database if available
+    # Queue the conversation for the write-behind log if the database is available
     if DB_AVAILABLE:
-        try:
-            conversation = Conversation(
-                bot_id=active_bot.id,
-                question=query,
-                answer=result.get('answer', ''),
-                sources=result.get('sources', []),
-                similarity_scores=result.get('similarity_scores', []),
-                intent=result.get('intent'),
-                intent_confidence=result.get('confidence'),
-                intent_ranking=result.get('intent_ranking'),
-                rasa_used=bool(result.get('rasa')),
-                response_time=elapsed
-            )
-            db.session.add(conversation)
-            db.session.commit()
-            result['conversation_id'] = conversation.id
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error logging conversation: {e}")
-    
+        conversation_id = next_conversation_id()
+        queued = conversation_log.put({
+            'id': conversation_id,
+            'bot_id': active_bot.id,
+            'question': query,
+            'answer': result.get('answer', ''),
+            'sources': result.get('sources', []),
+            'similarity_scores': result.get('similarity_scores', []),
+            'intent': result.get('intent'),
+            'intent_confidence': result.get('confidence'),
+            'intent_ranking': result.get('intent_ranking'),
+            'rasa_used': bool(result.get('rasa')),
+            'response_time': elapsed,
+            'timestamp': datetime.utcnow()
+        }, timeout=CONVERSATION_LOG_PUT_TIMEOUT)
+        if queued:
+            result['conversation_id'] = conversation_id
+        else:
+            app.logger.warning("Conversation log is full; not logging conversation %s", conversation_id)
+
     emit('chat_response', result)
 
 @app.route('/api/auto-detect-intents', methods=['POST'])
@@ -2042,6 +2603,7 @@ def export_training_data():
 
     try:
         intent_query = Intent.query.filter_by(enabled=True)
+        conversation_log.flush()
         convo_query = Conversation.query
         if bot:
             intent_query = intent_query.filter(Intent.bot_id == bot.id)
@@ -2087,5 +2649,37 @@ def export_training_data():
 def handle_connect():
     emit('connected', {'data': 'Connected to chatbot'})
 
+def train_job(job):
+    params = job.params
+    # In the external worker the service is started by the web process (see watch_worker_jobs).
+    if train_bot_project(
+        params['bot_id'], params['project_path'], params['include_conversations'], start_service=not IS_JOB_WORKER
+    ):
+        return {'start_service': params['bot_id']}
+    return None
+
+
+def init_bot_job(job):
+    if initialize_bot_project(job.params['bot_id'], job.params['project_path'], start_service=not IS_JOB_WORKER):
+        return {'start_service': job.params['bot_id']}
+    return None
+
+
+def in_app_context(handler):
+    def run(job):
+        with app.app_context():
+            return handler(job)
+    return run
+
+
+job_queue.register('crawl', in_app_context(crawl_job), limit=2)
+job_queue.register('reextract', in_app_context(reextract_job), limit=1)
+job_queue.register('index', in_app_context(index_job), limit=2)
+job_queue.register('documents', in_app_context(documents_job), limit=2, coalesce=False, on_finish=discard_job_uploads)
+job_queue.register('index_all', in_app_context(index_all_job), limit=1, coalesce=False, on_finish=discard_job_uploads)
+job_queue.register('compact', in_app_context(compact_job), limit=1)
+job_queue.register('train', train_job, limit=1)
+job_queue.register('init_bot', init_bot_job, limit=2)
+
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
@@ -104,3 +104,10 @@ class Bot(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
+
+class IdBlock(db.Model):
+    """Next id not yet handed out for a table whose ids are assigned before the row is inserted."""
+    __tablename__ = 'id_blocks'
+
+    name = db.Column(db.String(64), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
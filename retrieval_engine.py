@@ -1,7 +1,9 @@
-import os, json
+import os
 from typing import List, Dict, Tuple
 import numpy as np
 from openai import OpenAI
+from tools.index_segments import has_index, load_segments
+from tools.hub import offload
 
 class RetrievalEngine:
     def __init__(self, index_dir="kb/index", similarity_threshold=0.45, top_k=4):
@@ -9,8 +11,7 @@ class RetrievalEngine:
         self.similarity_threshold = similarity_threshold
         self.top_k = top_k
         self._loaded = False
-        self.embeddings = None
-        self.meta = None
+        self.segments = []
         self.client = None
 
     def load(self):
@@ -18,15 +19,28 @@ class RetrievalEngine:
         if self._loaded:
             return
         
-        if not os.path.exists(os.path.join(self.index_dir, "embeddings.npy")):
+        if not os.path.isdir(self.index_dir) or not has_index(self.index_dir):
             raise FileNotFoundError("No index found. Please crawl and index a website first.")
         
-        self.embeddings = np.load(os.path.join(self.index_dir, "embeddings.npy"))
-        with open(os.path.join(self.index_dir, "meta.json"), "r", encoding="utf-8") as f:
-            self.meta = json.load(f)
+        self.segments = offload(self._live_segments, load_segments(self.index_dir))
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self._loaded = True
 
+    @staticmethod
+    def _live_segments(segments: List[Dict]) -> List[Dict]:
+        """Keep only live rows of each segment so searches never see tombstoned chunks."""
+        live_segments = []
+        for segment in segments:
+            live_rows = np.flatnonzero(segment["live"])
+            if not live_rows.size:
+                continue
+            live_segments.append({
+                "name": segment["name"],
+                "embeddings": np.asarray(segment["embeddings"][live_rows], dtype="float32"),
+                "meta": [segment["metadata"][row] for row in live_rows]
+            })
+        return live_segments
+
     def cosine_similarity(self, query_vec, doc_vecs):
         """Calculate cosine similarity between query and document vectors"""
         query_norm = query_vec / (np.linalg.norm(query_vec) + 1e-10)
@@ -43,17 +57,20 @@ class RetrievalEngine:
             input=[query]
         )
         query_vec = np.array(response.data[0].embedding, dtype="float32")
-        
-        similarities = self.cosine_similarity(query_vec, self.embeddings)
-        
-        top_indices = np.argsort(similarities)[::-1][:self.top_k]
-        
+        # Scoring is CPU-bound; the embedding request above stays on the hub.
+        return offload(self._rank, query_vec, self.segments, self.top_k)
+
+    def _rank(self, query_vec, segments: List[Dict], top_k: int) -> List[Tuple[float, Dict]]:
+        """Score each segment independently and merge the per-segment top-k."""
         results = []
-        for idx in top_indices:
-            score = float(similarities[idx])
-            results.append((score, self.meta[idx]))
-        
-        return results
+        for segment in segments:
+            similarities = self.cosine_similarity(query_vec, segment["embeddings"])
+            top_indices = np.argsort(similarities)[::-1][:top_k]
+            for idx in top_indices:
+                results.append((float(similarities[idx]), segment["meta"][idx]))
+
+        results.sort(key=lambda hit: hit[0], reverse=True)
+        return results[:top_k]
 
     def format_answer(self, hits: List[Tuple[float, Dict]]) -> str:
         """Format search results into a coherent answer with sources"""
@@ -114,7 +131,8 @@ class RetrievalEngine:
         try:
             self.load()
             return {
-                "total_chunks": len(self.meta),
+                "total_chunks": sum(len(segment["meta"]) for segment in self.segments),
+                "segments": len(self.segments),
                 "indexed": True,
                 "similarity_threshold": self.similarity_threshold,
                 "top_k": self.top_k
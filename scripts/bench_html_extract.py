@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Compare per-page CPU time of the old multi-parse extraction with the single lxml pass."""
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trafilatura
+from bs4 import BeautifulSoup
+
+from tools.html_extract import extract_page, normalize_url, normalize_whitespace
+
+
+def legacy_extract(html, url):
+    """The previous crawl_site extraction: a BeautifulSoup tree plus trafilatura's own parse."""
+    soup = BeautifulSoup(html, 'html.parser')
+    canonical = url
+    link = soup.find('link', {'rel': 'canonical'})
+    if link and link.get('href'):
+        canonical = urllib.parse.urljoin(url, link['href']).strip() or url
+
+    text = trafilatura.extract(html, url=canonical, output_format='txt', include_links=False) or ''
+    if text.strip():
+        text = normalize_whitespace(text)
+    else:
+        fallback = BeautifulSoup(html, 'html.parser')
+        for node in fallback(['script', 'style', 'noscript']):
+            node.decompose()
+        text = normalize_whitespace(fallback.get_text(' ', strip=True))
+
+    title = soup.title.get_text(strip=True) if soup.title else ''
+    meta_description = ''
+    meta = soup.find('meta', attrs={'name': 'description'})
+    if meta and meta.get('content'):
+        meta_description = normalize_whitespace(meta['content'])
+
+    headings = {'h1': [], 'h2': [], 'h3': []}
+    for level in headings:
+        for node in soup.find_all(level):
+            heading = normalize_whitespace(node.get_text(' ', strip=True))
+            if heading:
+                headings[level].append(heading)
+
+    links = []
+    for anchor in soup.find_all('a', href=True):
+        normalized = normalize_url(anchor['href'], canonical)
+        if normalized:
+            links.append(normalized)
+
+    return {
+        'canonical': canonical,
+        'title': title,
+        'meta_description': meta_description,
+        'headings': headings,
+        'links': links,
+        'text': text,
+    }
+
+
+def time_pages(extract, pages, repeat):
+    per_page = []
+    for url, html in pages:
+        best = None
+        for _ in range(repeat):
+            started = time.process_time()
+            extract(html, url)
+            elapsed = time.process_time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        per_page.append(best)
+    return per_page
+
+
+def load_corpus(corpus_dir, base_url):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '**', '*.htm*'), recursive=True)):
+        with open(path, 'r', encoding='utf-8', errors='replace') as handle:
+            html = handle.read()
+        relative = os.path.relpath(path, corpus_dir).replace(os.sep, '/')
+        pages.append((urllib.parse.urljoin(base_url, relative), html))
+    return pages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('corpus', help='Directory of saved .html pages')
+    parser.add_argument('--base-url', default='https://example.com/', help='URL the pages are resolved against')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per page; the fastest is kept')
+    args = parser.parse_args(argv)
+
+    pages = load_corpus(args.corpus, args.base_url)
+    if not pages:
+        parser.error(f'No .html files found in {args.corpus}')
+
+    mismatches = []
+    for url, html in pages:
+        old, new = legacy_extract(html, url), extract_page(html, url)
+        differing = [key for key in old if old[key] != new[key]]
+        if differing:
+            mismatches.append((url, differing))
+
+    legacy = time_pages(legacy_extract, pages, args.repeat)
+    single = time_pages(extract_page, pages, args.repeat)
+
+    def describe(label, samples):
+        return (
+            f'{label:<12} total {sum(samples):8.3f}s  '
+            f'mean {statistics.mean(samples) * 1000:7.2f}ms  '
+            f'median {statistics.median(samples) * 1000:7.2f}ms'
+        )
+
+    print(f'{len(pages)} pages, best of {args.repeat} runs each (CPU time)')
+    print(describe('multi-parse', legacy))
+    print(describe('single-pass', single))
+    if sum(single):
+        print(f'speed-up     {sum(legacy) / sum(single):.2f}x')
+    print(f'{len(pages) - len(mismatches)}/{len(pages)} pages produce identical fields')
+    for url, differing in mismatches[:10]:
+        print(f'  {url}: {", ".join(differing)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""Run IntelliBot's background jobs (crawl, index, training) outside the web process.
+
+Start the web app with JOB_WORKER_MODE=external so it only queues jobs, then run
+one or more of these workers against the same jobs database. Set
+SOCKETIO_MESSAGE_QUEUE in both so progress events still reach the browser.
+Rasa services stay with the web process: a worker that trains a bot only
+reports it in the job result, and the web process starts the service. Likewise
+the web process reloads a bot's retrieval engine once an index job finishes.
+"""
+
+import os
+import signal
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['INTELLIBOT_JOB_WORKER'] = '1'
+
+import app as intellibot
+
+
+def main():
+    signal.signal(signal.SIGTERM, lambda *_: intellibot.job_queue.stop())
+    intellibot.database_ready.wait()
+    print(f'Job worker {intellibot.job_queue.owner} running jobs from {intellibot.JOBS_PATH}')
+    try:
+        intellibot.job_queue.run_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import math
+import hashlib
+from typing import List, Dict, Any, Tuple
+from tools.doc_store import DocumentRef, read_documents
+
+
+# Kept free of heavy imports: this module is loaded by every chunking worker process.
+
+
+def split_paragraphs(text: str) -> List[str]:
+  blocks = []
+  current = []
+  for line in text.splitlines():
+    stripped = line.strip()
+    if not stripped:
+      if current:
+        blocks.append(" ".join(current))
+        current = []
+      continue
+    current.append(stripped)
+  if current:
+    blocks.append(" ".join(current))
+  return blocks
+
+
+def chunk_document(
+  doc: Dict[str, Any],
+  target_size: int,
+  overlap: int
+) -> List[Dict[str, Any]]:
+  paragraphs = split_paragraphs(doc.get("text", ""))
+  if not paragraphs:
+    return []
+
+  max_size = max(target_size, 300)
+  overlap = min(overlap, max_size // 2)
+  chunks = []
+  buffer: List[str] = []
+  current_len = 0
+
+  for para in paragraphs:
+    para_len = len(para)
+    if current_len + para_len > max_size and buffer:
+      chunk_text = " ".join(buffer).strip()
+      if chunk_text:
+        chunks.append(chunk_text)
+      if overlap > 0 and buffer:
+        overlap_text = " ".join(buffer)[-overlap:]
+        buffer = [overlap_text, para]
+        current_len = len(overlap_text) + para_len
+      else:
+        buffer = [para]
+        current_len = para_len
+      continue
+    buffer.append(para)
+    current_len += para_len
+
+  final = " ".join(buffer).strip()
+  if final:
+    chunks.append(final)
+
+  structured = []
+  headings = doc.get("headings") or {}
+  primary_heading = ""
+  for level in ("h1", "h2", "h3"):
+    items = headings.get(level) or []
+    if items:
+      primary_heading = items[0]
+      break
+
+  doc_hash = doc.get("content_hash") or hashlib.sha1(doc.get("text", "").encode("utf-8")).hexdigest()
+  for idx, chunk_text in enumerate(chunks):
+    chunk_hash = hashlib.sha1(f"{doc_hash}::{idx}::{chunk_text}".encode("utf-8")).hexdigest()
+    structured.append({
+      "doc_hash": doc_hash,
+      "chunk_index": idx,
+      "chunk_hash": chunk_hash,
+      "text": chunk_text,
+      "url": doc.get("url") or doc.get("label") or "",
+      "title": doc.get("title") or primary_heading or doc.get("label") or "Untitled",
+      "source_type": doc.get("source_type") or "unknown",
+      "meta_description": doc.get("meta_description") or "",
+      "headings": headings,
+      "token_estimate": math.ceil(len(chunk_text) / 4),
+      "extracted_at": doc.get("extracted_at"),
+      "content_type": doc.get("content_type"),
+      "status_code": doc.get("status_code", 200)
+    })
+  return structured
+
+
+def load_and_chunk(
+  refs: List[DocumentRef],
+  chunk_size: int,
+  chunk_overlap: int
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+  """Read and chunk a batch of stored documents; runs inside pool workers."""
+  chunks: List[Dict[str, Any]] = []
+  skipped: List[str] = []
+  for ref, doc in read_documents(refs):
+    if doc is None:
+      skipped.append(ref.key)
+      continue
+    chunks.extend(chunk_document(doc, chunk_size, chunk_overlap))
+  return chunks, skipped
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+import os
+import time
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+FRONTIER_NAME = "crawl_frontier.sqlite"
+SCHEMA_VERSION = 3
+
+# Best-first ordering: score = priority + recency - DEPTH_WEIGHT * depth.
+DEFAULT_PRIORITY = 0.5
+DEPTH_WEIGHT = 0.1
+RECENCY_WEIGHT = 0.5
+RECENCY_HALF_LIFE_DAYS = 180.0
+
+QUEUED = "queued"
+IN_PROGRESS = "in_progress"
+STORED = "stored"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def default_frontier_path(output_dir: str) -> str:
+  return os.path.join(os.path.dirname(os.path.abspath(output_dir)), FRONTIER_NAME)
+
+
+def frontier_score(depth: int, priority: Optional[float] = None, lastmod: Optional[float] = None) -> float:
+  """
+  Rank a URL: sitemap ``priority`` (0-1, default 0.5), plus up to 0.5 for a
+  recent ``lastmod`` (halving every 180 days), minus 0.1 per link hop.
+  """
+  score = DEFAULT_PRIORITY if priority is None else min(1.0, max(0.0, priority))
+  if lastmod is not None:
+    age_days = max(0.0, (time.time() - lastmod) / 86400.0)
+    score += RECENCY_WEIGHT * 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+  return score - DEPTH_WEIGHT * depth
+
+
+class CrawlFrontier:
+  """
+  On-disk crawl frontier. Every URL the crawl has discovered is one row with its
+  state, so de-duplication happens when a URL is enqueued rather than when it is
+  popped, memory stays flat however large the site is, and an interrupted crawl
+  of the same start URL picks up where it stopped. Queued URLs are popped
+  best-first by ``frontier_score``, so a ``max_pages`` cap keeps the pages that
+  matter most.
+
+  States: ``queued`` -> ``in_progress`` -> ``stored`` (saved or confirmed
+  unchanged), ``done`` (visited, nothing stored), ``skipped`` or ``failed``.
+  """
+
+  def __init__(self, path: str, start_url: str, resume: bool = True):
+    self.path = path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    self.conn = sqlite3.connect(path)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+      # The frontier only matters mid-crawl; an older layout is simply dropped.
+      self.conn.executescript(
+        "DROP TABLE IF EXISTS frontier; DROP TABLE IF EXISTS crawl; "
+        "DROP TABLE IF EXISTS fingerprints; DROP TABLE IF EXISTS duplicates;"
+      )
+      self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    self.conn.executescript(
+      """
+      CREATE TABLE IF NOT EXISTS frontier (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        url TEXT NOT NULL UNIQUE,
+        state TEXT NOT NULL,
+        depth INTEGER NOT NULL DEFAULT 0,
+        priority REAL,
+        lastmod REAL,
+        score REAL NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS frontier_next ON frontier (state, score DESC, seq);
+      CREATE TABLE IF NOT EXISTS crawl (key TEXT PRIMARY KEY, value TEXT);
+      CREATE TABLE IF NOT EXISTS fingerprints (url TEXT PRIMARY KEY, simhash INTEGER NOT NULL);
+      CREATE TABLE IF NOT EXISTS duplicates (
+        url TEXT PRIMARY KEY,
+        duplicate_of TEXT NOT NULL,
+        distance INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        tokens INTEGER NOT NULL
+      );
+      """
+    )
+    self.resumed = resume and self._meta("status") == "running" and self._meta("start_url") == start_url
+    with self.conn:
+      if self.resumed:
+        # Whatever was in flight when the last run died gets fetched again.
+        self.conn.execute(
+          "UPDATE frontier SET state = ?, updated_at = ? WHERE state = ?",
+          (QUEUED, time.time(), IN_PROGRESS)
+        )
+      else:
+        self.conn.execute("DELETE FROM frontier")
+        self.conn.execute("DELETE FROM sqlite_sequence WHERE name = 'frontier'")
+        self.conn.execute("DELETE FROM fingerprints")
+        self.conn.execute("DELETE FROM duplicates")
+      self._set_meta("start_url", start_url)
+      self._set_meta("status", "running")
+
+  def _meta(self, key: str) -> Optional[str]:
+    row = self.conn.execute("SELECT value FROM crawl WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+  def _set_meta(self, key: str, value: str) -> None:
+    self.conn.execute("INSERT OR REPLACE INTO crawl (key, value) VALUES (?, ?)", (key, value))
+
+  def add(self, urls: Iterable[str], depth: int = 0) -> None:
+    """Queue links found ``depth`` hops from the start page."""
+    self.add_entries((url, depth, None, None) for url in urls)
+
+  def add_entries(self, entries: Iterable[Tuple[str, int, Optional[float], Optional[float]]]) -> None:
+    """
+    Queue ``(url, depth, priority, lastmod)`` entries. A URL already known keeps
+    its state; if it is still queued it takes the better score and shallower depth.
+    """
+    now = time.time()
+    rows = (
+      (url, QUEUED, depth, priority, lastmod, frontier_score(depth, priority, lastmod), now)
+      for url, depth, priority, lastmod in entries
+    )
+    with self.conn:
+      self.conn.executemany(
+        "INSERT INTO frontier (url, state, depth, priority, lastmod, score, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(url) DO UPDATE SET "
+        "score = max(score, excluded.score), depth = min(depth, excluded.depth) "
+        "WHERE state = 'queued' AND (excluded.score > score OR excluded.depth < depth)",
+        rows
+      )
+
+  def pop(self, limit: int) -> List[Tuple[str, int]]:
+    """Claim up to ``limit`` queued URLs, best score first, as ``(url, depth)``."""
+    if limit <= 0:
+      return []
+    with self.conn:
+      rows = self.conn.execute(
+        "SELECT seq, url, depth FROM frontier WHERE state = ? ORDER BY score DESC, seq LIMIT ?",
+        (QUEUED, limit)
+      ).fetchall()
+      self.conn.executemany(
+        "UPDATE frontier SET state = ?, updated_at = ? WHERE seq = ?",
+        ((IN_PROGRESS, time.time(), seq) for seq, _, _ in rows)
+      )
+    return [(url, depth) for _, url, depth in rows]
+
+  def state(self, url: str) -> Optional[str]:
+    row = self.conn.execute("SELECT state FROM frontier WHERE url = ?", (url,)).fetchone()
+    return row[0] if row else None
+
+  def mark(self, url: str, state: str) -> None:
+    """Set ``url``'s state, adding it if it was never queued (e.g. a canonical URL)."""
+    with self.conn:
+      self.conn.execute(
+        "INSERT INTO frontier (url, state, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(url) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+        (url, state, time.time())
+      )
+
+  def requeue(self, url: str) -> None:
+    """Put a claimed URL back in the queue, e.g. after the server asked us to slow down."""
+    with self.conn:
+      self.conn.execute(
+        "UPDATE frontier SET state = ?, updated_at = ? WHERE url = ?",
+        (QUEUED, time.time(), url)
+      )
+
+  def add_fingerprint(self, url: str, simhash: int) -> None:
+    """``simhash`` is stored signed; see ``near_duplicates.to_signed``."""
+    with self.conn:
+      self.conn.execute("INSERT OR REPLACE INTO fingerprints (url, simhash) VALUES (?, ?)", (url, simhash))
+
+  def fingerprints(self) -> Iterator[Tuple[str, int]]:
+    yield from self.conn.execute("SELECT url, simhash FROM fingerprints ORDER BY rowid")
+
+  def add_duplicate(self, url: str, duplicate_of: str, distance: int, size: int, tokens: int) -> None:
+    with self.conn:
+      self.conn.execute(
+        "INSERT OR REPLACE INTO duplicates (url, duplicate_of, distance, bytes, tokens) VALUES (?, ?, ?, ?, ?)",
+        (url, duplicate_of, distance, size, tokens)
+      )
+
+  def duplicates(self) -> List[Dict[str, Any]]:
+    rows = self.conn.execute("SELECT url, duplicate_of, distance, bytes, tokens FROM duplicates ORDER BY rowid")
+    return [
+      {"url": url, "duplicate_of": duplicate_of, "distance": distance, "bytes": size, "tokens": tokens}
+      for url, duplicate_of, distance, size, tokens in rows
+    ]
+
+  def count(self, state: str) -> int:
+    return self.conn.execute("SELECT COUNT(*) FROM frontier WHERE state = ?", (state,)).fetchone()[0]
+
+  def finish(self) -> None:
+    """Mark the crawl complete so the next crawl starts a fresh frontier."""
+    with self.conn:
+      self._set_meta("status", "complete")
+
+  def close(self) -> None:
+    self.conn.close()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import os
+import json
+import sqlite3
+import datetime
+from typing import Dict, Any, Optional
+from tools.doc_store import DocumentStore
+
+
+LEDGER_NAME = "crawl_ledger.sqlite"
+LEGACY_LEDGER_NAME = "crawl_ledger.json"
+LEDGER_FIELDS = (
+  "canonical",
+  "etag",
+  "last_modified",
+  "body_hash",
+  "content_hash",
+  "document",
+  "links",
+  "simhash",
+  "fetched_at"
+)
+
+
+def default_ledger_path(output_dir: str) -> str:
+  """The ledger lives next to the raw directory so clearing raw/ does not drop it."""
+  return os.path.join(os.path.dirname(os.path.abspath(output_dir)), LEDGER_NAME)
+
+
+class CrawlLedger:
+  """
+  Per-URL record of the last successful fetch: validators (ETag, Last-Modified),
+  the extracted ``content_hash``, the key of the stored document, and the page's links.
+
+  A re-crawl uses it to send conditional requests and to recognise pages whose
+  text has not changed, so those are neither re-extracted nor re-written. Rows
+  live in SQLite and are read on demand, so large sites do not grow memory.
+  """
+
+  def __init__(self, path: str, store: DocumentStore):
+    self.path = path
+    self.store = store
+    self._dirty = 0
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    self.conn = sqlite3.connect(path)
+    self.conn.row_factory = sqlite3.Row
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    columns = ", ".join(f"{field} TEXT" for field in LEDGER_FIELDS)
+    self.conn.executescript(
+      f"""
+      CREATE TABLE IF NOT EXISTS ledger (url TEXT PRIMARY KEY, {columns});
+      CREATE INDEX IF NOT EXISTS ledger_document ON ledger (document);
+      """
+    )
+    existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(ledger)")}
+    for field in LEDGER_FIELDS:
+      if field not in existing:
+        self.conn.execute(f"ALTER TABLE ledger ADD COLUMN {field} TEXT")
+    self._import_legacy()
+
+  def _import_legacy(self) -> None:
+    legacy_path = os.path.join(os.path.dirname(self.path), LEGACY_LEDGER_NAME)
+    if not os.path.exists(legacy_path):
+      return
+    try:
+      with open(legacy_path, "r", encoding="utf-8") as handle:
+        entries = json.load(handle).get("urls", {})
+    except (OSError, ValueError):
+      entries = {}
+    for url, entry in entries.items():
+      self._write(url, entry)
+    self.conn.commit()
+    os.remove(legacy_path)
+
+  def _document_exists(self, entry: Dict[str, Any]) -> bool:
+    document = entry.get("document")
+    return bool(document) and document in self.store
+
+  def _row(self, url: str) -> Optional[Dict[str, Any]]:
+    row = self.conn.execute("SELECT * FROM ledger WHERE url = ?", (url,)).fetchone()
+    if row is None:
+      return None
+    entry = {key: row[key] for key in LEDGER_FIELDS if row[key] is not None}
+    entry["links"] = json.loads(entry["links"]) if entry.get("links") else []
+    if entry.get("document", "").endswith(".json"):
+      # Recorded as a file name before documents moved into the store.
+      entry["document"] = entry["document"][:-len(".json")]
+    return entry
+
+  def get(self, url: str) -> Optional[Dict[str, Any]]:
+    """Return the entry for ``url`` only if its stored document is still on disk."""
+    entry = self._row(url)
+    if entry and self._document_exists(entry):
+      return entry
+    return None
+
+  def is_unchanged(self, url: str, content_hash: str) -> bool:
+    entry = self.get(url)
+    return bool(entry) and entry.get("content_hash") == content_hash
+
+  def replace_document(self, url: str, document: str) -> None:
+    """Remove the document previously stored for ``url`` if it changed and nothing else uses it."""
+    entry = self._row(url)
+    old = entry.get("document") if entry else None
+    if not old or old == document:
+      return
+    shared = self.conn.execute(
+      "SELECT 1 FROM ledger WHERE document IN (?, ?) AND url != ? LIMIT 1",
+      (old, f"{old}.json", url)
+    ).fetchone()
+    if shared:
+      return
+    self.store.delete(old)
+
+  def _write(self, url: str, fields: Dict[str, Any]) -> None:
+    entry = self._row(url) or {}
+    entry.update(fields)
+    values = [url]
+    for field in LEDGER_FIELDS:
+      value = entry.get(field)
+      if field == "links":
+        value = json.dumps(value or [])
+      values.append(value)
+    placeholders = ", ".join("?" for _ in values)
+    self.conn.execute(
+      f"INSERT OR REPLACE INTO ledger (url, {', '.join(LEDGER_FIELDS)}) VALUES ({placeholders})",
+      values
+    )
+
+  def record(self, url: str, **fields: Any) -> None:
+    fields["fetched_at"] = datetime.datetime.utcnow().isoformat() + "Z"
+    self._write(url, fields)
+    self._dirty += 1
+    if self._dirty >= 50:
+      self.save()
+
+  def save(self) -> None:
+    self.conn.commit()
+    self._dirty = 0
+
+  def close(self) -> None:
+    self.save()
+    self.conn.close()
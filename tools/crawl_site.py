@@ -1,23 +1,70 @@
 #!/usr/bin/env python3
 import os
-import re
 import sys
 import time
-import json
+import math
 import hashlib
 import urllib.parse
 import datetime
+import threading
 import collections
-import xml.etree.ElementTree as ET
+import email.utils
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 import requests
-import trafilatura
+from requests.adapters import HTTPAdapter
+from requests.compat import chardet
+from urllib3.util.request import ACCEPT_ENCODING
 from typing import Optional, Callable, Dict, Any, Iterable, List
 from urllib import robotparser
-from bs4 import BeautifulSoup
+from tools.html_extract import extract_page, normalize_url
+from tools.doc_store import DocumentStore
+from tools.html_archive import ArchivedPage, HtmlArchive, default_archive_path
+from tools.crawl_ledger import CrawlLedger, default_ledger_path
+from tools.crawl_frontier import CrawlFrontier, default_frontier_path
+from tools import crawl_frontier as frontier_states
+from tools.parallel import BudgetedProcessPool, TaskTimeout, worker_count
+from tools.sitemaps import iter_sitemap_entries
+from tools.near_duplicates import NearDuplicateIndex, simhash, to_signed, to_unsigned
 
 
 UserAgent = "IntelliBot/1.0"
 ProgressCallback = Optional[Callable[[str, str], None]]
+DocumentCallback = Optional[Callable[[Dict[str, Any]], None]]
+
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "8"))
+CRAWL_PER_HOST_CONCURRENCY = int(os.environ.get("CRAWL_PER_HOST_CONCURRENCY", "4"))
+CRAWL_DELAY = float(os.environ.get("CRAWL_DELAY", "0.2"))
+CRAWL_EXTRACT_TIMEOUT = float(os.environ.get("CRAWL_EXTRACT_TIMEOUT", "20"))
+# Pages whose SimHash is within this many bits of a stored page are skipped; -1 disables.
+CRAWL_NEAR_DUPLICATE_DISTANCE = int(os.environ.get("CRAWL_NEAR_DUPLICATE_DISTANCE", "3"))
+# Responses slower than this (seconds) make the crawler back off from a host.
+CRAWL_SLOW_RESPONSE = float(os.environ.get("CRAWL_SLOW_RESPONSE", "5"))
+# Upper bound on backed-off request spacing and on honoured Retry-After pauses.
+CRAWL_MAX_BACKOFF = float(os.environ.get("CRAWL_MAX_BACKOFF", "120"))
+# Times a URL answered with 429/503 is queued again before it is given up on.
+CRAWL_MAX_RETRIES = int(os.environ.get("CRAWL_MAX_RETRIES", "2"))
+# Pages whose (decoded) body is larger than this are abandoned mid-download.
+CRAWL_MAX_PAGE_BYTES = int(os.environ.get("CRAWL_MAX_PAGE_BYTES", str(5 * 1024 * 1024)))
+STREAM_CHUNK_SIZE = 64 * 1024
+# Unwanted bodies up to this size are read anyway so their connection stays reusable.
+DRAIN_LIMIT = 64 * 1024
+# Links to these are never queued: the crawler only extracts HTML.
+BINARY_EXTENSIONS = frozenset((
+  ".pdf", ".zip", ".gz", ".tgz", ".tar", ".bz2", ".xz", ".rar", ".7z", ".exe", ".msi", ".dmg", ".iso",
+  ".apk", ".bin", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".ico", ".bmp", ".tif", ".tiff",
+  ".mp3", ".wav", ".ogg", ".flac", ".m4a", ".mp4", ".m4v", ".mov", ".avi", ".mkv", ".webm", ".wmv",
+  ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".odt", ".ods", ".odp", ".epub",
+  ".css", ".js", ".woff", ".woff2", ".ttf", ".otf", ".eot"
+))
+BACKOFF_STATUSES = (429, 503)
+BACKOFF_DELAY_STEP = 0.25
+DELAY_RECOVERY = 0.9
+SLOW_LATENCY_FACTOR = 3.0
+LATENCY_SMOOTHING = 0.2
+# Keep fetched HTML in a WARC archive so pages can be re-extracted without re-crawling.
+CRAWL_ARCHIVE_HTML = os.environ.get("CRAWL_ARCHIVE_HTML", "1").lower() not in ("0", "false", "no")
+# Fetched pages allowed to wait for an extraction worker before fetching pauses.
+EXTRACT_QUEUE_PER_WORKER = 4
 
 
 def _notify(callback: ProgressCallback, kind: str, message: str) -> None:
@@ -25,55 +72,216 @@ def _notify(callback: ProgressCallback, kind: str, message: str) -> None:
     callback(kind, message)
 
 
-def _clean_text(html: str, url: str) -> str:
-  text = trafilatura.extract(
-    html,
-    url=url,
-    output_format="txt",
-    include_links=False
-  ) or ""
-  if text.strip():
-    return _normalize_whitespace(text)
-  soup = BeautifulSoup(html, "html.parser")
-  for node in soup(["script", "style", "noscript"]):
-    node.decompose()
-  text = soup.get_text(" ", strip=True)
-  return _normalize_whitespace(text)
-
-
-def _normalize_whitespace(text: str) -> str:
-  text = re.sub(r"[ \t]+", " ", text)
-  text = re.sub(r"\s+\n", "\n", text)
-  return text.strip()
-
-
-def _save_document(out_dir: str, payload: Dict[str, Any]) -> None:
-  os.makedirs(out_dir, exist_ok=True)
+def _save_document(store: DocumentStore, payload: Dict[str, Any]) -> str:
   content_hash = payload.get("content_hash")
   hash_prefix = content_hash[:16] if content_hash else hashlib.sha1(
     payload["url"].encode()
   ).hexdigest()[:16]
-  path = os.path.join(out_dir, f"{hash_prefix}.json")
-  with open(path, "w", encoding="utf-8") as handle:
-    json.dump(payload, handle, ensure_ascii=False, indent=2)
+  return store.put(hash_prefix, payload)
+
+
+class _ConnectionStats:
+  """Counts responses on a session so connection reuse can be reported."""
+
+  def __init__(self):
+    self.responses = 0
+    self._lock = threading.Lock()
+
+  def hook(self, response: requests.Response, *args: Any, **kwargs: Any) -> None:
+    with self._lock:
+      self.responses += 1
+
+  def summary(self, session: requests.Session) -> Dict[str, Any]:
+    # urllib3 counts every socket it opens; each response beyond that reused one.
+    connections = 0
+    for adapter in session.adapters.values():
+      pools = adapter.poolmanager.pools
+      for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is not None:
+          connections += pool.num_connections
+    reuse_rate = max(0.0, 1.0 - connections / self.responses) if self.responses else 0.0
+    return {
+      "requests": self.responses,
+      "connections": connections,
+      "reuse_rate": round(reuse_rate, 3)
+    }
+
+
+def _crawl_session(pool_size: int, stats: _ConnectionStats) -> requests.Session:
+  """
+  Shared keep-alive session for every request a crawl makes (robots, sitemaps,
+  pages). Connections and their DNS lookups are reused across pages; the pool
+  holds enough sockets per host for every worker.
+  """
+  session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), pool_block=True)
+  session.mount("http://", adapter)
+  session.mount("https://", adapter)
+  # urllib3 lists "br" here only when a brotli decoder is installed.
+  session.headers.update({"User-Agent": UserAgent, "Accept-Encoding": ACCEPT_ENCODING})
+  session.hooks["response"].append(stats.hook)
+  return session
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+  """Seconds to wait from a ``Retry-After`` header (delta-seconds or an HTTP date)."""
+  if not value:
+    return None
+  value = value.strip()
+  if value.isdigit():
+    return float(value)
+  try:
+    when = email.utils.parsedate_to_datetime(value)
+  except (TypeError, ValueError):
+    return None
+  if when.tzinfo is None:
+    when = when.replace(tzinfo=datetime.timezone.utc)
+  return max(0.0, when.timestamp() - time.time())
+
+
+class _HostRate:
+  """Rate-control state of one host."""
+
+  def __init__(self, delay: float):
+    self.limit = 1.0
+    self.peak = 1
+    self.in_flight = 0
+    self.min_delay = delay
+    self.delay = delay
+    self.next_start = 0.0
+    self.blocked_until = 0.0
+    self.latency: Optional[float] = None
+    self.last_decrease = 0.0
+    self.backoffs = 0
+    self.throttled = 0
 
 
-def _canonical_url(soup: BeautifulSoup, url: str) -> str:
-  link = soup.find("link", {"rel": "canonical"})
-  if not link or not link.get("href"):
-    return url
-  candidate = urllib.parse.urljoin(url, link["href"])
-  return candidate.strip() or url
+class HostThrottle:
+  """
+  Adaptive per-host politeness (AIMD). Each host starts with one request in
+  flight; every healthy response widens its window by ``1 / window`` (about one
+  more concurrent request per round trip) up to ``per_host``. A 429/503, a failed
+  request or a response slower than ``slow_response`` seconds (or three times
+  the host's usual latency) halves the window and doubles the spacing between
+  request starts, at most once per round trip. ``Retry-After`` pauses the host.
+  Spacing decays back to ``delay``, or the robots.txt crawl delay if larger, as
+  responses recover.
+  """
 
+  def __init__(
+    self,
+    per_host: int = CRAWL_PER_HOST_CONCURRENCY,
+    delay: float = CRAWL_DELAY,
+    slow_response: float = CRAWL_SLOW_RESPONSE,
+    max_backoff: float = CRAWL_MAX_BACKOFF
+  ):
+    self.per_host = max(1, per_host)
+    self.delay = max(0.0, delay)
+    self.slow_response = slow_response
+    self.max_backoff = max_backoff
+    self._cond = threading.Condition()
+    self._hosts: Dict[str, _HostRate] = {}
 
-def _collect_headings(soup: BeautifulSoup) -> Dict[str, List[str]]:
-  headings: Dict[str, List[str]] = {"h1": [], "h2": [], "h3": []}
-  for level in headings.keys():
-    for node in soup.find_all(level):
-      text = _normalize_whitespace(node.get_text(" ", strip=True))
-      if text:
-        headings[level].append(text)
-  return headings
+  def _host(self, host: str) -> _HostRate:
+    # Callers hold self._cond.
+    state = self._hosts.get(host)
+    if state is None:
+      state = self._hosts[host] = _HostRate(self.delay)
+    return state
+
+  def set_crawl_delay(self, host: str, seconds: float) -> None:
+    """Never start requests to ``host`` closer together than ``seconds``."""
+    with self._cond:
+      state = self._host(host)
+      state.min_delay = max(self.delay, seconds)
+      state.delay = max(state.delay, state.min_delay)
+
+  def acquire(self, host: str) -> None:
+    with self._cond:
+      state = self._host(host)
+      while state.in_flight >= int(state.limit):
+        self._cond.wait()
+      state.in_flight += 1
+      now = time.monotonic()
+      start = max(now, state.next_start, state.blocked_until)
+      state.next_start = start + state.delay
+    if start > now:
+      time.sleep(start - now)
+
+  def release(
+    self,
+    host: str,
+    status: Optional[int] = None,
+    elapsed: Optional[float] = None,
+    retry_after: Optional[str] = None
+  ) -> None:
+    """Report how the request went; ``status`` is ``None`` when it failed outright."""
+    with self._cond:
+      state = self._host(host)
+      state.in_flight -= 1
+      now = time.monotonic()
+      if status in BACKOFF_STATUSES:
+        state.throttled += 1
+        wait_for = _parse_retry_after(retry_after)
+        if wait_for is not None:
+          state.blocked_until = max(state.blocked_until, now + min(wait_for, self.max_backoff))
+        self._decrease(state, now)
+      elif status is None or (elapsed is not None and self._is_slow(state, elapsed)):
+        self._decrease(state, now)
+      else:
+        state.limit = min(float(self.per_host), state.limit + 1.0 / state.limit)
+        state.peak = max(state.peak, int(state.limit))
+        state.delay = max(state.min_delay, state.delay * DELAY_RECOVERY)
+      if status is not None and elapsed is not None:
+        state.latency = elapsed if state.latency is None else (
+          (1 - LATENCY_SMOOTHING) * state.latency + LATENCY_SMOOTHING * elapsed
+        )
+      self._cond.notify_all()
+
+  def _is_slow(self, state: _HostRate, elapsed: float) -> bool:
+    usual = state.latency if state.latency is not None else 0.0
+    return elapsed > max(self.slow_response, SLOW_LATENCY_FACTOR * usual)
+
+  def _decrease(self, state: _HostRate, now: float) -> None:
+    # Responses to requests sent before the last cut reflect the old rate.
+    if now - state.last_decrease < max(state.latency or 0.0, state.delay):
+      return
+    state.last_decrease = now
+    state.backoffs += 1
+    state.limit = max(1.0, state.limit / 2)
+    state.delay = min(self.max_backoff, max(state.delay * 2, BACKOFF_DELAY_STEP))
+
+  def summary(self) -> Dict[str, Dict[str, Any]]:
+    with self._cond:
+      return {
+        host: {
+          "concurrency": int(state.limit),
+          "peak_concurrency": state.peak,
+          "delay": round(state.delay, 3),
+          "crawl_delay": round(state.min_delay, 3),
+          "backoffs": state.backoffs,
+          "throttled_responses": state.throttled
+        }
+        for host, state in self._hosts.items()
+      }
+
+
+def _robots_crawl_delay(parser: Optional[robotparser.RobotFileParser]) -> Optional[float]:
+  """``Crawl-delay``, or the interval implied by ``Request-rate``, for our user agent."""
+  if not parser:
+    return None
+  delays = []
+  try:
+    crawl_delay = parser.crawl_delay(UserAgent)
+    request_rate = parser.request_rate(UserAgent)
+  except Exception:
+    return None
+  if crawl_delay is not None:
+    delays.append(float(crawl_delay))
+  if request_rate is not None and request_rate.requests:
+    delays.append(request_rate.seconds / request_rate.requests)
+  return max(delays) if delays else None
 
 
 def _allowed_url(parser: Optional[robotparser.RobotFileParser], url: str) -> bool:
@@ -85,61 +293,549 @@ def _allowed_url(parser: Optional[robotparser.RobotFileParser], url: str) -> boo
     return True
 
 
-def _load_robot_parser(start_url: str, timeout: int) -> Optional[robotparser.RobotFileParser]:
+def _load_robot_parser(
+  start_url: str,
+  timeout: int,
+  session: requests.Session
+) -> Optional[robotparser.RobotFileParser]:
   parsed = urllib.parse.urlparse(start_url)
   robots_url = urllib.parse.urlunparse((parsed.scheme, parsed.netloc, "/robots.txt", "", "", ""))
   parser = robotparser.RobotFileParser()
   try:
     parser.set_url(robots_url)
-    parser.read()
+    response = session.get(robots_url, timeout=timeout)
+    # Same outcomes as RobotFileParser.read(): auth errors block, other errors allow all.
+    if response.status_code in (401, 403):
+      parser.disallow_all = True
+    elif 400 <= response.status_code < 500:
+      parser.allow_all = True
+    elif response.status_code >= 500:
+      return None
+    else:
+      parser.parse(response.text.splitlines())
     return parser
   except Exception:
     return None
 
 
-def _iter_sitemap_urls(parser: Optional[robotparser.RobotFileParser], timeout: int) -> Iterable[str]:
-  if not parser:
-    return []
-  sitemap_urls = parser.site_maps() or []
-  for sitemap_url in sitemap_urls:
+def _same_host(candidate: str, host: str) -> bool:
+  parsed = urllib.parse.urlparse(candidate)
+  return parsed.netloc == host and parsed.scheme in ("http", "https")
+
+
+def _content_length(response: requests.Response) -> Optional[int]:
+  try:
+    return int(response.headers["Content-Length"])
+  except (KeyError, ValueError):
+    return None
+
+
+def _discard(response: requests.Response) -> None:
+  """Drop an unwanted body: read it if it is small so the connection can be reused, else close."""
+  length = _content_length(response)
+  try:
+    if length is not None and length <= DRAIN_LIMIT:
+      response.content
+  except requests.RequestException:
+    pass
+  response.close()
+
+
+def _is_binary_url(url: str) -> bool:
+  path = urllib.parse.urlparse(url).path.lower()
+  return os.path.splitext(path)[1] in BINARY_EXTENSIONS
+
+
+def _decode_body(body: bytes, response: requests.Response) -> str:
+  # Same choice as Response.text: the declared charset, else a detected one.
+  encoding = response.encoding or chardet.detect(body)["encoding"] or "utf-8"
+  try:
+    return str(body, encoding, errors="replace")
+  except LookupError:
+    return str(body, "utf-8", errors="replace")
+
+
+def _read_page(
+  url: str,
+  response: requests.Response,
+  previous: Optional[Dict[str, Any]],
+  max_bytes: int
+) -> Dict[str, Any]:
+  """Decide on the status line and headers first; only then stream the body, up to ``max_bytes``."""
+  if previous and response.status_code == 304:
+    _discard(response)
+    return {"url": url, "unchanged": "not modified"}
+
+  if response.status_code in BACKOFF_STATUSES:
+    _discard(response)
+    return {"url": url, "retry": f"HTTP {response.status_code}"}
+
+  if response.status_code != 200:
+    _discard(response)
+    return {"url": url, "warning": f"Skipped {url}: HTTP {response.status_code}"}
+
+  content_type = response.headers.get("Content-Type", "")
+  length = _content_length(response)
+  if "text/html" not in content_type:
+    _discard(response)
+    return {
+      "url": url,
+      "ignored": f"Ignored {url}: unsupported content-type {content_type}",
+      "bytes_avoided": length or 0
+    }
+  if length is not None and length > max_bytes:
+    response.close()
+    return {
+      "url": url,
+      "ignored": f"Ignored {url}: {length} bytes exceeds the {max_bytes} byte page limit",
+      "oversize": True,
+      "bytes_avoided": length
+    }
+
+  body = bytearray()
+  try:
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+      body.extend(chunk)
+      if len(body) > max_bytes:
+        response.close()
+        return {
+          "url": url,
+          "ignored": f"Ignored {url}: body exceeds the {max_bytes} byte page limit",
+          "oversize": True,
+          "bytes_avoided": max(0, (length or 0) - len(body))
+        }
+  except requests.RequestException as exc:
+    response.close()
+    return {"url": url, "error": f"Failed to fetch {url}: {exc}"}
+  body = bytes(body)
+
+  validators = {
+    "etag": response.headers.get("ETag", ""),
+    "last_modified": response.headers.get("Last-Modified", ""),
+    "body_hash": hashlib.sha1(body).hexdigest()
+  }
+  if previous and previous.get("body_hash") == validators["body_hash"]:
+    return {"url": url, "unchanged": "identical body", "validators": validators}
+
+  return {
+    "url": url,
+    "html": _decode_body(body, response),
+    "content_type": content_type,
+    "status_code": response.status_code,
+    "validators": validators
+  }
+
+
+def _fetch_page(
+  url: str,
+  timeout: int,
+  throttle: HostThrottle,
+  session: requests.Session,
+  previous: Optional[Dict[str, Any]] = None,
+  max_bytes: int = CRAWL_MAX_PAGE_BYTES
+) -> Dict[str, Any]:
+  """
+  Fetch one page on a fetcher thread. Never raises. ``previous`` is the page's
+  ledger entry; when given, the request is conditional and an identical body is
+  reported as unchanged so it is never sent for extraction. The response is
+  streamed, so non-HTML and oversized bodies are abandoned without downloading.
+  """
+  host = urllib.parse.urlparse(url).netloc
+  headers = {}
+  if previous:
+    if previous.get("etag"):
+      headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+      headers["If-Modified-Since"] = previous["last_modified"]
+  outcome: Dict[str, Any] = {}
+  throttle.acquire(host)
+  started = time.monotonic()
+  try:
     try:
-      response = requests.get(sitemap_url, headers={"User-Agent": UserAgent}, timeout=timeout)
-      if response.status_code != 200:
+      response = session.get(url, headers=headers, timeout=timeout, stream=True)
+    except requests.RequestException as exc:
+      return {"url": url, "error": f"Failed to fetch {url}: {exc}"}
+    outcome = {"status": response.status_code, "retry_after": response.headers.get("Retry-After")}
+    return _read_page(url, response, previous, max_bytes)
+  finally:
+    throttle.release(host, elapsed=time.monotonic() - started, **outcome)
+
+
+def _crawl_payload(page: Dict[str, Any], url: str, text: str, content_hash: str) -> Dict[str, Any]:
+  return {
+    "url": page["canonical"],
+    "original_url": url,
+    "title": page["title"],
+    "meta_description": page["meta_description"],
+    "headings": page["headings"],
+    "extracted_at": datetime.datetime.utcnow().isoformat() + "Z",
+    "text": text,
+    "content_hash": content_hash,
+    "source_type": "crawl",
+    "content_type": page["content_type"],
+    "status_code": page["status_code"]
+  }
+
+
+def _extract_for_crawl(html: str, url: str) -> Dict[str, Any]:
+  """Extraction-worker entry point: the page fields plus a SimHash of its text."""
+  page = extract_page(html, url)
+  page["simhash"] = simhash(page["text"])
+  return page
+
+
+class _StageStats:
+  """Completed items and active span of one pipeline stage."""
+
+  def __init__(self):
+    self.items = 0
+    self.started: Optional[float] = None
+    self.finished: Optional[float] = None
+
+  def start(self) -> None:
+    if self.started is None:
+      self.started = time.monotonic()
+
+  def done(self) -> None:
+    self.items += 1
+    self.finished = time.monotonic()
+
+  def summary(self) -> Dict[str, Any]:
+    span = (self.finished - self.started) if self.started is not None and self.finished is not None else 0.0
+    return {
+      "pages": self.items,
+      "seconds": round(span, 2),
+      "per_second": round(self.items / span, 2) if span > 0 else 0.0
+    }
+
+
+class _Crawler:
+  """
+  Two-stage crawl: fetcher threads download pages, a process pool extracts
+  them. This thread schedules both stages and does all bookkeeping (robots,
+  canonical de-duplication, the ledger, saving), so ``max_pages`` is exact.
+  """
+
+  def __init__(
+    self,
+    session: requests.Session,
+    frontier: CrawlFrontier,
+    ledger: Optional[CrawlLedger],
+    allowed_host: str,
+    max_pages: int,
+    timeout: int,
+    progress_callback: ProgressCallback,
+    store: DocumentStore,
+    archive: Optional[HtmlArchive],
+    respect_robots: bool,
+    throttle: HostThrottle,
+    fetchers: ThreadPoolExecutor,
+    fetch_workers: int,
+    extractor: BudgetedProcessPool,
+    extract_queue_size: int,
+    near_duplicate_distance: int,
+    max_page_bytes: int,
+    document_callback: DocumentCallback
+  ):
+    self.session = session
+    self.frontier = frontier
+    self.ledger = ledger
+    self.allowed_host = allowed_host
+    self.max_pages = max_pages
+    self.timeout = timeout
+    self.progress_callback = progress_callback
+    self.store = store
+    self.archive = archive
+    self.respect_robots = respect_robots
+    self.parser: Optional[robotparser.RobotFileParser] = None
+    self.throttle = throttle
+    self.fetchers = fetchers
+    self.fetch_workers = fetch_workers
+    self.extractor = extractor
+    self.extract_queue_size = extract_queue_size
+    self.max_page_bytes = max_page_bytes
+    self.document_callback = document_callback
+    self.near_duplicates: Optional[NearDuplicateIndex] = None
+    if near_duplicate_distance >= 0:
+      self.near_duplicates = NearDuplicateIndex(near_duplicate_distance)
+      for stored_url, fingerprint in frontier.fingerprints():
+        self.near_duplicates.add(stored_url, to_unsigned(fingerprint))
+
+    self.fetching: Dict[Future, int] = {}
+    self.extracting: Dict[Future, Dict[str, Any]] = {}
+    self.visited = 0
+    self.stored_pages = frontier.count(frontier_states.STORED)
+    self.resumed_pages = self.stored_pages
+    self.unchanged_pages = 0
+    self.removed_pages = 0
+    self.crawled: List[Dict[str, Any]] = []
+    self.fetch_stats = _StageStats()
+    self.extract_stats = _StageStats()
+    self.extract_failures = 0
+    self.peak_extract_queue = 0
+    self.retries: Dict[str, int] = {}
+    self.binary_links: set = set()
+    self.rejected_on_headers = 0
+    self.oversize_pages = 0
+    self.bytes_avoided = 0
+
+  def _wanted(self) -> int:
+    return self.max_pages - self.stored_pages
+
+  def _slots(self) -> int:
+    # Never have more pages outstanding than still wanted, and stop fetching
+    # while the extraction queue is full so fetchers cannot run ahead of it.
+    if len(self.extracting) >= self.extract_queue_size:
+      return 0
+    return min(
+      self.fetch_workers - len(self.fetching),
+      self._wanted() - len(self.fetching) - len(self.extracting)
+    )
+
+  def schedule(self) -> None:
+    while True:
+      claimed = self.frontier.pop(self._slots())
+      if not claimed:
+        return
+      for url, depth in claimed:
+        self._submit(url, depth)
+
+  def _submit(self, url: str, depth: int) -> None:
+    self.visited += 1
+    if self.respect_robots and not _allowed_url(self.parser, url):
+      self.frontier.mark(url, frontier_states.SKIPPED)
+      _notify(self.progress_callback, "warning", f"Skipped {url} (robots.txt)")
+      return
+    previous = dict(self.ledger.get(url) or {}) if self.ledger else None
+    self.fetch_stats.start()
+    future = self.fetchers.submit(
+      _fetch_page, url, self.timeout, self.throttle, self.session, previous, self.max_page_bytes
+    )
+    self.fetching[future] = depth
+
+  def enqueue_links(self, links: Iterable[str], depth: int) -> None:
+    wanted = []
+    for link in links:
+      if not _same_host(link, self.allowed_host):
         continue
-      for url in _parse_sitemap(response.text):
-        yield url
-    except requests.RequestException:
-      continue
+      if _is_binary_url(link):
+        self.binary_links.add(link)
+        continue
+      wanted.append(link)
+    self.frontier.add(wanted, depth)
 
+  def _claim(self, url: str, canonical: str) -> bool:
+    """Mark ``url`` and its canonical visited, unless another page already claimed the canonical."""
+    if canonical != url and self.frontier.state(canonical) not in (None, frontier_states.QUEUED):
+      self.frontier.mark(url, frontier_states.DONE)
+      return False
+    self.frontier.mark(canonical, frontier_states.DONE)
+    self.frontier.mark(url, frontier_states.DONE)
+    return True
 
-def _parse_sitemap(data: str) -> Iterable[str]:
-  try:
-    tree = ET.fromstring(data)
-  except ET.ParseError:
-    return []
-  namespace = ""
-  if tree.tag.startswith("{"):
-    namespace = tree.tag.split("}", 1)[0] + "}"
-  urls = []
-  for elem in tree.findall(f"{namespace}url/{namespace}loc"):
-    if elem.text:
-      urls.append(elem.text.strip())
-  return urls
+  def _stored(self, url: str) -> None:
+    self.frontier.mark(url, frontier_states.STORED)
+    self.stored_pages += 1
 
+  def _release(self, url: str) -> None:
+    """A page stored by an earlier crawl is now skipped; drop its stale document so it is not served."""
+    entry = self.ledger.get(url) if self.ledger else None
+    if entry and entry.get("document"):
+      self.ledger.replace_document(url, None)
+      self.ledger.record(url, content_hash=None, document=None)
+      self.removed_pages += 1
 
-def _same_host(candidate: str, host: str) -> bool:
-  parsed = urllib.parse.urlparse(candidate)
-  return parsed.netloc == host and parsed.scheme in ("http", "https")
+  def _remember_fingerprint(self, url: str, fingerprint: Optional[int]) -> None:
+    if self.near_duplicates is None or fingerprint is None:
+      return
+    self.near_duplicates.add(url, fingerprint)
+    self.frontier.add_fingerprint(url, to_signed(fingerprint))
 
+  def run(self) -> None:
+    self.schedule()
+    while (self.fetching or self.extracting) and self.stored_pages < self.max_pages:
+      done, _ = wait(set(self.fetching) | set(self.extracting), return_when=FIRST_COMPLETED)
+      for future in done:
+        if future in self.fetching:
+          depth = self.fetching.pop(future)
+          self.fetch_stats.done()
+          if self.stored_pages < self.max_pages:
+            self._fetched(future.result(), depth)
+        else:
+          page = self.extracting.pop(future)
+          self.extract_stats.done()
+          if self.stored_pages < self.max_pages:
+            self._extracted(page, future)
+      self.peak_extract_queue = max(self.peak_extract_queue, len(self.extracting))
+      self.schedule()
 
-def _normalize_url(url: str, base: str) -> Optional[str]:
-  merged = urllib.parse.urljoin(base, url.split("#")[0])
-  parsed = urllib.parse.urlparse(merged)
-  if not parsed.scheme or not parsed.netloc:
-    return None
-  return urllib.parse.urlunparse(
-    (parsed.scheme, parsed.netloc, parsed.path.rstrip("/") or "/", "", "", "")
-  )
+  def _fetched(self, page: Dict[str, Any], depth: int) -> None:
+    url = page["url"]
+    if "error" in page:
+      self.frontier.mark(url, frontier_states.FAILED)
+      _notify(self.progress_callback, "warning", page["error"])
+      return
+    if "warning" in page:
+      self.frontier.mark(url, frontier_states.FAILED)
+      _notify(self.progress_callback, "warning", page["warning"])
+      return
+    if "retry" in page:
+      attempts = self.retries[url] = self.retries.get(url, 0) + 1
+      if attempts > CRAWL_MAX_RETRIES:
+        self.frontier.mark(url, frontier_states.FAILED)
+        _notify(self.progress_callback, "warning", f"Skipped {url}: {page['retry']} after {attempts} attempts")
+      else:
+        # The throttle has already backed off this host; the URL waits its turn again.
+        self.frontier.requeue(url)
+        _notify(self.progress_callback, "info", f"Server throttled {url} ({page['retry']}); retrying later")
+      return
+    if "ignored" in page:
+      self.frontier.mark(url, frontier_states.SKIPPED)
+      if page.get("oversize"):
+        self.oversize_pages += 1
+      else:
+        self.rejected_on_headers += 1
+      self.bytes_avoided += page.get("bytes_avoided", 0)
+      _notify(self.progress_callback, "info", page["ignored"])
+      return
+
+    if "unchanged" in page:
+      entry = self.ledger.get(url) if self.ledger else None
+      if not entry:
+        self.frontier.mark(url, frontier_states.FAILED)
+        return
+      canonical = entry.get("canonical") or url
+      if not self._claim(url, canonical):
+        return
+      self.ledger.record(url, **page.get("validators", {}))
+      self._stored(url)
+      self._remember_fingerprint(canonical, int(entry["simhash"], 16) if entry.get("simhash") else None)
+      self.unchanged_pages += 1
+      _notify(
+        self.progress_callback,
+        "info",
+        f"Unchanged page {self.stored_pages}: {canonical[:70]} ({page['unchanged']})"
+      )
+      self.enqueue_links(entry.get("links", []), depth + 1)
+      return
+
+    page["depth"] = depth
+    html = page.pop("html")
+    if self.archive is not None:
+      self.archive.add(url, html, page["content_type"], page["status_code"])
+    self.extract_stats.start()
+    self.extracting[self.extractor.submit(_extract_for_crawl, html, url)] = page
+
+  def _extracted(self, page: Dict[str, Any], future: Future) -> None:
+    url = page["url"]
+    try:
+      page.update(future.result())
+    except TaskTimeout:
+      self.extract_failures += 1
+      self.frontier.mark(url, frontier_states.FAILED)
+      _notify(
+        self.progress_callback,
+        "warning",
+        f"Skipped {url} (extraction exceeded {self.extractor.time_budget:g}s)"
+      )
+      return
+    except Exception as exc:
+      self.extract_failures += 1
+      self.frontier.mark(url, frontier_states.FAILED)
+      _notify(self.progress_callback, "warning", f"Failed to extract {url}: {exc}")
+      return
+
+    canonical = page["canonical"]
+    if not self._claim(url, canonical):
+      return
+
+    text = page["text"]
+    if len(text) < 80:
+      self._release(url)
+      _notify(self.progress_callback, "warning", f"Skipped {canonical} (insufficient text)")
+      return
+
+    content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    fingerprint = page["simhash"]
+    links = [link for link in page["links"] if _same_host(link, self.allowed_host)]
+    if self.ledger and self.ledger.is_unchanged(url, content_hash):
+      self.ledger.record(url, canonical=canonical, links=links, simhash=f"{fingerprint:016x}", **page["validators"])
+      self._stored(url)
+      self._remember_fingerprint(canonical, fingerprint)
+      self.unchanged_pages += 1
+      _notify(self.progress_callback, "info", f"Unchanged page {self.stored_pages}: {canonical[:70]} (same text)")
+      self.enqueue_links(links, page["depth"] + 1)
+      return
+
+    match = self.near_duplicates.find(fingerprint) if self.near_duplicates is not None else None
+    if match:
+      original, distance = match
+      size = len(text.encode("utf-8"))
+      self.frontier.add_duplicate(canonical, original, distance, size, math.ceil(len(text) / 4))
+      self._release(url)
+      _notify(
+        self.progress_callback,
+        "info",
+        f"Skipped {canonical[:70]} (near-duplicate of {original[:70]}, {distance} bits apart)"
+      )
+      self.enqueue_links(links, page["depth"] + 1)
+      return
+
+    payload = _crawl_payload(page, url, text, content_hash)
+    document = _save_document(self.store, payload)
+    if self.ledger:
+      self.ledger.replace_document(url, document)
+      self.ledger.record(
+        url,
+        canonical=canonical,
+        content_hash=content_hash,
+        document=document,
+        links=links,
+        simhash=f"{fingerprint:016x}",
+        **page["validators"]
+      )
+    self._stored(url)
+    self._remember_fingerprint(canonical, fingerprint)
+    if self.document_callback:
+      self.document_callback(payload)
+    self.crawled.append({"url": canonical, "chars": len(text), "title": page["title"]})
+
+    _notify(
+      self.progress_callback,
+      "success",
+      f"Saved page {self.stored_pages}: {canonical[:70]} ({len(text)} chars)"
+    )
+
+    self.enqueue_links(links, page["depth"] + 1)
+
+    if self.visited % 10 == 0:
+      _notify(
+        self.progress_callback,
+        "info",
+        f"Crawling... {self.stored_pages} pages saved, {self.visited} URLs visited, "
+        f"{self.frontier.count(frontier_states.QUEUED)} queued, {len(self.fetching)} fetching, "
+        f"{self.extractor.pending} waiting for extraction, {self.extractor.running} extracting"
+      )
+
+  def transfer_summary(self) -> Dict[str, Any]:
+    return {
+      "binary_links_skipped": len(self.binary_links),
+      "rejected_on_headers": self.rejected_on_headers,
+      "oversize_pages": self.oversize_pages,
+      "bytes_avoided": self.bytes_avoided
+    }
+
+  def stage_summary(self) -> Dict[str, Any]:
+    return {
+      "fetch": self.fetch_stats.summary(),
+      "extract": dict(
+        self.extract_stats.summary(),
+        failures=self.extract_failures,
+        timeouts=self.extractor.timeouts
+      ),
+      "peak_extract_queue": self.peak_extract_queue,
+      "extract_queue_size": self.extract_queue_size
+    }
 
 
 def crawl_site(
@@ -149,125 +845,357 @@ def crawl_site(
   progress_callback: ProgressCallback = None,
   output_dir: str = "kb/raw",
   include_sitemaps: bool = True,
-  respect_robots: bool = True
+  respect_robots: bool = True,
+  concurrency: int = CRAWL_CONCURRENCY,
+  per_host_concurrency: int = CRAWL_PER_HOST_CONCURRENCY,
+  politeness_delay: float = CRAWL_DELAY,
+  incremental: bool = True,
+  ledger_path: Optional[str] = None,
+  extract_workers: Optional[int] = None,
+  extract_timeout: float = CRAWL_EXTRACT_TIMEOUT,
+  resume: bool = True,
+  frontier_path: Optional[str] = None,
+  near_duplicate_distance: int = CRAWL_NEAR_DUPLICATE_DISTANCE,
+  max_page_bytes: int = CRAWL_MAX_PAGE_BYTES,
+  archive_html: bool = CRAWL_ARCHIVE_HTML,
+  archive_path: Optional[str] = None,
+  document_callback: DocumentCallback = None
 ) -> Dict[str, Any]:
-  """Crawl a website and extract structured page metadata."""
+  """
+  Crawl a website and extract structured page metadata.
+
+  Pages are fetched by ``concurrency`` worker threads. Load on any one host is
+  adapted to how it responds (see ``HostThrottle``): up to ``per_host_concurrency``
+  requests in flight, started at least ``politeness_delay`` seconds apart, or
+  the robots.txt ``Crawl-delay`` if that is longer. URLs answered with 429/503
+  are retried after the host has been backed off. Fetched HTML goes
+  through a bounded queue to ``extract_workers`` processes; an extraction taking
+  longer than ``extract_timeout`` seconds is killed and the page skipped.
+
+  With ``incremental`` set, a fetch ledger (by default next to ``output_dir``) is
+  used to make conditional requests; pages that return 304 or whose text is
+  unchanged still count towards ``max_pages`` but are not re-written, and only
+  changed pages are listed in the result's ``urls``.
+
+  The frontier is kept on disk (by default next to ``output_dir``). If a crawl of
+  the same start URL was interrupted and its saved pages are still in
+  ``output_dir``, ``resume`` continues it instead of starting over.
+
+  Responses are streamed: non-HTML content types and bodies larger than
+  ``max_page_bytes`` are abandoned on their headers or as soon as the limit is
+  crossed, and links with binary file extensions are never queued. The result's
+  ``transfer`` counts these, with ``bytes_avoided`` as declared by Content-Length.
+
+  With ``archive_html`` set, every page sent for extraction is also appended to
+  a WARC archive (by default next to ``output_dir``) that ``reextract_site``
+  can rebuild the documents from.
+
+  Pages whose text SimHash is within ``near_duplicate_distance`` bits of a page
+  already stored (print views, tag listings, pagination) are not saved; the
+  result's ``near_duplicates`` maps each to the page it duplicates.
+
+  ``document_callback`` is called with each new or changed document as soon as
+  it is saved, so a consumer (e.g. ``EmbeddingPipeline``) can work on it while
+  the crawl continues.
+  """
   parsed_start = urllib.parse.urlparse(start_url)
   allowed_host = parsed_start.netloc
   if not allowed_host:
     raise ValueError(f"Invalid start URL: {start_url}")
 
-  parser = _load_robot_parser(start_url, timeout) if respect_robots else None
-  queue = collections.deque()
-  seen: Dict[str, str] = {}
+  fetch_workers = max(1, concurrency)
+  extract_workers = worker_count(extract_workers, "CRAWL_EXTRACT_WORKERS")
+  stats = _ConnectionStats()
+  session = _crawl_session(fetch_workers, stats)
+  store = DocumentStore(output_dir)
+  archive = HtmlArchive(archive_path or default_archive_path(output_dir)) if archive_html else None
+  ledger = CrawlLedger(ledger_path or default_ledger_path(output_dir), store) if incremental else None
+  # Only resume if the pages the interrupted run saved are still there.
+  resume = resume and len(store) > 0
+  frontier = CrawlFrontier(frontier_path or default_frontier_path(output_dir), start_url, resume=resume)
+  fetchers = ThreadPoolExecutor(max_workers=fetch_workers)
+  extractor = BudgetedProcessPool(extract_workers, extract_timeout)
+  throttle = HostThrottle(per_host_concurrency, politeness_delay)
+  crawler = _Crawler(
+    session, frontier, ledger, allowed_host, max_pages, timeout, progress_callback, store, archive, respect_robots,
+    throttle, fetchers, fetch_workers,
+    extractor, extract_workers * EXTRACT_QUEUE_PER_WORKER, near_duplicate_distance, max_page_bytes,
+    document_callback
+  )
+  try:
+    crawler.parser = _load_robot_parser(start_url, timeout, session) if respect_robots else None
+    crawl_delay = _robots_crawl_delay(crawler.parser)
+    if crawl_delay:
+      throttle.set_crawl_delay(allowed_host, crawl_delay)
+      _notify(progress_callback, "info", f"Honouring robots.txt crawl delay of {crawl_delay:g}s")
+    if frontier.resumed:
+      _notify(
+        progress_callback,
+        "info",
+        f"Resuming crawl of {start_url}: {crawler.stored_pages} pages already saved, "
+        f"{frontier.count(frontier_states.QUEUED)} queued"
+      )
+    else:
+      start_normalized = normalize_url(start_url, start_url)
+      if start_normalized:
+        frontier.add_entries([(start_normalized, 0, 1.0, None)])
+      if include_sitemaps and crawler.parser:
+        # Sitemap pages are treated as one hop from the start page.
+        frontier.add_entries(
+          (url, 1, entry.priority, entry.lastmod)
+          for entry in iter_sitemap_entries(crawler.parser.site_maps() or [], session, timeout)
+          for url in [normalize_url(entry.url, entry.url)]
+          if url and _same_host(url, allowed_host) and not _is_binary_url(url)
+        )
+      _notify(progress_callback, "info", f"Starting crawl of {start_url} (max {max_pages} pages)")
 
-  start_normalized = _normalize_url(start_url, start_url)
-  if start_normalized:
-    queue.append(start_normalized)
+    crawler.run()
+    frontier.finish()
+    # Re-crawls replace changed pages; reclaim the space once most of it is stale.
+    store.compact()
+    if archive is not None:
+      archive.prune()
+    connections = stats.summary(session)
+    duplicates = frontier.duplicates()
+  finally:
+    fetchers.shutdown(wait=True, cancel_futures=True)
+    extractor.shutdown(cancel_futures=True)
+    session.close()
+    frontier.close()
+    if ledger:
+      ledger.close()
+    if archive is not None:
+      archive.close()
+    store.close()
 
-  if include_sitemaps:
-    for sitemap_url in _iter_sitemap_urls(parser, timeout):
-      normalized = _normalize_url(sitemap_url, sitemap_url)
-      if normalized and _same_host(normalized, allowed_host):
-        queue.append(normalized)
+  _notify(
+    progress_callback,
+    "info",
+    f"HTTP: {connections['requests']} requests over {connections['connections']} connections "
+    f"({connections['reuse_rate']:.0%} reused)"
+  )
+  stages = crawler.stage_summary()
+  _notify(
+    progress_callback,
+    "info",
+    f"Stages: fetched {stages['fetch']['pages']} pages ({stages['fetch']['per_second']}/s), "
+    f"extracted {stages['extract']['pages']} ({stages['extract']['per_second']}/s, "
+    f"{stages['extract']['timeouts']} timed out), peak extraction queue "
+    f"{stages['peak_extract_queue']}/{stages['extract_queue_size']}"
+  )
+  transfer = crawler.transfer_summary()
+  if transfer["binary_links_skipped"] or transfer["rejected_on_headers"] or transfer["oversize_pages"]:
+    _notify(
+      progress_callback,
+      "info",
+      f"Downloads avoided: {transfer['binary_links_skipped']} binary links not fetched, "
+      f"{transfer['rejected_on_headers']} non-HTML and {transfer['oversize_pages']} oversized responses "
+      f"abandoned ({transfer['bytes_avoided']} bytes not downloaded)"
+    )
+  rate_control = throttle.summary()
+  backoffs = sum(host["backoffs"] for host in rate_control.values())
+  if backoffs:
+    _notify(
+      progress_callback,
+      "info",
+      f"Rate control: backed off {backoffs} times after "
+      f"{sum(host['throttled_responses'] for host in rate_control.values())} throttled responses"
+    )
+  near_duplicates = {
+    "pages": len(duplicates),
+    "bytes": sum(item["bytes"] for item in duplicates),
+    "tokens": sum(item["tokens"] for item in duplicates),
+    "mapping": duplicates
+  }
+  if duplicates:
+    _notify(
+      progress_callback,
+      "info",
+      f"Near-duplicates: skipped {near_duplicates['pages']} pages "
+      f"({near_duplicates['bytes']} bytes, ~{near_duplicates['tokens']} embedding tokens saved)"
+    )
+  stored_pages = crawler.stored_pages
+  changed_pages = len(crawler.crawled)
+  final_msg = f"Done. Saved {stored_pages} pages to {output_dir}"
+  if crawler.unchanged_pages:
+    final_msg += f" ({changed_pages} changed, {crawler.unchanged_pages} unchanged)"
+  if crawler.removed_pages:
+    final_msg += f"; removed {crawler.removed_pages} previously stored pages now skipped"
+  print(final_msg)
+  _notify(progress_callback, "complete", final_msg)
+  return {
+    "pages": stored_pages,
+    "resumed_pages": crawler.resumed_pages,
+    "changed": changed_pages,
+    "unchanged": crawler.unchanged_pages,
+    "removed": crawler.removed_pages,
+    "urls": crawler.crawled,
+    "connections": connections,
+    "stages": stages,
+    "rate_control": rate_control,
+    "transfer": transfer,
+    "near_duplicates": near_duplicates
+  }
 
-  stored_pages = 0
-  crawled = []
 
-  _notify(progress_callback, "info", f"Starting crawl of {start_url} (max {max_pages} pages)")
 
-  while queue and stored_pages < max_pages:
-    url = queue.popleft()
-    if url in seen:
-      continue
-    seen[url] = "queued"
+class _Reextractor:
+  """Replays archived pages through extraction and brings the stored documents in line."""
 
-    if respect_robots and not _allowed_url(parser, url):
-      _notify(progress_callback, "warning", f"Skipped {url} (robots.txt)")
-      continue
+  def __init__(
+    self,
+    store: DocumentStore,
+    ledger: CrawlLedger,
+    progress_callback: ProgressCallback,
+    near_duplicate_distance: int
+  ):
+    self.store = store
+    self.ledger = ledger
+    self.progress_callback = progress_callback
+    self.near_duplicates = NearDuplicateIndex(near_duplicate_distance) if near_duplicate_distance >= 0 else None
+    self.canonicals: set = set()
+    self.pages = 0
+    self.unchanged = 0
+    self.removed = 0
+    self.failures = 0
+    self.near_duplicate_pages = 0
+    self.changed: List[Dict[str, Any]] = []
 
-    try:
-      response = requests.get(url, headers={"User-Agent": UserAgent}, timeout=timeout)
-    except requests.RequestException as exc:
-      _notify(progress_callback, "warning", f"Failed to fetch {url}: {exc}")
-      continue
-
-    if response.status_code != 200:
-      _notify(progress_callback, "warning", f"Skipped {url}: HTTP {response.status_code}")
-      continue
-
-    content_type = response.headers.get("Content-Type", "")
-    if "text/html" not in content_type:
-      _notify(progress_callback, "info", f"Ignored {url}: unsupported content-type {content_type}")
-      continue
-
-    html = response.text
-    soup = BeautifulSoup(html, "html.parser")
-    canonical = _canonical_url(soup, url)
-    if canonical != url and canonical in seen:
-      continue
-    seen[canonical] = "fetched"
-    seen[url] = "fetched"
-
-    text = _clean_text(html, canonical)
-    if len(text) < 80:
-      _notify(progress_callback, "warning", f"Skipped {canonical} (insufficient text)")
-      continue
+  def _drop(self, url: str) -> None:
+    """The page no longer yields a document of its own; release the one it had."""
+    if self.ledger.get(url):
+      self.ledger.replace_document(url, None)
+      self.ledger.record(url, content_hash=None, document=None)
+      self.removed += 1
 
-    title = soup.title.get_text(strip=True) if soup.title else ""
-    meta_description = ""
-    meta = soup.find("meta", attrs={"name": "description"})
-    if meta and meta.get("content"):
-      meta_description = _normalize_whitespace(meta["content"])
+  def handle(self, archived: ArchivedPage, future: Future, time_budget: float) -> None:
+    url = archived.url
+    try:
+      page = future.result()
+    except TaskTimeout:
+      # Keep whatever was stored for this page before.
+      self.failures += 1
+      _notify(self.progress_callback, "warning", f"Kept previous document for {url} (extraction exceeded {time_budget:g}s)")
+      return
+    except Exception as exc:
+      self.failures += 1
+      _notify(self.progress_callback, "warning", f"Kept previous document for {url}: {exc}")
+      return
 
-    headings = _collect_headings(soup)
-    content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    canonical = page["canonical"]
+    text = page["text"]
+    if canonical in self.canonicals or len(text) < 80:
+      self._drop(url)
+      return
+    self.canonicals.add(canonical)
 
-    payload = {
-      "url": canonical,
-      "original_url": url,
-      "title": title,
-      "meta_description": meta_description,
-      "headings": headings,
-      "extracted_at": datetime.datetime.utcnow().isoformat() + "Z",
-      "text": text,
-      "content_hash": content_hash,
-      "source_type": "crawl",
-      "content_type": content_type,
-      "status_code": response.status_code
-    }
-    _save_document(output_dir, payload)
-    stored_pages += 1
-    crawled.append({"url": canonical, "chars": len(text), "title": title})
+    fingerprint = page["simhash"]
+    match = self.near_duplicates.find(fingerprint) if self.near_duplicates is not None else None
+    if match:
+      self.near_duplicate_pages += 1
+      self._drop(url)
+      return
 
-    _notify(progress_callback, "success", f"Saved page {stored_pages}: {canonical[:70]} ({len(text)} chars)")
+    content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    page.update(content_type=archived.content_type, status_code=archived.status_code)
+    payload = _crawl_payload(page, url, text, content_hash)
+    document = content_hash[:16]
+    if document in self.store:
+      self.unchanged += 1
+    else:
+      _save_document(self.store, payload)
+      self.changed.append({"url": canonical, "chars": len(text), "title": page["title"]})
+    self.ledger.replace_document(url, document)
+    self.ledger.record(
+      url,
+      canonical=canonical,
+      content_hash=content_hash,
+      document=document,
+      links=[link for link in page["links"] if _same_host(link, urllib.parse.urlparse(url).netloc)],
+      simhash=f"{fingerprint:016x}"
+    )
+    if self.near_duplicates is not None:
+      self.near_duplicates.add(canonical, fingerprint)
+    self.pages += 1
+    if self.pages % 25 == 0:
+      _notify(self.progress_callback, "info", f"Re-extracted {self.pages} pages ({len(self.changed)} changed)...")
 
-    for link in soup.find_all("a", href=True):
-      normalized = _normalize_url(link["href"], canonical)
-      if not normalized:
-        continue
-      if not _same_host(normalized, allowed_host):
-        continue
-      if normalized in seen:
-        continue
-      queue.append(normalized)
 
-    time.sleep(0.2)
+def reextract_site(
+  output_dir: str = "kb/raw",
+  progress_callback: ProgressCallback = None,
+  archive_path: Optional[str] = None,
+  ledger_path: Optional[str] = None,
+  extract_workers: Optional[int] = None,
+  extract_timeout: float = CRAWL_EXTRACT_TIMEOUT,
+  near_duplicate_distance: int = CRAWL_NEAR_DUPLICATE_DISTANCE
+) -> Dict[str, Any]:
+  """
+  Rebuild the crawled documents in ``output_dir`` from the HTML archive
+  instead of the network, e.g. after extraction has changed. Pages are
+  extracted in ``extract_workers`` processes and go through the same canonical,
+  length and near-duplicate checks as a crawl. Documents whose text comes out
+  the same are left alone, changed ones are replaced through the ledger, and
+  uploads or pages crawled before the archive existed are not touched.
+  """
+  archive_dir = archive_path or default_archive_path(output_dir)
+  if not os.path.isdir(archive_dir):
+    raise ValueError(f"No HTML archive at {archive_dir}; crawl the site first")
 
-    if len(seen) % 10 == 0:
-      _notify(
-        progress_callback,
-        "info",
-        f"Crawling... {stored_pages} pages saved, {len(seen)} URLs visited, {len(queue)} queued"
-      )
+  extract_workers = worker_count(extract_workers, "CRAWL_EXTRACT_WORKERS")
+  store = DocumentStore(output_dir)
+  ledger = CrawlLedger(ledger_path or default_ledger_path(output_dir), store)
+  archive = HtmlArchive(archive_dir)
+  extractor = BudgetedProcessPool(extract_workers, extract_timeout)
+  reextractor = _Reextractor(store, ledger, progress_callback, near_duplicate_distance)
+  window = extract_workers * EXTRACT_QUEUE_PER_WORKER
+  started = time.monotonic()
+  try:
+    _notify(
+      progress_callback,
+      "info",
+      f"Re-extracting {len(archive)} archived pages with {extract_workers} worker processes..."
+    )
+    # Results are handled in archive order so canonical and near-duplicate
+    # decisions do not depend on which worker finishes first.
+    pending: collections.deque = collections.deque()
+    for archived in archive.iter_pages():
+      pending.append((archived, extractor.submit(_extract_for_crawl, archived.html, archived.url)))
+      if len(pending) >= window:
+        reextractor.handle(*pending.popleft(), extract_timeout)
+    while pending:
+      reextractor.handle(*pending.popleft(), extract_timeout)
+    store.compact()
+  finally:
+    extractor.shutdown(cancel_futures=True)
+    archive.close()
+    ledger.close()
+    store.close()
 
-  final_msg = f"Done. Saved {stored_pages} pages to {output_dir}"
+  elapsed = time.monotonic() - started
+  final_msg = (
+    f"Re-extracted {reextractor.pages} pages in {elapsed:.1f}s: {len(reextractor.changed)} changed, "
+    f"{reextractor.unchanged} unchanged, {reextractor.removed} removed, "
+    f"{reextractor.near_duplicate_pages} near-duplicates, {reextractor.failures} failed"
+  )
   print(final_msg)
   _notify(progress_callback, "complete", final_msg)
-  return {"pages": stored_pages, "urls": crawled}
+  return {
+    "pages": reextractor.pages,
+    "changed": len(reextractor.changed),
+    "unchanged": reextractor.unchanged,
+    "removed": reextractor.removed,
+    "near_duplicates": reextractor.near_duplicate_pages,
+    "failures": reextractor.failures,
+    "seconds": round(elapsed, 2),
+    "urls": reextractor.changed
+  }
 
 
 if __name__ == "__main__":
-  start = sys.argv[1] if len(sys.argv) > 1 else "https://www.officems.co.za/"
-  limit = int(sys.argv[2]) if len(sys.argv) > 2 else 500
-  crawl_site(start, limit)
+  if len(sys.argv) > 1 and sys.argv[1] == "--reextract":
+    reextract_site(sys.argv[2] if len(sys.argv) > 2 else "kb/raw")
+  else:
+    start = sys.argv[1] if len(sys.argv) > 1 else "https://www.officems.co.za/"
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    crawl_site(start, limit)
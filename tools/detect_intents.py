@@ -1,9 +1,9 @@
 import os
 import json
-import glob
 from typing import Dict, Any, Optional, Iterable, List
 import yaml
 from openai import OpenAI
+from tools.doc_store import DocumentStore
 
 
 def _load_profile(profile_path: Optional[str]) -> Dict[str, Any]:
@@ -14,25 +14,17 @@ def _load_profile(profile_path: Optional[str]) -> Dict[str, Any]:
 
 
 def _sample_documents(raw_dir: str, limit: int = 12) -> List[Dict[str, str]]:
-  paths = sorted(
-    glob.glob(os.path.join(raw_dir, "*.json")),
-    key=lambda p: os.path.getsize(p),
-    reverse=True
-  )[:limit]
+  with DocumentStore(raw_dir) as store:
+    documents = store.largest(limit)
   samples = []
-  for path in paths:
-    try:
-      with open(path, "r", encoding="utf-8") as handle:
-        data = json.load(handle)
-      text = (data.get("text") or "")[:1500]
-      if not text.strip():
-        continue
-      samples.append({
-        "source": data.get("url") or data.get("label") or os.path.basename(path),
-        "snippet": text.strip()
-      })
-    except Exception:
+  for key, data in documents:
+    text = (data.get("text") or "")[:1500]
+    if not text.strip():
       continue
+    samples.append({
+      "source": data.get("url") or data.get("label") or key,
+      "snippet": text.strip()
+    })
   return samples
 
 
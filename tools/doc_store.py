@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import zlib
+import glob
+import struct
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+
+STORE_INDEX_NAME = "documents.sqlite"
+STORE_LOCK_NAME = "documents.lock"
+SEGMENT_NAME = "docs-{:06d}.seg"
+SEGMENT_RE = re.compile(r"^docs-(\d{6})\.seg$")
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+# Frame: key length, payload length, UTF-8 key, zlib-compressed JSON payload.
+# A zero payload length marks the key as deleted.
+FRAME_HEADER = struct.Struct(">HI")
+# Segments are rewritten once this share of their bytes belongs to replaced or deleted documents.
+COMPACT_GARBAGE_RATIO = 0.5
+
+# How often a writer waiting on another process's file lock tries again.
+LOCK_RETRY_INTERVAL = 0.05
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+class _StoreLock:
+  """
+  Serialises writers of one store: a thread lock within the process and an
+  ``flock`` on ``documents.lock`` across processes (the web app and an
+  external job worker). The file lock is polled rather than waited on, so a
+  waiting eventlet green thread still yields to the hub.
+  """
+
+  def __init__(self, raw_dir: str, lock: threading.Lock):
+    self.path = os.path.join(raw_dir, STORE_LOCK_NAME)
+    self.lock = lock
+    self._handle: Optional[Any] = None
+
+  def __enter__(self) -> "_StoreLock":
+    self.lock.acquire()
+    try:
+      if fcntl is not None:
+        if self._handle is None:
+          self._handle = open(self.path, "a")
+        while True:
+          try:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+          except BlockingIOError:
+            time.sleep(LOCK_RETRY_INTERVAL)
+    except BaseException:
+      self.lock.release()
+      raise
+    return self
+
+  def __exit__(self, *exc: Any) -> None:
+    try:
+      if self._handle is not None:
+        fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+    finally:
+      self.lock.release()
+
+  def close(self) -> None:
+    if self._handle is not None:
+      self._handle.close()
+      self._handle = None
+
+
+def _store_lock(raw_dir: str) -> _StoreLock:
+  key = os.path.abspath(raw_dir)
+  with _locks_guard:
+    lock = _locks.get(key)
+    if lock is None:
+      lock = threading.Lock()
+      _locks[key] = lock
+  return _StoreLock(raw_dir, lock)
+
+
+class DocumentRef(NamedTuple):
+  """Where one document's compressed payload lives; enough to read it without the index."""
+  key: str
+  path: str
+  offset: int
+  length: int
+
+
+def _decode(data: bytes) -> Dict[str, Any]:
+  return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def read_documents(refs: Iterable[DocumentRef]) -> Iterator[Tuple[DocumentRef, Optional[Dict[str, Any]]]]:
+  """
+  Read documents by reference, keeping each segment file open while consecutive
+  references point into it. Yields ``None`` for a document that cannot be read.
+  Safe to call in worker processes.
+  """
+  handle = None
+  current = None
+  try:
+    for ref in refs:
+      try:
+        if ref.path != current:
+          if handle:
+            handle.close()
+          handle = None
+          current = ref.path
+          handle = open(ref.path, "rb")
+        handle.seek(ref.offset)
+        yield ref, _decode(handle.read(ref.length))
+      except (OSError, zlib.error, ValueError):
+        yield ref, None
+  finally:
+    if handle:
+      handle.close()
+
+
+class DocumentStore:
+  """
+  Append-only store for the raw knowledge documents of one bot. Documents are
+  zlib-compressed JSON frames appended to ``docs-NNNNNN.seg`` files; a SQLite
+  index maps each key to its segment and offset and keeps the fields listings
+  need (URL, label, size), so counting, listing or picking the largest
+  documents never decompresses anything and a full scan is a few sequential
+  reads.
+
+  Replacing or deleting a document appends a new frame; ``compact`` rewrites
+  the segments once most of their bytes are dead. Frames carry their key, so
+  frames written after the last index commit (a crash mid-write) are
+  re-indexed on open. Writes, that recovery and compaction hold a lock
+  shared with other processes, so an open never cuts off a frame another
+  process is still appending. Loose ``*.json`` files from the old
+  one-file-per-document layout are imported the first time a directory is
+  opened.
+  """
+
+  def __init__(self, raw_dir: str):
+    self.raw_dir = raw_dir
+    self._lock = _store_lock(raw_dir)
+    self._readers: Dict[str, Any] = {}
+    os.makedirs(raw_dir, exist_ok=True)
+    self.conn = sqlite3.connect(os.path.join(raw_dir, STORE_INDEX_NAME))
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    self.conn.executescript(
+      """
+      CREATE TABLE IF NOT EXISTS documents (
+        key TEXT PRIMARY KEY,
+        segment INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        url TEXT,
+        label TEXT,
+        source_type TEXT,
+        content_hash TEXT
+      );
+      CREATE INDEX IF NOT EXISTS documents_position ON documents (segment, offset);
+      CREATE INDEX IF NOT EXISTS documents_size ON documents (size DESC);
+      CREATE TABLE IF NOT EXISTS segments (segment INTEGER PRIMARY KEY, bytes INTEGER NOT NULL);
+      """
+    )
+    with self._lock:
+      self._recover()
+      self._import_legacy()
+
+  def __enter__(self) -> "DocumentStore":
+    return self
+
+  def __exit__(self, *exc: Any) -> None:
+    self.close()
+
+  def _segment_path(self, segment: int) -> str:
+    return os.path.join(self.raw_dir, SEGMENT_NAME.format(segment))
+
+  def _segment_files(self) -> Dict[int, str]:
+    files = {}
+    for name in os.listdir(self.raw_dir):
+      match = SEGMENT_RE.match(name)
+      if match:
+        files[int(match.group(1))] = os.path.join(self.raw_dir, name)
+    return files
+
+  def _recover(self) -> None:
+    """Index frames appended after the last commit; drop segments a finished compaction left behind."""
+    recorded = dict(self.conn.execute("SELECT segment, bytes FROM segments"))
+    newest = max(recorded) if recorded else 0
+    for segment, path in sorted(self._segment_files().items()):
+      if segment not in recorded and segment < newest:
+        os.remove(path)
+        continue
+      start = recorded.get(segment, 0)
+      if os.path.getsize(path) > start:
+        self._reindex_tail(segment, path, start)
+
+  def _reindex_tail(self, segment: int, path: str, start: int) -> None:
+    end = start
+    with open(path, "rb") as handle, self.conn:
+      handle.seek(start)
+      while True:
+        header = handle.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+          break
+        key_length, length = FRAME_HEADER.unpack(header)
+        key = handle.read(key_length).decode("utf-8", errors="replace")
+        offset = handle.tell()
+        data = handle.read(length)
+        if len(key) == 0 or len(data) < length:
+          break
+        if length:
+          try:
+            payload = _decode(data)
+          except (zlib.error, ValueError):
+            break
+          self._index(key, segment, offset, data, payload)
+        else:
+          self.conn.execute("DELETE FROM documents WHERE key = ?", (key,))
+        end = handle.tell()
+      self.conn.execute("INSERT OR REPLACE INTO segments (segment, bytes) VALUES (?, ?)", (segment, end))
+    # A torn final frame is cut off so the next append starts on a frame boundary.
+    if os.path.getsize(path) > end:
+      with open(path, "r+b") as handle:
+        handle.truncate(end)
+
+  def _import_legacy(self) -> None:
+    imported = []
+    with self.conn:
+      for path in sorted(glob.glob(os.path.join(self.raw_dir, "*.json"))):
+        try:
+          with open(path, "r", encoding="utf-8") as handle:
+            payload = json.load(handle)
+        except (OSError, ValueError):
+          continue
+        self._put(os.path.splitext(os.path.basename(path))[0], payload)
+        imported.append(path)
+    for path in imported:
+      os.remove(path)
+
+  def _index(self, key: str, segment: int, offset: int, data: bytes, payload: Dict[str, Any]) -> None:
+    self.conn.execute(
+      "INSERT OR REPLACE INTO documents "
+      "(key, segment, offset, length, size, url, label, source_type, content_hash) "
+      "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+      (
+        key, segment, offset, len(data), len(payload.get("text") or ""),
+        payload.get("url"), payload.get("label"), payload.get("source_type"), payload.get("content_hash")
+      )
+    )
+
+  def _append(self, key: str, data: bytes) -> Tuple[int, int, int]:
+    """Append one frame to the newest segment; returns ``(segment, payload offset, segment end)``."""
+    row = self.conn.execute("SELECT segment, bytes FROM segments ORDER BY segment DESC LIMIT 1").fetchone()
+    segment, size = row if row else (1, 0)
+    encoded_key = key.encode("utf-8")
+    frame_size = FRAME_HEADER.size + len(encoded_key) + len(data)
+    if size and size + frame_size > SEGMENT_MAX_BYTES:
+      segment, size = segment + 1, 0
+    with open(self._segment_path(segment), "ab") as handle:
+      handle.seek(size)
+      handle.truncate()
+      handle.write(FRAME_HEADER.pack(len(encoded_key), len(data)))
+      handle.write(encoded_key)
+      handle.write(data)
+    return segment, size + FRAME_HEADER.size + len(encoded_key), size + frame_size
+
+  def _put(self, key: str, payload: Dict[str, Any]) -> None:
+    data = zlib.compress(
+      json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+      COMPRESSION_LEVEL
+    )
+    segment, offset, end = self._append(key, data)
+    self._index(key, segment, offset, data, payload)
+    self.conn.execute("INSERT OR REPLACE INTO segments (segment, bytes) VALUES (?, ?)", (segment, end))
+
+  def put(self, key: str, payload: Dict[str, Any]) -> str:
+    """Store ``payload`` under ``key``, replacing any document already there."""
+    with self._lock, self.conn:
+      self._put(key, payload)
+    return key
+
+  def delete(self, key: str) -> None:
+    with self._lock:
+      if key not in self:
+        return
+      segment, _, end = self._append(key, b"")
+      with self.conn:
+        self.conn.execute("DELETE FROM documents WHERE key = ?", (key,))
+        self.conn.execute("INSERT OR REPLACE INTO segments (segment, bytes) VALUES (?, ?)", (segment, end))
+
+  def __contains__(self, key: str) -> bool:
+    return self.conn.execute("SELECT 1 FROM documents WHERE key = ?", (key,)).fetchone() is not None
+
+  def __len__(self) -> int:
+    return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+  def _read(self, segment: int, offset: int, length: int) -> Dict[str, Any]:
+    path = self._segment_path(segment)
+    handle = self._readers.get(path)
+    if handle is None:
+      handle = self._readers[path] = open(path, "rb")
+    handle.seek(offset)
+    return _decode(handle.read(length))
+
+  def get(self, key: str) -> Optional[Dict[str, Any]]:
+    row = self.conn.execute("SELECT segment, offset, length FROM documents WHERE key = ?", (key,)).fetchone()
+    if row is None:
+      return None
+    try:
+      return self._read(*row)
+    except (OSError, zlib.error, ValueError):
+      return None
+
+  def refs(self) -> List[DocumentRef]:
+    """Every live document, in on-disk order."""
+    return [
+      DocumentRef(key, self._segment_path(segment), offset, length)
+      for key, segment, offset, length in self.conn.execute(
+        "SELECT key, segment, offset, length FROM documents ORDER BY segment, offset"
+      )
+    ]
+
+  def iter_documents(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """``(key, payload)`` for every readable document, scanning segments sequentially."""
+    for ref, payload in read_documents(self.refs()):
+      if payload is not None:
+        yield ref.key, payload
+
+  def largest(self, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """The ``limit`` documents with the most text."""
+    rows = self.conn.execute(
+      "SELECT key, segment, offset, length FROM documents ORDER BY size DESC, key LIMIT ?",
+      (limit,)
+    ).fetchall()
+    documents = []
+    for key, segment, offset, length in rows:
+      try:
+        documents.append((key, self._read(segment, offset, length)))
+      except (OSError, zlib.error, ValueError):
+        continue
+    return documents
+
+  def sources(self) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+    """``(url, label)`` of every document, read from the index alone."""
+    yield from self.conn.execute("SELECT url, label FROM documents ORDER BY segment, offset")
+
+  def stats(self) -> Dict[str, Any]:
+    documents, text_chars, live_bytes = self.conn.execute(
+      "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM documents"
+    ).fetchone()
+    segment_bytes = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM segments").fetchone()[0]
+    return {
+      "documents": documents,
+      "text_chars": text_chars,
+      "compressed_bytes": live_bytes,
+      "segment_bytes": segment_bytes,
+      "segments": self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+    }
+
+  def compact(self, force: bool = False) -> int:
+    """
+    Rewrite live documents into fresh segments if enough of the store is dead
+    weight (or ``force``). Returns the number of bytes reclaimed.
+    """
+    with self._lock:
+      stats = self.stats()
+      garbage = stats["segment_bytes"] - stats["compressed_bytes"]
+      if not stats["segment_bytes"] or (not force and garbage < COMPACT_GARBAGE_RATIO * stats["segment_bytes"]):
+        return 0
+      old_segments = [segment for (segment,) in self.conn.execute("SELECT segment FROM segments")]
+      rows = self.conn.execute("SELECT key, segment, offset, length FROM documents ORDER BY segment, offset").fetchall()
+      segment = max(old_segments) + 1
+      sizes = {segment: 0}
+      positions = []
+      handle = open(self._segment_path(segment), "wb")
+      try:
+        for key, old_segment, offset, length in rows:
+          with open(self._segment_path(old_segment), "rb") as source:
+            source.seek(offset)
+            data = source.read(length)
+          encoded_key = key.encode("utf-8")
+          frame_size = FRAME_HEADER.size + len(encoded_key) + len(data)
+          if sizes[segment] and sizes[segment] + frame_size > SEGMENT_MAX_BYTES:
+            handle.flush()
+            os.fsync(handle.fileno())
+            handle.close()
+            segment += 1
+            sizes[segment] = 0
+            handle = open(self._segment_path(segment), "wb")
+          handle.write(FRAME_HEADER.pack(len(encoded_key), len(data)))
+          handle.write(encoded_key)
+          handle.write(data)
+          positions.append((segment, sizes[segment] + FRAME_HEADER.size + len(encoded_key), key))
+          sizes[segment] += frame_size
+        handle.flush()
+        os.fsync(handle.fileno())
+      finally:
+        handle.close()
+      self._close_readers()
+      with self.conn:
+        self.conn.execute("DELETE FROM segments")
+        self.conn.executemany("INSERT INTO segments (segment, bytes) VALUES (?, ?)", sizes.items())
+        self.conn.executemany("UPDATE documents SET segment = ?, offset = ? WHERE key = ?", positions)
+      for old_segment in old_segments:
+        try:
+          os.remove(self._segment_path(old_segment))
+        except OSError:
+          pass
+      return garbage
+
+  def _close_readers(self) -> None:
+    for handle in self._readers.values():
+      handle.close()
+    self._readers = {}
+
+  def close(self) -> None:
+    self._close_readers()
+    self.conn.close()
+    self._lock.close()
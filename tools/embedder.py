@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+import os
+import time
+import random
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Callable, Tuple
+import numpy as np
+import openai
+from openai import OpenAI
+
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+ProgressCallback = Optional[Callable[[str, str], None]]
+
+# Account-wide quota shared by every bot building in this process.
+EMBEDDING_TOKENS_PER_MINUTE = int(os.environ.get("EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.environ.get("EMBEDDING_REQUESTS_PER_MINUTE", "3000"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "6"))
+
+# The API accepts at most 2048 inputs and 300k tokens per request; stay well below.
+MAX_BATCH_ITEMS = 256
+MAX_BATCH_TOKENS = 60000
+MIN_BATCH_TOKENS = 2000
+INITIAL_BATCH_TOKENS = 16000
+
+
+def _notify(callback: ProgressCallback, kind: str, message: str) -> None:
+  if callback:
+    callback(kind, message)
+
+
+class TokenBucket:
+  """Thread-safe token bucket refilled continuously at ``rate_per_minute``."""
+
+  def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+    self.rate = rate_per_minute / 60.0
+    self.capacity = capacity if capacity is not None else rate_per_minute
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def _refill(self) -> None:
+    now = time.monotonic()
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def acquire(self, amount: float = 1.0) -> float:
+    """Block until ``amount`` tokens are available; returns the time spent waiting."""
+    amount = min(amount, self.capacity)
+    waited = 0.0
+    while True:
+      with self._lock:
+        self._refill()
+        if self.tokens >= amount:
+          self.tokens -= amount
+          return waited
+        delay = (amount - self.tokens) / self.rate
+      time.sleep(delay)
+      waited += delay
+
+  def penalize(self, seconds: float) -> None:
+    """Drain the bucket so every caller pauses for ``seconds`` (e.g. after a 429)."""
+    with self._lock:
+      self._refill()
+      self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RateLimiter:
+  """Paired token and request buckets enforcing the embedding quota."""
+
+  def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+    self.tokens = TokenBucket(tokens_per_minute)
+    self.requests = TokenBucket(requests_per_minute)
+
+  def acquire(self, tokens: int) -> float:
+    return self.requests.acquire(1) + self.tokens.acquire(tokens)
+
+  def penalize(self, seconds: float) -> None:
+    self.tokens.penalize(seconds)
+    self.requests.penalize(seconds)
+
+
+_shared_limiter: Optional[RateLimiter] = None
+_shared_limiter_lock = threading.Lock()
+
+
+def shared_rate_limiter() -> RateLimiter:
+  """Return the process-wide limiter used by all concurrent index builds."""
+  global _shared_limiter
+  with _shared_limiter_lock:
+    if _shared_limiter is None:
+      _shared_limiter = RateLimiter(EMBEDDING_TOKENS_PER_MINUTE, EMBEDDING_REQUESTS_PER_MINUTE)
+    return _shared_limiter
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+  response = getattr(exc, "response", None)
+  headers = getattr(response, "headers", None) or {}
+  try:
+    if headers.get("retry-after-ms"):
+      return float(headers["retry-after-ms"]) / 1000.0
+    if headers.get("retry-after"):
+      return float(headers["retry-after"])
+  except (TypeError, ValueError):
+    return None
+  return None
+
+
+def _is_retryable(exc: Exception) -> bool:
+  if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+    return True
+  if isinstance(exc, openai.APIStatusError):
+    return exc.status_code >= 500 or exc.status_code in (408, 409)
+  return False
+
+
+class Embedder:
+  """
+  Pipelined embedding client: keeps up to ``concurrency`` requests in flight,
+  sizes batches by estimated tokens (shrinking after rate limits, growing while
+  healthy) and retries transient failures with exponential backoff.
+  """
+
+  def __init__(
+    self,
+    client: Optional[OpenAI] = None,
+    concurrency: int = EMBEDDING_CONCURRENCY,
+    limiter: Optional[RateLimiter] = None,
+    max_retries: int = EMBEDDING_MAX_RETRIES,
+    progress_callback: ProgressCallback = None
+  ):
+    if client is None:
+      api_key = os.environ.get("OPENAI_API_KEY")
+      if not api_key:
+        raise RuntimeError("OPENAI_API_KEY not configured")
+      # Retries are handled here so they are visible to the limiter.
+      client = OpenAI(api_key=api_key, max_retries=0)
+    self.client = client
+    self.concurrency = max(1, concurrency)
+    self.limiter = limiter or shared_rate_limiter()
+    self.max_retries = max_retries
+    self.progress_callback = progress_callback
+    self.batch_tokens = INITIAL_BATCH_TOKENS
+    self.retries = 0
+    self._lock = threading.Lock()
+
+  def _shrink(self) -> None:
+    with self._lock:
+      self.batch_tokens = max(MIN_BATCH_TOKENS, self.batch_tokens // 2)
+
+  def _grow(self) -> None:
+    with self._lock:
+      self.batch_tokens = min(MAX_BATCH_TOKENS, int(self.batch_tokens * 1.25))
+
+  def _embed_batch(self, texts: List[str], tokens: int) -> np.ndarray:
+    attempt = 0
+    while True:
+      self.limiter.acquire(tokens)
+      try:
+        response = self.client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+      except Exception as exc:
+        if not _is_retryable(exc) or attempt >= self.max_retries:
+          raise
+        attempt += 1
+        with self._lock:
+          self.retries += 1
+        delay = _retry_after(exc)
+        if delay is None:
+          delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+        if isinstance(exc, openai.RateLimitError):
+          self._shrink()
+          self.limiter.penalize(delay)
+        _notify(
+          self.progress_callback,
+          "warning",
+          f"Embedding request failed ({exc.__class__.__name__}); retry {attempt}/{self.max_retries} in {delay:.1f}s"
+        )
+        time.sleep(delay)
+        continue
+      self._grow()
+      ordered = sorted(response.data, key=lambda item: item.index)
+      return np.array([item.embedding for item in ordered], dtype="float32")
+
+  def _batches(self, chunks: Iterable[Dict[str, Any]]) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+    batch: List[Dict[str, Any]] = []
+    batch_tokens = 0
+    for chunk in chunks:
+      tokens = int(chunk.get("token_estimate") or 1)
+      if batch and (batch_tokens + tokens > self.batch_tokens or len(batch) >= MAX_BATCH_ITEMS):
+        yield batch, batch_tokens
+        batch, batch_tokens = [], 0
+      batch.append(chunk)
+      batch_tokens += tokens
+    if batch:
+      yield batch, batch_tokens
+
+  def iter_embeddings(
+    self,
+    chunks: Iterable[Dict[str, Any]]
+  ) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+    """Yield ``(chunks, vectors)`` per batch in input order while later batches are in flight."""
+    in_flight: collections.deque = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=self.concurrency)
+    try:
+      for batch, tokens in self._batches(chunks):
+        future: Future = executor.submit(self._embed_batch, [chunk["text"] for chunk in batch], tokens)
+        in_flight.append((batch, future))
+        while len(in_flight) >= self.concurrency:
+          done_batch, done_future = in_flight.popleft()
+          yield done_batch, done_future.result()
+      while in_flight:
+        done_batch, done_future = in_flight.popleft()
+        yield done_batch, done_future.result()
+    finally:
+      # Do not keep paying for batches nobody will consume after a failure.
+      executor.shutdown(wait=True, cancel_futures=True)
+
+  def embed_chunks(self, chunks: List[Dict[str, Any]]) -> np.ndarray:
+    """Embed ``chunks`` and return one row per chunk, in order."""
+    if not chunks:
+      return np.empty((0, 0), dtype="float32")
+    total_tokens = sum(int(chunk.get("token_estimate") or 1) for chunk in chunks)
+    vectors = []
+    done_tokens = 0
+    for batch, batch_vectors in self.iter_embeddings(chunks):
+      vectors.append(batch_vectors)
+      done_tokens += sum(int(chunk.get("token_estimate") or 1) for chunk in batch)
+      _notify(
+        self.progress_callback,
+        "info",
+        f"Embedded {done_tokens}/{total_tokens} tokens ({len(vectors)} batches, {self.batch_tokens} tokens/batch)"
+      )
+    return np.concatenate(vectors)
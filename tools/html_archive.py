@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import os
+import re
+import gzip
+import uuid
+import base64
+import hashlib
+import sqlite3
+import datetime
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+
+ARCHIVE_DIR_NAME = "archive"
+ARCHIVE_INDEX_NAME = "archive.sqlite"
+WARC_RE = re.compile(r"^crawl-\d{8}T\d{6}-[0-9a-f]{8}\.warc\.gz$")
+
+
+def default_archive_path(output_dir: str) -> str:
+  """The archive lives next to the raw directory so clearing raw/ keeps it."""
+  return os.path.join(os.path.dirname(os.path.abspath(output_dir)), ARCHIVE_DIR_NAME)
+
+
+class ArchivedPage(NamedTuple):
+  url: str
+  html: str
+  content_type: str
+  status_code: int
+  fetched_at: str
+
+
+def _warc_record(url: str, body: bytes, fetched_at: str) -> bytes:
+  digest = base64.b32encode(hashlib.sha1(body).digest()).decode("ascii")
+  headers = [
+    "WARC/1.1",
+    "WARC-Type: resource",
+    f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>",
+    f"WARC-Date: {fetched_at}",
+    f"WARC-Target-URI: {url}",
+    f"WARC-Payload-Digest: sha1:{digest}",
+    "Content-Type: text/html; charset=utf-8",
+    f"Content-Length: {len(body)}"
+  ]
+  return ("\r\n".join(headers) + "\r\n\r\n").encode("utf-8") + body + b"\r\n\r\n"
+
+
+def _warcinfo_record(created_at: str) -> bytes:
+  body = b"software: IntelliBot crawler\r\nformat: WARC File Format 1.1\r\n"
+  headers = [
+    "WARC/1.1",
+    "WARC-Type: warcinfo",
+    f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>",
+    f"WARC-Date: {created_at}",
+    "Content-Type: application/warc-fields",
+    f"Content-Length: {len(body)}"
+  ]
+  return ("\r\n".join(headers) + "\r\n\r\n").encode("utf-8") + body + b"\r\n\r\n"
+
+
+def read_record(path: str, offset: int, length: int) -> Tuple[dict, bytes]:
+  """Decompress one record (its own gzip member) and split it into WARC headers and body."""
+  with open(path, "rb") as handle:
+    handle.seek(offset)
+    record = gzip.decompress(handle.read(length))
+  head, _, rest = record.partition(b"\r\n\r\n")
+  headers = {}
+  for line in head.decode("utf-8", errors="replace").split("\r\n")[1:]:
+    name, _, value = line.partition(":")
+    headers[name.strip()] = value.strip()
+  return headers, rest[:int(headers.get("Content-Length", len(rest)))]
+
+
+class HtmlArchive:
+  """
+  Fetched HTML kept as WARC ``resource`` records, each its own gzip member, so
+  the files open in standard WARC tooling and any record decompresses on its
+  own. Every crawl appends to a new ``crawl-<time>.warc.gz``; a SQLite index
+  keeps the latest record per URL, and files whose records have all been
+  superseded are pruned. Bodies are stored decoded as UTF-8 so re-extraction
+  sees exactly the HTML the crawl extracted.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self._dirty = 0
+    self._handle = None
+    self._file: Optional[str] = None
+    os.makedirs(path, exist_ok=True)
+    self.conn = sqlite3.connect(os.path.join(path, ARCHIVE_INDEX_NAME))
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    self.conn.execute(
+      """
+      CREATE TABLE IF NOT EXISTS records (
+        url TEXT PRIMARY KEY,
+        file TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        content_type TEXT,
+        status_code INTEGER,
+        fetched_at TEXT
+      )
+      """
+    )
+
+  def _writer(self):
+    if self._handle is None:
+      now = datetime.datetime.utcnow()
+      self._file = f"crawl-{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.warc.gz"
+      self._handle = open(os.path.join(self.path, self._file), "ab")
+      self._handle.write(gzip.compress(_warcinfo_record(now.isoformat() + "Z")))
+    return self._handle
+
+  def add(self, url: str, html: str, content_type: str, status_code: int) -> None:
+    fetched_at = datetime.datetime.utcnow().isoformat() + "Z"
+    member = gzip.compress(_warc_record(url, html.encode("utf-8"), fetched_at))
+    handle = self._writer()
+    offset = handle.tell()
+    handle.write(member)
+    self.conn.execute(
+      "INSERT OR REPLACE INTO records (url, file, offset, length, content_type, status_code, fetched_at) "
+      "VALUES (?, ?, ?, ?, ?, ?, ?)",
+      (url, self._file, offset, len(member), content_type, status_code, fetched_at)
+    )
+    self._dirty += 1
+    if self._dirty >= 50:
+      self.save()
+
+  def __len__(self) -> int:
+    return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+  def iter_pages(self) -> Iterator[ArchivedPage]:
+    """The latest archived response for every URL, read file by file in on-disk order."""
+    self.save()
+    rows = self.conn.execute(
+      "SELECT url, file, offset, length, content_type, status_code, fetched_at FROM records ORDER BY file, offset"
+    ).fetchall()
+    for url, name, offset, length, content_type, status_code, fetched_at in rows:
+      try:
+        _, body = read_record(os.path.join(self.path, name), offset, length)
+      except (OSError, EOFError, ValueError, gzip.BadGzipFile):
+        continue
+      yield ArchivedPage(url, body.decode("utf-8", errors="replace"), content_type or "", status_code or 200, fetched_at)
+
+  def prune(self) -> int:
+    """Delete archive files none of whose records are still the latest; returns how many."""
+    self.save()
+    live = {name for (name,) in self.conn.execute("SELECT DISTINCT file FROM records")}
+    removed = 0
+    for name in os.listdir(self.path):
+      if WARC_RE.match(name) and name not in live and name != self._file:
+        os.remove(os.path.join(self.path, name))
+        removed += 1
+    return removed
+
+  def save(self) -> None:
+    if self._handle:
+      self._handle.flush()
+    self.conn.commit()
+    self._dirty = 0
+
+  def close(self) -> None:
+    self.save()
+    if self._handle:
+      self._handle.close()
+      self._handle = None
+    self.conn.close()
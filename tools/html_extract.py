@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import re
+import urllib.parse
+from typing import Optional, Dict, Any, List, Iterator
+import lxml.html
+from lxml import etree
+import trafilatura
+
+
+# Same settings trafilatura uses for its own parse, so the tree we hand it is
+# indistinguishable from one it would have built.
+HTML_PARSER = lxml.html.HTMLParser(
+  collect_ids=False,
+  default_doctype=False,
+  encoding="utf-8",
+  remove_comments=True,
+  remove_pis=True
+)
+SKIPPED_TEXT_TAGS = frozenset({"script", "style", "noscript"})
+
+
+def normalize_whitespace(text: str) -> str:
+  text = re.sub(r"[ \t]+", " ", text)
+  text = re.sub(r"\s+\n", "\n", text)
+  return text.strip()
+
+
+def normalize_url(url: str, base: str) -> Optional[str]:
+  merged = urllib.parse.urljoin(base, url.split("#")[0])
+  parsed = urllib.parse.urlparse(merged)
+  if not parsed.scheme or not parsed.netloc:
+    return None
+  return urllib.parse.urlunparse(
+    (parsed.scheme, parsed.netloc, parsed.path.rstrip("/") or "/", "", "", "")
+  )
+
+
+def parse_html(html: str) -> Optional[lxml.html.HtmlElement]:
+  """Parse a page once; returns ``None`` for empty or unparseable input."""
+  if not html or not html.strip():
+    return None
+  try:
+    return lxml.html.fromstring(html.encode("utf-8"), parser=HTML_PARSER)
+  except (etree.ParserError, ValueError):
+    return None
+
+
+def _node_text(node: lxml.html.HtmlElement) -> str:
+  return " ".join(piece.strip() for piece in node.itertext() if piece.strip())
+
+
+def _iter_visible_text(node: lxml.html.HtmlElement) -> Iterator[str]:
+  if not isinstance(node.tag, str) or node.tag in SKIPPED_TEXT_TAGS:
+    return
+  if node.text:
+    yield node.text
+  for child in node:
+    yield from _iter_visible_text(child)
+    if child.tail:
+      yield child.tail
+
+
+def _canonical_url(tree: lxml.html.HtmlElement, url: str) -> str:
+  links = tree.xpath("//link[contains(concat(' ', normalize-space(@rel), ' '), ' canonical ')]")
+  if not links or not links[0].get("href"):
+    return url
+  candidate = urllib.parse.urljoin(url, links[0].get("href"))
+  return candidate.strip() or url
+
+
+def _collect_headings(tree: lxml.html.HtmlElement) -> Dict[str, List[str]]:
+  headings: Dict[str, List[str]] = {"h1": [], "h2": [], "h3": []}
+  for node in tree.iter("h1", "h2", "h3"):
+    text = normalize_whitespace(_node_text(node))
+    if text:
+      headings[node.tag].append(text)
+  return headings
+
+
+def _clean_text(tree: lxml.html.HtmlElement, url: str) -> str:
+  # trafilatura copies a tree it is given, so ours stays usable for the fallback.
+  text = trafilatura.extract(
+    tree,
+    url=url,
+    output_format="txt",
+    include_links=False
+  ) or ""
+  if text.strip():
+    return normalize_whitespace(text)
+  pieces = (piece.strip() for piece in _iter_visible_text(tree))
+  return normalize_whitespace(" ".join(piece for piece in pieces if piece))
+
+
+def extract_page(html: str, url: str) -> Dict[str, Any]:
+  """
+  Extract canonical URL, title, meta description, headings, links and main
+  text from one page, all from a single lxml parse.
+  """
+  tree = parse_html(html)
+  if tree is None:
+    return {
+      "canonical": url,
+      "title": "",
+      "meta_description": "",
+      "headings": {"h1": [], "h2": [], "h3": []},
+      "links": [],
+      "text": ""
+    }
+
+  canonical = _canonical_url(tree, url)
+
+  title_node = tree.find(".//title")
+  title = _node_text(title_node) if title_node is not None else ""
+
+  meta_description = ""
+  metas = tree.xpath("//meta[@name='description'][@content]")
+  if metas:
+    meta_description = normalize_whitespace(metas[0].get("content"))
+
+  links = []
+  for node in tree.iter("a"):
+    href = node.get("href")
+    if href is None:
+      continue
+    normalized = normalize_url(href, canonical)
+    if normalized:
+      links.append(normalized)
+
+  return {
+    "canonical": canonical,
+    "title": title,
+    "meta_description": meta_description,
+    "headings": _collect_headings(tree),
+    "links": links,
+    "text": _clean_text(tree, canonical)
+  }
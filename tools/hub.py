@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+try:
+  from eventlet import patcher, tpool
+except ImportError:
+  patcher = tpool = None
+
+
+T = TypeVar("T")
+StallCallback = Optional[Callable[[float], None]]
+
+
+def hub_active() -> bool:
+  """True when threads are eventlet green threads sharing one OS thread."""
+  return patcher is not None and patcher.is_monkey_patched("thread")
+
+
+def _capture(func: Callable[..., T], args: tuple, kwargs: Dict[str, Any]) -> Any:
+  try:
+    return True, func(*args, **kwargs)
+  except BaseException as exc:
+    return False, exc
+
+
+def offload(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+  """
+  Run CPU-bound ``func`` on a native thread from eventlet's thread pool so the
+  hub keeps serving other clients meanwhile; without eventlet it is a plain
+  call. ``func`` runs outside the hub, so it must not take locks, sockets or
+  other monkey-patched primitives: pass it data and files, not services.
+  """
+  if not hub_active():
+    return func(*args, **kwargs)
+  # tpool prints a traceback for every exception it forwards; raise it here instead.
+  ok, value = tpool.execute(_capture, func, args, kwargs)
+  if not ok:
+    raise value
+  return value
+
+
+class HubLatencyMonitor:
+  """
+  Detects event-loop stalls: a green thread sleeps ``interval`` seconds and
+  measures how late it wakes up. Lateness above ``threshold`` means something
+  held the hub that long, and is counted and passed to ``on_stall``.
+  """
+
+  def __init__(self, threshold: float, interval: Optional[float] = None, on_stall: StallCallback = None):
+    self.threshold = threshold
+    self.interval = interval if interval is not None else max(0.05, threshold / 2)
+    self.on_stall = on_stall
+    self.stalls = 0
+    self.max_lag = 0.0
+    self.total_stalled = 0.0
+    self.last_stall_at: Optional[float] = None
+    self._stop = threading.Event()
+    self._thread: Optional[threading.Thread] = None
+
+  def start(self) -> "HubLatencyMonitor":
+    if self._thread is None and self.threshold > 0:
+      self._thread = threading.Thread(target=self._run, name="hub-latency-monitor", daemon=True)
+      self._thread.start()
+    return self
+
+  def _run(self) -> None:
+    while not self._stop.is_set():
+      expected = time.monotonic() + self.interval
+      time.sleep(self.interval)
+      lag = time.monotonic() - expected
+      self.max_lag = max(self.max_lag, lag)
+      if lag < self.threshold:
+        continue
+      self.stalls += 1
+      self.total_stalled += lag
+      self.last_stall_at = time.time()
+      if self.on_stall:
+        self.on_stall(lag)
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "running": self._thread is not None and not self._stop.is_set(),
+      "threshold_ms": round(self.threshold * 1000),
+      "stalls": self.stalls,
+      "max_lag_ms": round(self.max_lag * 1000, 1),
+      "stalled_ms": round(self.total_stalled * 1000, 1),
+      "last_stall_at": self.last_stall_at
+    }
+
+  def stop(self) -> None:
+    self._stop.set()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+from typing import List, Dict, Any, Iterator, Set, Tuple
+import numpy as np
+
+
+CHECKPOINT_DIR = "checkpoint"
+VECTORS_NAME = "vectors.f32"
+CHUNKS_NAME = "chunks.jsonl"
+COMMITS_NAME = "commits.jsonl"
+
+
+def _fsync(handle) -> None:
+  handle.flush()
+  os.fsync(handle.fileno())
+
+
+class EmbeddingCheckpoint:
+  """
+  Append-only record of embedding batches for an in-progress index build.
+
+  Each batch appends raw float32 rows to ``vectors.f32`` and one metadata line
+  per row to ``chunks.jsonl``; only once both are synced is a line written to
+  ``commits.jsonl``. On reopen, anything past the last commit is truncated, so
+  a crash mid-batch loses at most that batch.
+  """
+
+  def __init__(self, index_dir: str):
+    self.path = os.path.join(index_dir, CHECKPOINT_DIR)
+    self.vectors_path = os.path.join(self.path, VECTORS_NAME)
+    self.chunks_path = os.path.join(self.path, CHUNKS_NAME)
+    self.commits_path = os.path.join(self.path, COMMITS_NAME)
+    self.batches = 0
+    self.rows = 0
+    self.dimension = 0
+    self.chunk_bytes = 0
+    self.hashes: Set[str] = set()
+    self._open()
+
+  def _last_commit(self) -> Dict[str, Any]:
+    last: Dict[str, Any] = {}
+    if not os.path.exists(self.commits_path):
+      return last
+    with open(self.commits_path, "r", encoding="utf-8") as handle:
+      for line in handle:
+        try:
+          last = json.loads(line)
+        except ValueError:
+          # A torn final line means that commit never completed.
+          break
+    return last
+
+  def _open(self) -> None:
+    os.makedirs(self.path, exist_ok=True)
+    commit = self._last_commit()
+    self.batches = int(commit.get("batch", 0))
+    self.rows = int(commit.get("rows", 0))
+    self.dimension = int(commit.get("dimension", 0))
+    self.chunk_bytes = int(commit.get("chunk_bytes", 0))
+
+    with open(self.vectors_path, "ab") as handle:
+      handle.truncate(self.rows * self.dimension * 4)
+    with open(self.chunks_path, "ab") as handle:
+      handle.truncate(self.chunk_bytes)
+    with open(self.commits_path, "a", encoding="utf-8") as handle:
+      pass
+    self._rewrite_commits_if_torn()
+
+    with open(self.chunks_path, "r", encoding="utf-8") as handle:
+      for line in handle:
+        if line.strip():
+          self.hashes.add(json.loads(line)["chunk_hash"])
+
+  def _rewrite_commits_if_torn(self) -> None:
+    with open(self.commits_path, "r", encoding="utf-8") as handle:
+      lines = handle.readlines()
+    valid = []
+    for line in lines:
+      try:
+        json.loads(line)
+      except ValueError:
+        break
+      valid.append(line)
+    if len(valid) != len(lines):
+      with open(self.commits_path, "w", encoding="utf-8") as handle:
+        handle.writelines(valid)
+        _fsync(handle)
+
+  @property
+  def resumed(self) -> bool:
+    return self.batches > 0
+
+  def append_batch(self, metadata: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+    """Durably append one embedded batch and commit it."""
+    if not metadata:
+      return
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if self.dimension and vectors.shape[1] != self.dimension:
+      raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match checkpoint ({self.dimension})")
+    with open(self.vectors_path, "ab") as handle:
+      handle.write(vectors.tobytes())
+      _fsync(handle)
+    encoded = "".join(json.dumps(meta, ensure_ascii=False) + "\n" for meta in metadata).encode("utf-8")
+    with open(self.chunks_path, "ab") as handle:
+      handle.write(encoded)
+      _fsync(handle)
+
+    self.batches += 1
+    self.rows += len(metadata)
+    self.dimension = int(vectors.shape[1])
+    self.chunk_bytes += len(encoded)
+    self.hashes.update(meta["chunk_hash"] for meta in metadata)
+    commit = {
+      "batch": self.batches,
+      "rows": self.rows,
+      "dimension": self.dimension,
+      "chunk_bytes": self.chunk_bytes
+    }
+    with open(self.commits_path, "a", encoding="utf-8") as handle:
+      handle.write(json.dumps(commit) + "\n")
+      _fsync(handle)
+
+  def iter_blocks(self, block_rows: int = 2048) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+    """Yield committed rows as ``(metadata, vectors)`` blocks without loading the whole file."""
+    if not self.rows:
+      return
+    vectors = np.memmap(self.vectors_path, dtype="float32", mode="r", shape=(self.rows, self.dimension))
+    block: List[Dict[str, Any]] = []
+    start = 0
+    with open(self.chunks_path, "r", encoding="utf-8") as handle:
+      for line in handle:
+        if not line.strip():
+          continue
+        block.append(json.loads(line))
+        if len(block) >= block_rows:
+          yield block, np.asarray(vectors[start:start + len(block)])
+          start += len(block)
+          block = []
+    if block:
+      yield block, np.asarray(vectors[start:start + len(block)])
+    del vectors
+
+  def clear(self) -> None:
+    shutil.rmtree(self.path, ignore_errors=True)
@@ -1,143 +1,300 @@
 #!/usr/bin/env python3
 import os
 import json
-import glob
-import math
-import hashlib
+import time
+import queue
 import datetime
-from typing import List, Dict, Any, Tuple, Optional, Callable
-import numpy as np
-from openai import OpenAI
+import threading
+from typing import List, Dict, Any, Iterable, Iterator, Set, Tuple, Optional, Callable
+from tools.chunking import chunk_document, load_and_chunk
+from tools.doc_store import DocumentRef, DocumentStore
+from tools.embedder import Embedder
+from tools.hub import offload
+from tools.parallel import batched, ordered_map, process_pool, worker_count
+from tools.index_checkpoint import EmbeddingCheckpoint
+from tools.index_segments import (
+  SegmentWriter,
+  add_tombstones,
+  live_chunk_hashes,
+  load_manifest,
+  index_summary,
+)
 
 
 ProgressCallback = Optional[Callable[[str, str], None]]
 
+DOCUMENT_BATCH_SIZE = 64
+PARALLEL_MIN_DOCUMENTS = 512
+
+_build_locks: Dict[str, threading.Lock] = {}
+_build_locks_guard = threading.Lock()
+
 
 def _notify(callback: ProgressCallback, kind: str, message: str) -> None:
   if callback:
     callback(kind, message)
 
 
-def _load_documents(raw_dir: str, progress_callback: ProgressCallback = None) -> List[Dict[str, Any]]:
-  doc_paths = glob.glob(os.path.join(raw_dir, "*.json"))
-  documents: List[Dict[str, Any]] = []
-  _notify(progress_callback, "info", f"Loading {len(doc_paths)} knowledge documents...")
-  for path in doc_paths:
-    try:
-      with open(path, "r", encoding="utf-8") as handle:
-        doc = json.load(handle)
-      doc["__path"] = path
-      documents.append(doc)
-    except Exception:
-      _notify(progress_callback, "warning", f"Skipping malformed document: {path}")
-  return documents
-
-
-def _paragraphs(text: str) -> List[str]:
-  blocks = []
-  current = []
-  for line in text.splitlines():
-    stripped = line.strip()
-    if not stripped:
-      if current:
-        blocks.append(" ".join(current))
-        current = []
-      continue
-    current.append(stripped)
-  if current:
-    blocks.append(" ".join(current))
-  return blocks
-
-
-def _chunk_document(
-  doc: Dict[str, Any],
-  target_size: int,
-  overlap: int
-) -> List[Dict[str, Any]]:
-  paragraphs = _paragraphs(doc.get("text", ""))
-  if not paragraphs:
-    return []
-
-  max_size = max(target_size, 300)
-  overlap = min(overlap, max_size // 2)
-  chunks = []
-  buffer: List[str] = []
-  current_len = 0
-
-  for para in paragraphs:
-    para_len = len(para)
-    if current_len + para_len > max_size and buffer:
-      chunk_text = " ".join(buffer).strip()
-      if chunk_text:
-        chunks.append(chunk_text)
-      if overlap > 0 and buffer:
-        overlap_text = " ".join(buffer)[-overlap:]
-        buffer = [overlap_text, para]
-        current_len = len(overlap_text) + para_len
-      else:
-        buffer = [para]
-        current_len = para_len
-      continue
-    buffer.append(para)
-    current_len += para_len
-
-  final = " ".join(buffer).strip()
-  if final:
-    chunks.append(final)
-
-  structured = []
-  headings = doc.get("headings") or {}
-  primary_heading = ""
-  for level in ("h1", "h2", "h3"):
-    items = headings.get(level) or []
-    if items:
-      primary_heading = items[0]
-      break
-
-  doc_hash = doc.get("content_hash") or hashlib.sha1(doc.get("text", "").encode("utf-8")).hexdigest()
-  for idx, chunk_text in enumerate(chunks):
-    chunk_hash = hashlib.sha1(f"{doc_hash}::{idx}::{chunk_text}".encode("utf-8")).hexdigest()
-    structured.append({
-      "doc_hash": doc_hash,
-      "chunk_index": idx,
-      "chunk_hash": chunk_hash,
-      "text": chunk_text,
-      "url": doc.get("url") or doc.get("label") or "",
-      "title": doc.get("title") or primary_heading or doc.get("label") or "Untitled",
-      "source_type": doc.get("source_type") or "unknown",
-      "meta_description": doc.get("meta_description") or "",
-      "headings": headings,
-      "token_estimate": math.ceil(len(chunk_text) / 4),
-      "extracted_at": doc.get("extracted_at"),
-      "content_type": doc.get("content_type"),
-      "status_code": doc.get("status_code", 200)
-    })
-  return structured
-
-
-def _load_existing_index(index_dir: str) -> Tuple[List[Dict[str, Any]], np.ndarray]:
-  meta_path = os.path.join(index_dir, "meta.json")
-  embeddings_path = os.path.join(index_dir, "embeddings.npy")
-  if not os.path.exists(meta_path) or not os.path.exists(embeddings_path):
-    return [], np.empty((0,), dtype="float32")
+def _document_refs(raw_dir: str) -> List[DocumentRef]:
+  with DocumentStore(raw_dir) as store:
+    return store.refs()
+
+
+def _iter_chunks(
+  documents: Iterable[Dict[str, Any]],
+  chunk_size: int,
+  chunk_overlap: int
+) -> Iterator[Dict[str, Any]]:
+  for doc in documents:
+    for chunk in offload(chunk_document, doc, chunk_size, chunk_overlap):
+      yield chunk
+
+
+def _iter_chunk_batches(
+  doc_refs: List[DocumentRef],
+  chunk_size: int,
+  chunk_overlap: int,
+  workers: int,
+  progress_callback: ProgressCallback = None
+) -> Iterator[List[Dict[str, Any]]]:
+  """
+  Yield chunk batches in document order. Large corpora are parsed and chunked
+  in a process pool; small ones stay in-process to avoid worker start-up cost.
+  """
+  _notify(progress_callback, "info", f"Loading {len(doc_refs)} knowledge documents...")
+  # References are in on-disk order, so every batch is one sequential read.
+  ref_batches = batched(doc_refs, DOCUMENT_BATCH_SIZE)
+  if workers <= 1 or len(doc_refs) < PARALLEL_MIN_DOCUMENTS:
+    results = (offload(load_and_chunk, refs, chunk_size, chunk_overlap) for refs in ref_batches)
+    for chunks, skipped in results:
+      for key in skipped:
+        _notify(progress_callback, "warning", f"Skipping malformed document: {key}")
+      yield chunks
+    return
+
+  _notify(progress_callback, "info", f"Chunking documents with {workers} worker processes...")
+  with process_pool(workers) as executor:
+    results = ordered_map(
+      executor,
+      load_and_chunk,
+      ref_batches,
+      chunk_size,
+      chunk_overlap,
+      window=workers * 4
+    )
+    for chunks, skipped in results:
+      for key in skipped:
+        _notify(progress_callback, "warning", f"Skipping malformed document: {key}")
+      yield chunks
+
+
+def _chunk_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+  return {
+    "chunk_hash": chunk["chunk_hash"],
+    "doc_hash": chunk["doc_hash"],
+    "text": chunk["text"],
+    "url": chunk["url"],
+    "title": chunk["title"],
+    "source_type": chunk["source_type"],
+    "meta_description": chunk["meta_description"],
+    "headings": chunk["headings"],
+    "token_estimate": chunk["token_estimate"],
+    "extracted_at": chunk["extracted_at"],
+    "content_type": chunk["content_type"],
+    "status_code": chunk["status_code"]
+  }
+
+
+def _build_lock(index_dir: str) -> threading.Lock:
+  key = os.path.abspath(index_dir)
+  with _build_locks_guard:
+    return _build_locks.setdefault(key, threading.Lock())
+
+
+def _seal_checkpoint(index_dir: str, checkpoint: EmbeddingCheckpoint, wanted: Set[str]) -> Tuple[Optional[str], int]:
+  """Stream the checkpoint rows still wanted into a new memory-mapped segment."""
+  rows = len(wanted & checkpoint.hashes)
+  if not rows:
+    return None, 0
+  writer = SegmentWriter(index_dir, rows, checkpoint.dimension)
   try:
-    with open(meta_path, "r", encoding="utf-8") as handle:
-      metadata = json.load(handle)
-    embeddings = np.load(embeddings_path)
-    return metadata, embeddings
+    for metadata, vectors in checkpoint.iter_blocks():
+      keep = [row for row, meta in enumerate(metadata) if meta["chunk_hash"] in wanted]
+      if keep:
+        writer.write([metadata[row] for row in keep], vectors[keep])
   except Exception:
-    return [], np.empty((0,), dtype="float32")
+    writer.abort()
+    raise
+  return writer.commit(), rows
 
 
-def _reuse_embeddings(metadata: List[Dict[str, Any]], embeddings: np.ndarray) -> Tuple[Dict[str, np.ndarray], int]:
-  reused = {}
-  count = 0
-  if not metadata or embeddings.size == 0:
-    return reused, count
-  for idx, meta in enumerate(metadata):
-    reused[meta["chunk_hash"]] = embeddings[idx]
-    count += 1
-  return reused, count
+def _append_chunks(
+  index_dir: str,
+  chunks: Iterable[Dict[str, Any]],
+  progress_callback: ProgressCallback = None
+) -> Tuple[int, int]:
+  """
+  Embed a stream of chunks and write them to the index as a single new segment.
+  Every completed batch is committed to an on-disk checkpoint first, so an
+  interrupted build resumes from the last committed batch instead of
+  re-embedding, and only one batch of vectors is held in memory at a time.
+  Returns ``(new_embeddings, resumed_embeddings)``.
+  """
+  with _build_lock(index_dir):
+    checkpoint = EmbeddingCheckpoint(index_dir)
+    if checkpoint.resumed:
+      _notify(
+        progress_callback,
+        "info",
+        f"Resuming from checkpoint batch {checkpoint.batches} ({checkpoint.rows} chunks already embedded)"
+      )
+
+    wanted: Set[str] = set()
+    counts = {"pending": 0, "resumed": 0}
+
+    def pending_chunks() -> Iterator[Dict[str, Any]]:
+      for chunk in chunks:
+        wanted.add(chunk["chunk_hash"])
+        if chunk["chunk_hash"] in checkpoint.hashes:
+          counts["resumed"] += 1
+          continue
+        counts["pending"] += 1
+        yield chunk
+
+    embedder = Embedder(progress_callback=progress_callback)
+    _notify(progress_callback, "info", f"Embedding new chunks ({embedder.concurrency} concurrent requests)...")
+    for batch, vectors in embedder.iter_embeddings(pending_chunks()):
+      checkpoint.append_batch([_chunk_metadata(chunk) for chunk in batch], vectors)
+      _notify(
+        progress_callback,
+        "info",
+        f"Embedding batch {checkpoint.batches} committed ({checkpoint.rows} chunks embedded)"
+      )
+    if embedder.retries:
+      _notify(progress_callback, "info", f"Recovered from {embedder.retries} transient embedding errors")
+
+    segment, rows = _seal_checkpoint(index_dir, checkpoint, wanted)
+    checkpoint.clear()
+  if segment:
+    _notify(progress_callback, "info", f"Wrote segment {segment} ({rows} chunks)")
+  return counts["pending"], counts["resumed"]
+
+
+class EmbeddingPipeline:
+  """
+  Embeds documents while they are still being produced, e.g. saved by a
+  running crawl. ``add`` queues a document; a background thread chunks it and
+  streams the chunks through the embedder into the build checkpoint. Nothing
+  is published here: the ``index_kb`` run that follows finds these chunks in
+  the checkpoint, embeds only what is left and seals the index, so end-to-end
+  time is roughly the longer of producing and embedding rather than their sum.
+
+  A failure in the background thread is recorded, not raised; the later
+  ``index_kb`` run simply embeds whatever the pipeline did not get to.
+  """
+
+  _DONE = object()
+
+  def __init__(
+    self,
+    index_dir: str,
+    chunk_size: int = 900,
+    chunk_overlap: int = 150,
+    progress_callback: ProgressCallback = None
+  ):
+    self.index_dir = index_dir
+    self.chunk_size = chunk_size
+    self.chunk_overlap = chunk_overlap
+    self.progress_callback = progress_callback
+    self.documents = 0
+    self.embedded = 0
+    self.error: Optional[Exception] = None
+    self._queue: "queue.Queue[Any]" = queue.Queue()
+    self._thread: Optional[threading.Thread] = None
+    self._started = 0.0
+
+  def start(self) -> "EmbeddingPipeline":
+    os.makedirs(self.index_dir, exist_ok=True)
+    self._started = time.monotonic()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+    return self
+
+  def add(self, document: Dict[str, Any]) -> None:
+    self.documents += 1
+    self._queue.put(document)
+
+  def _documents(self) -> Iterator[Dict[str, Any]]:
+    while True:
+      document = self._queue.get()
+      if document is self._DONE:
+        return
+      yield document
+
+  def _run(self) -> None:
+    with _build_lock(self.index_dir):
+      try:
+        checkpoint = EmbeddingCheckpoint(self.index_dir)
+        skip = live_chunk_hashes(self.index_dir) | checkpoint.hashes
+
+        def pending_chunks() -> Iterator[Dict[str, Any]]:
+          for chunk in _iter_chunks(self._documents(), self.chunk_size, self.chunk_overlap):
+            if chunk["chunk_hash"] in skip:
+              continue
+            skip.add(chunk["chunk_hash"])
+            yield chunk
+
+        embedder = Embedder(progress_callback=self.progress_callback)
+        for batch, vectors in embedder.iter_embeddings(pending_chunks()):
+          checkpoint.append_batch([_chunk_metadata(chunk) for chunk in batch], vectors)
+          self.embedded += len(batch)
+          _notify(
+            self.progress_callback,
+            "info",
+            f"Embedded {self.embedded} chunks from {self.documents} documents so far (batch {checkpoint.batches})"
+          )
+      except Exception as exc:
+        self.error = exc
+        _notify(self.progress_callback, "warning", f"Embedding pipeline stopped early: {exc}")
+        # Keep draining so producers never block on a dead consumer.
+        for _ in self._documents():
+          pass
+
+  def finish(self) -> Dict[str, Any]:
+    """Wait for every queued document to be embedded; returns what was done."""
+    if self._thread is not None:
+      self._queue.put(self._DONE)
+      self._thread.join()
+      self._thread = None
+    return {
+      "documents": self.documents,
+      "embedded_chunks": self.embedded,
+      "seconds": round(time.monotonic() - self._started, 2),
+      "error": str(self.error) if self.error else None
+    }
+
+
+def _update_similarity_threshold(config_path: str, progress_callback: ProgressCallback = None) -> None:
+  if not config_path or not os.path.exists(config_path):
+    return
+  try:
+    with open(config_path, "r", encoding="utf-8") as config_file:
+      config = json.load(config_file)
+    config["similarity_threshold"] = 0.40
+    with open(config_path, "w", encoding="utf-8") as config_file:
+      json.dump(config, config_file, indent=2)
+    _notify(progress_callback, "info", "Updated similarity threshold to 0.40 for OpenAI embeddings")
+  except Exception as exc:
+    _notify(progress_callback, "warning", f"Could not update config: {exc}")
+
+
+def _write_stats(index_dir: str, summary: Dict[str, Any]) -> None:
+  stats_path = os.path.join(index_dir, "stats.json")
+  try:
+    with open(stats_path, "w", encoding="utf-8") as stats_file:
+      json.dump(summary, stats_file, indent=2)
+  except Exception:
+    pass
 
 
 def index_kb(
@@ -146,124 +303,106 @@ def index_kb(
   progress_callback: ProgressCallback = None,
   raw_dir: str = "kb/raw",
   index_dir: str = "kb/index",
-  config_path: str = "config.json"
+  config_path: str = "config.json",
+  workers: Optional[int] = None
 ) -> Dict[str, Any]:
   """
-  Build a vector index from knowledge documents using OpenAI embeddings with caching.
+  Bring the segmented vector index in line with the knowledge documents.
+  Chunks already in the index are kept as-is, new chunks are embedded into a
+  fresh segment and chunks whose documents disappeared are tombstoned.
+  ``workers`` sets the chunking process pool size (default: ``INDEX_WORKERS``
+  or CPU count - 1).
   """
   os.makedirs(index_dir, exist_ok=True)
-  documents = _load_documents(raw_dir, progress_callback)
-  if not documents:
+  doc_refs = _document_refs(raw_dir)
+  if not doc_refs:
     error_msg = "No documents found. Please crawl or upload knowledge sources first."
     _notify(progress_callback, "error", error_msg)
     raise ValueError(error_msg)
 
-  cache_meta, cache_embeddings = _load_existing_index(index_dir)
-  embedding_cache, cached_count = _reuse_embeddings(cache_meta, cache_embeddings)
-
-  _notify(progress_callback, "info", f"Loaded {cached_count} cached embeddings")
-
-  all_chunks: List[Dict[str, Any]] = []
-  new_chunks: List[Dict[str, Any]] = []
-  cached_hits = 0
-
-  for doc in documents:
-    chunks = _chunk_document(doc, chunk_size, chunk_overlap)
-    if not chunks:
-      continue
-    for chunk in chunks:
-      all_chunks.append(chunk)
-      if chunk["chunk_hash"] in embedding_cache:
-        cached_hits += 1
-        chunk["_embedding"] = embedding_cache[chunk["chunk_hash"]]
-      else:
-        new_chunks.append(chunk)
-
-  _notify(progress_callback, "info", f"{len(all_chunks)} chunks prepared ({cached_hits} reused)")
-
-  texts_to_embed = [chunk["text"] for chunk in new_chunks]
-  api_key = os.environ.get("OPENAI_API_KEY")
-  if not api_key:
-    raise RuntimeError("OPENAI_API_KEY not configured")
-  client = OpenAI(api_key=api_key)
-
-  embeddings = []
-  batch_size = 64
-  for start in range(0, len(texts_to_embed), batch_size):
-    batch = texts_to_embed[start:start + batch_size]
-    if not batch:
-      continue
-    batch_index = start // batch_size + 1
-    total_batches = (len(texts_to_embed) - 1) // batch_size + 1
-    _notify(progress_callback, "info", f"Embedding batch {batch_index}/{total_batches}...")
-    response = client.embeddings.create(model="text-embedding-3-small", input=batch)
-    vectors = [np.array(item.embedding, dtype="float32") for item in response.data]
-    embeddings.extend(vectors)
-
-  for chunk, vector in zip(new_chunks, embeddings):
-    chunk["_embedding"] = vector
-
-  vector_list = []
-  metadata = []
-  for chunk in all_chunks:
-    vector = chunk.get("_embedding")
-    if vector is None:
-      continue
-    vector_list.append(vector)
-    metadata.append({
-      "chunk_hash": chunk["chunk_hash"],
-      "doc_hash": chunk["doc_hash"],
-      "text": chunk["text"],
-      "url": chunk["url"],
-      "title": chunk["title"],
-      "source_type": chunk["source_type"],
-      "meta_description": chunk["meta_description"],
-      "headings": chunk["headings"],
-      "token_estimate": chunk["token_estimate"],
-      "extracted_at": chunk["extracted_at"],
-      "content_type": chunk["content_type"],
-      "status_code": chunk["status_code"]
-    })
-
-  if not vector_list:
+  live_hashes = live_chunk_hashes(index_dir)
+  _notify(progress_callback, "info", f"Loaded {len(live_hashes)} cached embeddings")
+
+  # Documents flow through chunking into embedding batches one at a time;
+  # only chunk hashes are kept for the whole corpus.
+  current_hashes: Set[str] = set()
+  cached = {"hits": 0}
+
+  pool_size = worker_count(workers, "INDEX_WORKERS")
+
+  def new_chunks() -> Iterator[Dict[str, Any]]:
+    batches = _iter_chunk_batches(doc_refs, chunk_size, chunk_overlap, pool_size, progress_callback)
+    for batch in batches:
+      for chunk in batch:
+        if chunk["chunk_hash"] in current_hashes:
+          continue
+        current_hashes.add(chunk["chunk_hash"])
+        if chunk["chunk_hash"] in live_hashes:
+          cached["hits"] += 1
+          continue
+        yield chunk
+
+  new_embeddings, resumed_embeddings = _append_chunks(index_dir, new_chunks(), progress_callback)
+  cached_hits = cached["hits"]
+  _notify(progress_callback, "info", f"{len(current_hashes)} chunks prepared ({cached_hits} reused)")
+
+  if not current_hashes:
     raise RuntimeError("No embeddings generated")
 
-  matrix = np.stack(vector_list).astype("float32")
-  np.save(os.path.join(index_dir, "embeddings.npy"), matrix)
-  with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as handle:
-    json.dump(metadata, handle, ensure_ascii=False, indent=2)
-
-  if config_path and os.path.exists(config_path):
-    try:
-      with open(config_path, "r", encoding="utf-8") as config_file:
-        config = json.load(config_file)
-      config["similarity_threshold"] = 0.40
-      with open(config_path, "w", encoding="utf-8") as config_file:
-        json.dump(config, config_file, indent=2)
-      _notify(progress_callback, "info", "Updated similarity threshold to 0.40 for OpenAI embeddings")
-    except Exception as exc:
-      _notify(progress_callback, "warning", f"Could not update config: {exc}")
-
-  reused_embeddings = cached_hits
-  new_embeddings = len(embeddings)
-  total_chunks = len(metadata)
+  removed = add_tombstones(index_dir, live_hashes - current_hashes)
+  if removed:
+    _notify(progress_callback, "info", f"Tombstoned {removed} chunks from removed documents")
+
+  _update_similarity_threshold(config_path, progress_callback)
 
+  manifest = load_manifest(index_dir)
+  total_chunks = len(current_hashes)
   summary = {
     "total_chunks": total_chunks,
-    "dimension": int(matrix.shape[1]),
+    "dimension": int(manifest["dimension"] or 0),
     "new_embeddings": new_embeddings,
-    "reused_embeddings": reused_embeddings,
+    "reused_embeddings": cached_hits,
+    "resumed_embeddings": resumed_embeddings,
+    "removed_chunks": removed,
+    "segments": len(manifest["segments"]),
     "last_indexed_at": datetime.datetime.utcnow().isoformat() + "Z"
   }
-  stats_path = os.path.join(index_dir, "stats.json")
-  try:
-    with open(stats_path, "w", encoding="utf-8") as stats_file:
-      json.dump(summary, stats_file, indent=2)
-  except Exception:
-    pass
+  _write_stats(index_dir, summary)
   _notify(progress_callback, "complete", f"Index built successfully ({total_chunks} chunks, {new_embeddings} new embeddings)!")
   return summary
 
 
+def index_documents(
+  documents: Iterable[Dict[str, Any]],
+  chunk_size: int = 900,
+  chunk_overlap: int = 150,
+  progress_callback: ProgressCallback = None,
+  index_dir: str = "kb/index"
+) -> Dict[str, Any]:
+  """
+  Append freshly added documents to the index as a small segment without
+  touching the rest of the index.
+  """
+  os.makedirs(index_dir, exist_ok=True)
+  live_hashes = live_chunk_hashes(index_dir)
+
+  def new_chunks() -> Iterator[Dict[str, Any]]:
+    for chunk in _iter_chunks(documents, chunk_size, chunk_overlap):
+      if chunk["chunk_hash"] in live_hashes:
+        continue
+      live_hashes.add(chunk["chunk_hash"])
+      yield chunk
+
+  new_embeddings, resumed_embeddings = _append_chunks(index_dir, new_chunks(), progress_callback)
+  summary = index_summary(index_dir)
+  summary.update({
+    "new_embeddings": new_embeddings,
+    "resumed_embeddings": resumed_embeddings,
+    "last_indexed_at": datetime.datetime.utcnow().isoformat() + "Z"
+  })
+  _notify(progress_callback, "complete", f"Added {new_embeddings} chunks to the index")
+  return summary
+
+
 if __name__ == "__main__":
   index_kb()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+import tempfile
+import datetime
+import threading
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
+import numpy as np
+from tools.hub import offload
+
+
+MANIFEST_NAME = "manifest.json"
+TOMBSTONES_NAME = "tombstones.json"
+SEGMENTS_DIR = "segments"
+SEGMENT_EMBEDDINGS = "embeddings.npy"
+SEGMENT_META = "meta.jsonl"
+COMPACTION_BLOCK_ROWS = 2048
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _index_lock(index_dir: str) -> threading.Lock:
+  key = os.path.abspath(index_dir)
+  with _locks_guard:
+    lock = _locks.get(key)
+    if lock is None:
+      lock = threading.Lock()
+      _locks[key] = lock
+    return lock
+
+
+def _write_json_atomic(path: str, data: Any) -> None:
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "w", encoding="utf-8") as handle:
+    json.dump(data, handle, ensure_ascii=False, indent=2)
+  os.replace(tmp_path, path)
+
+
+def _empty_manifest() -> Dict[str, Any]:
+  return {"version": 1, "next_seq": 1, "dimension": None, "segments": []}
+
+
+def _segment_dir(index_dir: str, name: str) -> str:
+  return os.path.join(index_dir, SEGMENTS_DIR, name)
+
+
+def _read_manifest(index_dir: str) -> Dict[str, Any]:
+  path = os.path.join(index_dir, MANIFEST_NAME)
+  if not os.path.exists(path):
+    return _empty_manifest()
+  with open(path, "r", encoding="utf-8") as handle:
+    manifest = json.load(handle)
+  for key, value in _empty_manifest().items():
+    manifest.setdefault(key, value)
+  return manifest
+
+
+def _read_tombstones(index_dir: str) -> Dict[str, int]:
+  path = os.path.join(index_dir, TOMBSTONES_NAME)
+  if not os.path.exists(path):
+    return {}
+  try:
+    with open(path, "r", encoding="utf-8") as handle:
+      return json.load(handle) or {}
+  except Exception:
+    return {}
+
+
+def _iter_segment_meta(index_dir: str, name: str) -> Iterator[Dict[str, Any]]:
+  with open(os.path.join(_segment_dir(index_dir, name), SEGMENT_META), "r", encoding="utf-8") as handle:
+    for line in handle:
+      if line.strip():
+        yield json.loads(line)
+
+
+def _read_segment_meta(index_dir: str, name: str) -> List[Dict[str, Any]]:
+  return list(_iter_segment_meta(index_dir, name))
+
+
+def _segment_hashes(index_dir: str, name: str) -> List[str]:
+  return [meta["chunk_hash"] for meta in _iter_segment_meta(index_dir, name)]
+
+
+class SegmentWriter:
+  """
+  Streams rows into a preallocated, memory-mapped segment so callers never hold
+  the full matrix in memory. Rows are written to a hidden build directory and
+  only become visible once installed into the manifest.
+  """
+
+  def __init__(self, index_dir: str, rows: int, dimension: int):
+    if rows <= 0 or dimension <= 0:
+      raise ValueError("SegmentWriter needs at least one row and a known dimension")
+    segments_dir = os.path.join(index_dir, SEGMENTS_DIR)
+    os.makedirs(segments_dir, exist_ok=True)
+    self.index_dir = index_dir
+    self.rows = rows
+    self.dimension = dimension
+    self.written = 0
+    self.tmp_dir = tempfile.mkdtemp(prefix=".build-", dir=segments_dir)
+    self._vectors = np.lib.format.open_memmap(
+      os.path.join(self.tmp_dir, SEGMENT_EMBEDDINGS),
+      mode="w+",
+      dtype="float32",
+      shape=(rows, dimension)
+    )
+    self._meta = open(os.path.join(self.tmp_dir, SEGMENT_META), "w", encoding="utf-8")
+
+  def write(self, metadata: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+    count = len(metadata)
+    if count != vectors.shape[0]:
+      raise ValueError("Segment metadata and embeddings are misaligned")
+    if self.written + count > self.rows:
+      raise ValueError("More rows written than the segment was sized for")
+    self._vectors[self.written:self.written + count] = vectors
+    for meta in metadata:
+      self._meta.write(json.dumps(meta, ensure_ascii=False) + "\n")
+    self.written += count
+
+  def finish(self) -> str:
+    """Flush and close the build files; returns the build directory."""
+    if self.written != self.rows:
+      self.abort()
+      raise ValueError(f"Segment sized for {self.rows} rows but {self.written} were written")
+    self._vectors.flush()
+    del self._vectors
+    self._meta.close()
+    return self.tmp_dir
+
+  def abort(self) -> None:
+    if not self._meta.closed:
+      self._meta.close()
+    shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+  def commit(self) -> str:
+    """Install the segment as the newest one and return its name."""
+    build_dir = self.finish()
+    with _index_lock(self.index_dir):
+      manifest = offload(_migrate_and_read_manifest, self.index_dir)
+      if manifest["dimension"] and manifest["dimension"] != self.dimension:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise ValueError(f"Embedding dimension {self.dimension} does not match index ({manifest['dimension']})")
+      seq = manifest["next_seq"]
+      name = f"seg-{seq:06d}"
+      os.replace(build_dir, _segment_dir(self.index_dir, name))
+      manifest["segments"].append(_segment_entry(name, seq, self.rows))
+      manifest["next_seq"] = seq + 1
+      manifest["dimension"] = self.dimension
+      _write_json_atomic(os.path.join(self.index_dir, MANIFEST_NAME), manifest)
+    return name
+
+
+def _segment_entry(name: str, seq: int, rows: int) -> Dict[str, Any]:
+  return {
+    "name": name,
+    "seq": seq,
+    "rows": rows,
+    "created_at": datetime.datetime.utcnow().isoformat() + "Z"
+  }
+
+
+def _migrate_legacy_index(index_dir: str) -> None:
+  """Move a pre-segment ``embeddings.npy``/``meta.json`` pair into the first segment."""
+  legacy_embeddings = os.path.join(index_dir, "embeddings.npy")
+  legacy_meta = os.path.join(index_dir, "meta.json")
+  if os.path.exists(os.path.join(index_dir, MANIFEST_NAME)):
+    return
+  if not os.path.exists(legacy_embeddings) or not os.path.exists(legacy_meta):
+    return
+  with open(legacy_meta, "r", encoding="utf-8") as handle:
+    metadata = json.load(handle)
+  matrix = np.load(legacy_embeddings)
+  manifest = _empty_manifest()
+  if metadata and matrix.size:
+    name = "seg-000001"
+    writer = SegmentWriter(index_dir, len(metadata), int(matrix.shape[1]))
+    writer.write(metadata, matrix)
+    os.replace(writer.finish(), _segment_dir(index_dir, name))
+    manifest["segments"].append(_segment_entry(name, 1, len(metadata)))
+    manifest["next_seq"] = 2
+    manifest["dimension"] = int(matrix.shape[1])
+  _write_json_atomic(os.path.join(index_dir, MANIFEST_NAME), manifest)
+  os.remove(legacy_embeddings)
+  os.remove(legacy_meta)
+
+
+def _migrate_and_read_manifest(index_dir: str) -> Dict[str, Any]:
+  # File and numpy work only; the caller holds the index lock so it can run off the hub.
+  _migrate_legacy_index(index_dir)
+  return _read_manifest(index_dir)
+
+
+def load_manifest(index_dir: str) -> Dict[str, Any]:
+  """Return the segment manifest, migrating a legacy single-file index on first use."""
+  with _index_lock(index_dir):
+    # Migration loads and rewrites the whole legacy matrix, so it must not run on the hub.
+    return offload(_migrate_and_read_manifest, index_dir)
+
+
+def has_index(index_dir: str) -> bool:
+  if os.path.exists(os.path.join(index_dir, "embeddings.npy")):
+    return True
+  return bool(load_manifest(index_dir)["segments"])
+
+
+def append_segment(index_dir: str, metadata: List[Dict[str, Any]], matrix: np.ndarray) -> Optional[str]:
+  """
+  Persist a new immutable segment and register it in the manifest.
+  Returns the segment name, or None when there is nothing to write.
+  """
+  if not metadata:
+    return None
+  writer = SegmentWriter(index_dir, len(metadata), int(matrix.shape[1]))
+  try:
+    writer.write(metadata, matrix)
+  except Exception:
+    writer.abort()
+    raise
+  return writer.commit()
+
+
+def add_tombstones(index_dir: str, chunk_hashes: Iterable[str]) -> int:
+  """
+  Mark chunks as deleted. A tombstone hides every copy of the chunk written up to
+  now; re-adding the same chunk later in a newer segment makes it live again.
+  """
+  hashes = [chunk_hash for chunk_hash in chunk_hashes if chunk_hash]
+  if not hashes:
+    return 0
+  with _index_lock(index_dir):
+    _migrate_legacy_index(index_dir)
+    manifest = _read_manifest(index_dir)
+    tombstones = _read_tombstones(index_dir)
+    latest_seq = manifest["next_seq"] - 1
+    for chunk_hash in hashes:
+      tombstones[chunk_hash] = latest_seq
+    _write_json_atomic(os.path.join(index_dir, TOMBSTONES_NAME), tombstones)
+  return len(hashes)
+
+
+def _live_masks(
+  segments: List[Dict[str, Any]],
+  hashes_by_segment: Dict[str, List[str]],
+  tombstones: Dict[str, int]
+) -> Dict[str, np.ndarray]:
+  masks: Dict[str, np.ndarray] = {}
+  seen: Set[str] = set()
+  for entry in sorted(segments, key=lambda item: item["seq"], reverse=True):
+    hashes = hashes_by_segment[entry["name"]]
+    mask = np.ones(len(hashes), dtype=bool)
+    for row, chunk_hash in enumerate(hashes):
+      if chunk_hash in seen or tombstones.get(chunk_hash, 0) >= entry["seq"]:
+        mask[row] = False
+        continue
+      seen.add(chunk_hash)
+    masks[entry["name"]] = mask
+  return masks
+
+
+def _read_segments(
+  index_dir: str,
+  segments: List[Dict[str, Any]],
+  tombstones: Dict[str, int],
+  mmap: bool
+) -> List[Dict[str, Any]]:
+  # Pure parsing with no index lock, so load_segments can run it off the hub.
+  metadata_by_segment = {
+    entry["name"]: _read_segment_meta(index_dir, entry["name"])
+    for entry in segments
+  }
+  hashes_by_segment = {
+    name: [meta["chunk_hash"] for meta in metadata]
+    for name, metadata in metadata_by_segment.items()
+  }
+  masks = _live_masks(segments, hashes_by_segment, tombstones)
+  loaded = []
+  for entry in segments:
+    embeddings_path = os.path.join(_segment_dir(index_dir, entry["name"]), SEGMENT_EMBEDDINGS)
+    loaded.append({
+      "name": entry["name"],
+      "seq": entry["seq"],
+      "metadata": metadata_by_segment[entry["name"]],
+      "embeddings": np.load(embeddings_path, mmap_mode="r" if mmap else None),
+      "live": masks[entry["name"]]
+    })
+  return loaded
+
+
+def load_segments(index_dir: str, mmap: bool = False) -> List[Dict[str, Any]]:
+  """
+  Load every segment with its metadata, embeddings and a boolean ``live`` mask
+  that hides tombstoned rows and older duplicates of the same chunk.
+  """
+  for attempt in range(2):
+    manifest = load_manifest(index_dir)
+    tombstones = _read_tombstones(index_dir)
+    try:
+      return offload(_read_segments, index_dir, manifest["segments"], tombstones, mmap)
+    except FileNotFoundError:
+      # A concurrent compaction swapped the manifest; re-read it once.
+      if attempt:
+        raise
+  return []
+
+
+def _live_state(index_dir: str) -> Tuple[Dict[str, Any], Dict[str, List[str]], Dict[str, np.ndarray]]:
+  manifest = load_manifest(index_dir)
+  tombstones = _read_tombstones(index_dir)
+  hashes_by_segment = {
+    entry["name"]: _segment_hashes(index_dir, entry["name"])
+    for entry in manifest["segments"]
+  }
+  return manifest, hashes_by_segment, _live_masks(manifest["segments"], hashes_by_segment, tombstones)
+
+
+def live_chunk_hashes(index_dir: str) -> Set[str]:
+  """Return the hashes of every chunk currently searchable in the index."""
+  _, hashes_by_segment, masks = _live_state(index_dir)
+  hashes: Set[str] = set()
+  for name, segment_hashes in hashes_by_segment.items():
+    mask = masks[name]
+    hashes.update(chunk_hash for row, chunk_hash in enumerate(segment_hashes) if mask[row])
+  return hashes
+
+
+def index_summary(index_dir: str) -> Dict[str, Any]:
+  manifest = load_manifest(index_dir)
+  return {
+    "segments": len(manifest["segments"]),
+    "live_chunks": len(live_chunk_hashes(index_dir)),
+    "dimension": manifest["dimension"]
+  }
+
+
+def compact_segments(
+  index_dir: str,
+  small_segment_rows: int = 4096,
+  min_small_segments: int = 4,
+  max_dead_ratio: float = 0.3
+) -> Dict[str, Any]:
+  """
+  Merge small segments (and segments dominated by tombstoned rows) into one.
+  The merged segment is built outside the index lock so appends and searches
+  carry on; only the manifest swap is serialized. If another compaction
+  swapped out any selected segment meanwhile, the merged copy is discarded.
+  """
+  manifest, _, masks = _live_state(index_dir)
+  segments = manifest["segments"]
+  selected = []
+  small = [entry for entry in segments if entry["rows"] < small_segment_rows]
+  if len(small) >= min_small_segments:
+    selected.extend(small)
+  selected_names = {entry["name"] for entry in selected}
+  for entry in segments:
+    if entry["name"] in selected_names or not entry["rows"]:
+      continue
+    if 1 - (masks[entry["name"]].sum() / entry["rows"]) > max_dead_ratio:
+      selected.append(entry)
+      selected_names.add(entry["name"])
+  if len(selected) < 2 and all(masks[entry["name"]].all() for entry in selected):
+    return {"compacted": False, "segments": len(segments)}
+
+  selected.sort(key=lambda entry: entry["seq"])
+  merged_rows = int(sum(masks[entry["name"]].sum() for entry in selected))
+  merged_seq = selected[-1]["seq"]
+
+  build_dir = None
+  if merged_rows:
+    # Copy live rows segment by segment so memory stays bounded by one block.
+    writer = SegmentWriter(index_dir, merged_rows, int(manifest["dimension"]))
+    try:
+      for entry in selected:
+        mask = masks[entry["name"]]
+        embeddings = np.load(
+          os.path.join(_segment_dir(index_dir, entry["name"]), SEGMENT_EMBEDDINGS),
+          mmap_mode="r"
+        )
+        block_meta: List[Dict[str, Any]] = []
+        block_rows: List[int] = []
+        for row, meta in enumerate(_iter_segment_meta(index_dir, entry["name"])):
+          if not mask[row]:
+            continue
+          block_meta.append(meta)
+          block_rows.append(row)
+          if len(block_rows) >= COMPACTION_BLOCK_ROWS:
+            writer.write(block_meta, embeddings[block_rows])
+            block_meta, block_rows = [], []
+        if block_rows:
+          writer.write(block_meta, embeddings[block_rows])
+        del embeddings
+      build_dir = writer.finish()
+    except Exception:
+      writer.abort()
+      raise
+
+  with _index_lock(index_dir):
+    manifest = _read_manifest(index_dir)
+    remaining = [entry for entry in manifest["segments"] if entry["name"] not in selected_names]
+    if len(manifest["segments"]) - len(remaining) != len(selected_names):
+      # Installing this copy would duplicate rows another compaction already merged.
+      if build_dir:
+        shutil.rmtree(build_dir, ignore_errors=True)
+      return {"compacted": False, "segments": len(manifest["segments"])}
+    merged_name = f"seg-{merged_seq:06d}-c1"
+    suffix = 1
+    while os.path.exists(_segment_dir(index_dir, merged_name)):
+      suffix += 1
+      merged_name = f"seg-{merged_seq:06d}-c{suffix}"
+    if build_dir:
+      os.replace(build_dir, _segment_dir(index_dir, merged_name))
+      remaining.append(_segment_entry(merged_name, merged_seq, merged_rows))
+    remaining.sort(key=lambda entry: entry["seq"])
+    manifest["segments"] = remaining
+    _write_json_atomic(os.path.join(index_dir, MANIFEST_NAME), manifest)
+
+    # Tombstones older than every remaining segment can no longer hide anything.
+    oldest_seq = min((entry["seq"] for entry in remaining), default=manifest["next_seq"])
+    tombstones = _read_tombstones(index_dir)
+    pruned = {chunk_hash: seq for chunk_hash, seq in tombstones.items() if seq >= oldest_seq}
+    if len(pruned) != len(tombstones):
+      _write_json_atomic(os.path.join(index_dir, TOMBSTONES_NAME), pruned)
+
+  for name in selected_names:
+    shutil.rmtree(_segment_dir(index_dir, name), ignore_errors=True)
+
+  return {
+    "compacted": True,
+    "merged_segments": len(selected),
+    "rows": merged_rows,
+    "segments": len(remaining)
+  }
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+import contextlib
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1"))
+# A running job whose owner has not checked in for this long is presumed dead.
+JOB_HEARTBEAT_TIMEOUT = float(os.environ.get("JOB_HEARTBEAT_TIMEOUT", "60"))
+# Jobs interrupted (e.g. by restarts) this many times are failed, not resumed.
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+CANCEL_CHECK_INTERVAL = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+  """Raised inside a job once its cancellation has been requested."""
+
+
+def parse_limits(value: Optional[str]) -> Dict[str, int]:
+  """Parse ``kind=limit`` pairs, e.g. ``"crawl=2,train=1"``."""
+  limits: Dict[str, int] = {}
+  for item in (value or "").split(","):
+    kind, _, limit = item.partition("=")
+    try:
+      limits[kind.strip()] = max(1, int(limit))
+    except ValueError:
+      continue
+  return limits
+
+
+def _owner() -> str:
+  return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+  """Whether a job owner on this host is still running; owners elsewhere are assumed alive."""
+  host, _, pid = (owner or "").rpartition(":")
+  if host != socket.gethostname() or not pid.isdigit():
+    return True
+  try:
+    os.kill(int(pid), 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+  return True
+
+
+FinishCallback = Optional[Callable[[Dict[str, Any], str], None]]
+
+
+class _Kind(NamedTuple):
+  handler: Callable[["Job"], Any]
+  limit: int
+  coalesce: bool
+  on_finish: FinishCallback
+
+
+class Job:
+  """What a handler receives: the job's parameters plus a way to notice cancellation."""
+
+  def __init__(self, queue: "JobQueue", job_id: int, kind: str, params: Dict[str, Any], resource: Optional[str], attempts: int):
+    self.queue = queue
+    self.id = job_id
+    self.kind = kind
+    self.params = params
+    self.resource = resource
+    self.attempts = attempts
+    self._checked_at = 0.0
+    self._cancelled = False
+
+  @property
+  def resumed(self) -> bool:
+    return self.attempts > 1
+
+  def cancel_requested(self) -> bool:
+    now = time.monotonic()
+    if not self._cancelled and now - self._checked_at >= CANCEL_CHECK_INTERVAL:
+      self._checked_at = now
+      self._cancelled = self.queue._cancel_requested(self.id)
+    return self._cancelled
+
+  def raise_if_cancelled(self) -> None:
+    if self.cancel_requested():
+      raise JobCancelled(f"Job {self.id} cancelled")
+
+
+class JobQueue:
+  """
+  Background work as rows in SQLite: each job has a kind, JSON parameters,
+  an optional ``resource`` (e.g. one bot's knowledge base) and a state
+  (``queued`` -> ``running`` -> ``succeeded``/``failed``/``cancelled``).
+
+  Submitting a job identical to one already queued or running returns that
+  job instead; for kinds registered with ``coalesce`` a queued job simply takes
+  the newest parameters. At most ``limit`` jobs of a kind run at once, and
+  never two on the same resource. Limits are enforced through the database, so
+  several processes can share one queue. Jobs whose process died are queued
+  again on the next ``start`` (or once their heartbeat goes stale), so handlers
+  must be safe to re-run; anything a re-run still needs (spooled uploads, say)
+  is released in the kind's ``on_finish`` callback, which runs once the job
+  reaches a final state. Cancelling a running job is cooperative: handlers
+  call ``Job.raise_if_cancelled`` at convenient points.
+  """
+
+  def __init__(self, path: str, workers: int = JOB_WORKERS, limits: Optional[Dict[str, int]] = None):
+    self.path = path
+    self.workers = max(1, workers)
+    self.limits = limits or {}
+    self.kinds: Dict[str, _Kind] = {}
+    self.owner = _owner()
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._stopping = threading.Event()
+    self._running: Dict[int, threading.Thread] = {}
+    self._thread: Optional[threading.Thread] = None
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    self.conn.executescript(
+      """
+      CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        resource TEXT,
+        params TEXT NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        owner TEXT,
+        heartbeat_at REAL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        error TEXT,
+        result TEXT
+      );
+      CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+      CREATE INDEX IF NOT EXISTS jobs_resource ON jobs (resource, state);
+      """
+    )
+
+  @contextlib.contextmanager
+  def _transaction(self) -> Iterator[sqlite3.Connection]:
+    # BEGIN IMMEDIATE takes the write lock up front, so two processes cannot
+    # both see a free slot and claim it.
+    with self._lock:
+      self.conn.execute("BEGIN IMMEDIATE")
+      try:
+        yield self.conn
+      except BaseException:
+        self.conn.execute("ROLLBACK")
+        raise
+      self.conn.execute("COMMIT")
+
+  def register(
+    self,
+    kind: str,
+    handler: Callable[[Job], Any],
+    limit: int = 1,
+    coalesce: bool = True,
+    on_finish: FinishCallback = None
+  ) -> None:
+    """
+    Handle jobs of ``kind``; ``limit`` can be overridden by the ``limits`` given
+    to the queue. ``on_finish(params, state)`` is called once a job of this kind
+    has succeeded, failed or been cancelled, and never while it may still be
+    resumed.
+    """
+    self.kinds[kind] = _Kind(handler, max(1, self.limits.get(kind, limit)), coalesce, on_finish)
+
+  def _finalize(self, kind: str, params: Dict[str, Any], state: str) -> None:
+    registered = self.kinds.get(kind)
+    if registered is None or registered.on_finish is None:
+      return
+    try:
+      registered.on_finish(params, state)
+    except Exception:
+      logger.exception("Finishing %s job failed", kind)
+
+  def submit(self, kind: str, params: Dict[str, Any], resource: Optional[str] = None) -> Tuple[int, bool]:
+    """Queue a job; returns ``(job_id, created)`` where ``created`` is False for a duplicate."""
+    encoded = json.dumps(params, sort_keys=True)
+    coalesce = kind in self.kinds and self.kinds[kind].coalesce
+    with self._transaction() as conn:
+      active = conn.execute(
+        "SELECT id, state, params FROM jobs WHERE kind = ? AND resource IS ? AND state IN (?, ?) ORDER BY id",
+        (kind, resource) + ACTIVE_STATES
+      ).fetchall()
+      for job_id, state, existing in active:
+        if existing == encoded:
+          return job_id, False
+      for job_id, state, existing in active:
+        if state == QUEUED and coalesce:
+          conn.execute("UPDATE jobs SET params = ? WHERE id = ?", (encoded, job_id))
+          return job_id, False
+      cursor = conn.execute(
+        "INSERT INTO jobs (kind, resource, params, state, created_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, resource, encoded, QUEUED, time.time())
+      )
+      job_id = cursor.lastrowid
+    self._wake.set()
+    return job_id, True
+
+  def cancel(self, job_id: int) -> Optional[str]:
+    """Cancel a queued job outright, or ask a running one to stop; returns its state."""
+    with self._transaction() as conn:
+      row = conn.execute("SELECT state, kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+      if row is None:
+        return None
+      state, kind, params = row
+      if state == RUNNING:
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+      if state != QUEUED:
+        return state
+      conn.execute(
+        "UPDATE jobs SET state = ?, cancel_requested = 1, finished_at = ? WHERE id = ?",
+        (CANCELLED, time.time(), job_id)
+      )
+    self._finalize(kind, json.loads(params), CANCELLED)
+    return CANCELLED
+
+  def _cancel_requested(self, job_id: int) -> bool:
+    with self._lock:
+      row = self.conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return bool(row and row[0])
+
+  def _describe(self, row: Tuple[Any, ...]) -> Dict[str, Any]:
+    job_id, kind, resource, params, state, attempts, cancel_requested, created_at, started_at, finished_at, error, result = row
+    return {
+      "id": job_id,
+      "kind": kind,
+      "resource": resource,
+      "params": json.loads(params),
+      "state": state,
+      "attempts": attempts,
+      "cancel_requested": bool(cancel_requested),
+      "created_at": created_at,
+      "started_at": started_at,
+      "finished_at": finished_at,
+      "error": error,
+      "result": json.loads(result) if result else None
+    }
+
+  _COLUMNS = "id, kind, resource, params, state, attempts, cancel_requested, created_at, started_at, finished_at, error, result"
+
+  def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+    with self._lock:
+      row = self.conn.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return self._describe(row) if row else None
+
+  def list(self, resource: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Most recent jobs first, optionally only those on ``resource``."""
+    query = f"SELECT {self._COLUMNS} FROM jobs"
+    args: Tuple[Any, ...] = ()
+    if resource is not None:
+      query += " WHERE resource = ?"
+      args = (resource,)
+    with self._lock:
+      rows = self.conn.execute(query + " ORDER BY id DESC LIMIT ?", args + (limit,)).fetchall()
+    return [self._describe(row) for row in rows]
+
+  def finished_since(self, since: float, kinds: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """Jobs (optionally only of ``kinds``) that reached a final state after ``since``, oldest first."""
+    query = f"SELECT {self._COLUMNS} FROM jobs WHERE finished_at > ? AND state NOT IN (?, ?)"
+    args: Tuple[Any, ...] = (since,) + ACTIVE_STATES
+    if kinds:
+      query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+      args += tuple(kinds)
+    with self._lock:
+      rows = self.conn.execute(query + " ORDER BY finished_at", args).fetchall()
+    return [self._describe(row) for row in rows]
+
+  def recover(self) -> int:
+    """Queue again the running jobs whose owner is gone; returns how many were resumed."""
+    stale_before = time.time() - JOB_HEARTBEAT_TIMEOUT
+    resumed = 0
+    finished: List[Tuple[str, str, str]] = []
+    with self._transaction() as conn:
+      rows = conn.execute(
+        "SELECT id, kind, params, owner, heartbeat_at, attempts, cancel_requested FROM jobs WHERE state = ?",
+        (RUNNING,)
+      ).fetchall()
+      for job_id, kind, params, owner, heartbeat_at, attempts, cancel_requested in rows:
+        if owner == self.owner and job_id in self._running:
+          continue
+        if _owner_alive(owner) and owner != self.owner and (heartbeat_at or 0) >= stale_before:
+          continue
+        if cancel_requested:
+          state, error = CANCELLED, None
+        elif attempts >= JOB_MAX_ATTEMPTS:
+          state, error = FAILED, f"Interrupted {attempts} times"
+        else:
+          state, error = QUEUED, None
+          resumed += 1
+        conn.execute(
+          "UPDATE jobs SET state = ?, owner = NULL, error = ?, finished_at = ? WHERE id = ?",
+          (state, error, None if state == QUEUED else time.time(), job_id)
+        )
+        if state != QUEUED:
+          finished.append((kind, params, state))
+    for kind, params, state in finished:
+      self._finalize(kind, json.loads(params), state)
+    return resumed
+
+  def _claim(self) -> Optional[Job]:
+    with self._transaction() as conn:
+      running = dict(conn.execute("SELECT kind, COUNT(*) FROM jobs WHERE state = ? GROUP BY kind", (RUNNING,)))
+      busy = {
+        resource for (resource,) in conn.execute(
+          "SELECT DISTINCT resource FROM jobs WHERE state = ? AND resource IS NOT NULL", (RUNNING,)
+        )
+      }
+      rows = conn.execute(
+        "SELECT id, kind, resource, params, attempts FROM jobs WHERE state = ? ORDER BY id", (QUEUED,)
+      ).fetchall()
+      for job_id, kind, resource, params, attempts in rows:
+        registered = self.kinds.get(kind)
+        if registered is None or running.get(kind, 0) >= registered.limit:
+          continue
+        if resource is not None and resource in busy:
+          continue
+        now = time.time()
+        conn.execute(
+          "UPDATE jobs SET state = ?, owner = ?, heartbeat_at = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+          (RUNNING, self.owner, now, now, job_id)
+        )
+        return Job(self, job_id, kind, json.loads(params), resource, attempts + 1)
+    return None
+
+  def _finish(self, job: Job, state: str, error: Optional[str], result: Any) -> bool:
+    """Record the outcome; False if the job was meanwhile recovered by another worker."""
+    try:
+      encoded = json.dumps(result) if result is not None else None
+    except (TypeError, ValueError):
+      encoded = None
+    with self._transaction() as conn:
+      cursor = conn.execute(
+        "UPDATE jobs SET state = ?, error = ?, result = ?, finished_at = ?, owner = NULL WHERE id = ? AND owner = ?",
+        (state, error, encoded, time.time(), job.id, self.owner)
+      )
+    return cursor.rowcount > 0
+
+  def _execute(self, job: Job) -> None:
+    state, error, result = SUCCEEDED, None, None
+    try:
+      result = self.kinds[job.kind].handler(job)
+    except JobCancelled:
+      state = CANCELLED
+    except Exception as exc:
+      state, error = FAILED, str(exc)
+      logger.exception("Job %s (%s) failed", job.id, job.kind)
+    finally:
+      if self._finish(job, state, error, result):
+        self._finalize(job.kind, job.params, state)
+      with self._lock:
+        self._running.pop(job.id, None)
+      self._wake.set()
+
+  def _heartbeat(self) -> None:
+    with self._lock:
+      ids = list(self._running)
+    if ids:
+      with self._transaction() as conn:
+        conn.executemany(
+          "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ?",
+          ((time.time(), job_id, self.owner) for job_id in ids)
+        )
+
+  def run_forever(self) -> None:
+    """Dispatch jobs until ``stop``; this is the body of a dedicated worker process."""
+    self.recover()
+    last_recovery = time.monotonic()
+    while not self._stopping.is_set():
+      while len(self._running) < self.workers:
+        job = self._claim()
+        if job is None:
+          break
+        thread = threading.Thread(target=self._execute, args=(job,), daemon=True)
+        with self._lock:
+          self._running[job.id] = thread
+        thread.start()
+      self._heartbeat()
+      if time.monotonic() - last_recovery >= JOB_HEARTBEAT_TIMEOUT:
+        # Another worker process may have died holding jobs.
+        self.recover()
+        last_recovery = time.monotonic()
+      self._wake.wait(JOB_POLL_INTERVAL)
+      self._wake.clear()
+
+  def start(self) -> "JobQueue":
+    """Dispatch jobs from a background thread of this process."""
+    if self._thread is None:
+      self._thread = threading.Thread(target=self.run_forever, daemon=True)
+      self._thread.start()
+    return self
+
+  def stop(self, timeout: float = 5.0) -> None:
+    self._stopping.set()
+    self._wake.set()
+    if self._thread is not None:
+      self._thread.join(timeout)
+      self._thread = None
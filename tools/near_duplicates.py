@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import re
+import hashlib
+from typing import List, Optional, Tuple
+import numpy as np
+
+
+SHINGLE_WORDS = 3
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def simhash(text: str, shingle_words: int = SHINGLE_WORDS) -> int:
+  """
+  64-bit SimHash over overlapping word shingles. Pages that differ only in
+  boilerplate, dates or pagination land a few bits apart.
+  """
+  words = _WORD_RE.findall(text.lower())
+  if not words:
+    return 0
+  if len(words) < shingle_words:
+    shingles = [" ".join(words)]
+  else:
+    shingles = [" ".join(words[i:i + shingle_words]) for i in range(len(words) - shingle_words + 1)]
+  hashes = np.frombuffer(
+    b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles),
+    dtype=">u8"
+  )
+  bits = np.unpackbits(hashes.astype(">u8").view(np.uint8).reshape(-1, 8), axis=1)
+  # Each bit votes +1 when set and -1 when clear; the sign of the sum is the fingerprint bit.
+  votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+  fingerprint = 0
+  for bit in (votes > 0):
+    fingerprint = (fingerprint << 1) | int(bit)
+  return fingerprint
+
+
+def to_signed(fingerprint: int) -> int:
+  """SQLite integers are signed 64-bit."""
+  return fingerprint - (1 << 64) if fingerprint >= (1 << 63) else fingerprint
+
+
+def to_unsigned(value: int) -> int:
+  return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateIndex:
+  """Fingerprints of stored pages, searched for the closest one within ``max_distance`` bits."""
+
+  def __init__(self, max_distance: int):
+    self.max_distance = max_distance
+    self.urls: List[str] = []
+    self._fingerprints = np.zeros(1024, dtype=np.uint64)
+
+  def __len__(self) -> int:
+    return len(self.urls)
+
+  def add(self, url: str, fingerprint: int) -> None:
+    if len(self.urls) == len(self._fingerprints):
+      self._fingerprints = np.concatenate([self._fingerprints, np.zeros_like(self._fingerprints)])
+    self._fingerprints[len(self.urls)] = np.uint64(fingerprint)
+    self.urls.append(url)
+
+  def find(self, fingerprint: int) -> Optional[Tuple[str, int]]:
+    """Return ``(url, distance)`` of the nearest stored page within ``max_distance``, if any."""
+    if not self.urls:
+      return None
+    xor = self._fingerprints[:len(self.urls)] ^ np.uint64(fingerprint)
+    distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+    best = int(np.argmin(distances))
+    if distances[best] > self.max_distance:
+      return None
+    return self.urls[best], int(distances[best])
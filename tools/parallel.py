@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+import os
+import time
+import threading
+import collections
+import multiprocessing
+from multiprocessing import connection
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+
+def worker_count(configured: Optional[int] = None, env_var: str = "INTELLIBOT_WORKERS") -> int:
+  """Resolve a worker count from an explicit value, an env var, or the CPU count."""
+  if configured is None:
+    env_value = os.environ.get(env_var)
+    if env_value:
+      try:
+        configured = int(env_value)
+      except ValueError:
+        configured = None
+  if configured is None:
+    configured = max(1, (os.cpu_count() or 2) - 1)
+  return max(1, configured)
+
+
+def process_pool(workers: int, initializer: Optional[Callable[..., Any]] = None, initargs: tuple = ()) -> ProcessPoolExecutor:
+  """
+  Create a process pool using the ``spawn`` start method. Forking the web
+  process would copy the eventlet hub and its sockets into every child; spawned
+  workers start clean and never run on the hub.
+  """
+  return ProcessPoolExecutor(
+    max_workers=workers,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=initializer,
+    initargs=initargs
+  )
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+  batch: List[T] = []
+  for item in items:
+    batch.append(item)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def ordered_map(
+  executor: ProcessPoolExecutor,
+  fn: Callable[..., Any],
+  items: Iterable[Any],
+  *args: Any,
+  window: int = 8
+) -> Iterator[Any]:
+  """
+  Like ``executor.map`` but with at most ``window`` tasks outstanding, so a
+  huge input does not queue every task (and every result) up front. Results
+  are yielded in input order.
+  """
+  pending: collections.deque = collections.deque()
+  for item in items:
+    pending.append(executor.submit(fn, item, *args))
+    if len(pending) >= window:
+      yield pending.popleft().result()
+  while pending:
+    yield pending.popleft().result()
+
+
+class TaskTimeout(Exception):
+  """Raised on a future whose task ran past the pool's time budget."""
+
+
+def _budgeted_worker(conn: Any, initializer: Optional[Callable[..., Any]], initargs: tuple) -> None:
+  if initializer is not None:
+    initializer(*initargs)
+  # Start-up (spawn, imports, initializer) must not count against a task's budget.
+  try:
+    conn.send(None)
+  except OSError:
+    return
+  while True:
+    try:
+      fn, args = conn.recv()
+    except (EOFError, OSError):
+      return
+    try:
+      outcome = (True, fn(*args))
+    except BaseException as exc:
+      outcome = (False, exc)
+    try:
+      conn.send(outcome)
+    except Exception as exc:
+      # Unpicklable result or exception; report it rather than dying silently.
+      conn.send((False, RuntimeError(f"{outcome[1].__class__.__name__}: {exc}")))
+
+
+class _Worker:
+  def __init__(self, context: Any, initializer: Optional[Callable[..., Any]], initargs: tuple):
+    self.conn, child_conn = context.Pipe()
+    self.process = context.Process(target=_budgeted_worker, args=(child_conn, initializer, initargs), daemon=True)
+    self.process.start()
+    child_conn.close()
+    self.ready = False
+    self.future: Optional[Future] = None
+    self.deadline = 0.0
+
+  def kill(self) -> None:
+    self.process.kill()
+    self.process.join()
+    self.conn.close()
+
+
+class BudgetedProcessPool:
+  """
+  Process pool where every task gets at most ``time_budget`` seconds. A worker
+  that overruns is killed and replaced, and its future fails with ``TaskTimeout``,
+  so one pathological input cannot stall the pool. Workers are spawned, as in
+  ``process_pool``.
+  """
+
+  def __init__(
+    self,
+    workers: int,
+    time_budget: float,
+    initializer: Optional[Callable[..., Any]] = None,
+    initargs: tuple = ()
+  ):
+    self.time_budget = time_budget
+    self.timeouts = 0
+    self._context = multiprocessing.get_context("spawn")
+    self._initializer = initializer
+    self._initargs = initargs
+    self._workers = [_Worker(self._context, initializer, initargs) for _ in range(max(1, workers))]
+    self._tasks: collections.deque = collections.deque()
+    self._lock = threading.Lock()
+    self._wake_reader, self._wake_writer = self._context.Pipe(duplex=False)
+    self._closed = False
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  @property
+  def pending(self) -> int:
+    """Tasks submitted but not yet handed to a worker."""
+    return len(self._tasks)
+
+  @property
+  def running(self) -> int:
+    return sum(1 for worker in self._workers if worker.future is not None)
+
+  def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+    future: Future = Future()
+    with self._lock:
+      if self._closed:
+        raise RuntimeError("cannot submit to a closed pool")
+      self._tasks.append((future, fn, args))
+    self._wake()
+    return future
+
+  def _wake(self) -> None:
+    try:
+      self._wake_writer.send_bytes(b"x")
+    except OSError:
+      pass
+
+  def _dispatch(self) -> None:
+    with self._lock:
+      for worker in self._workers:
+        if not worker.ready or worker.future is not None:
+          continue
+        while self._tasks:
+          future, fn, args = self._tasks.popleft()
+          if future.set_running_or_notify_cancel():
+            break
+        else:
+          return
+        worker.future = future
+        worker.deadline = time.monotonic() + self.time_budget
+        worker.conn.send((fn, args))
+
+  def _replace(self, index: int) -> None:
+    self._workers[index].kill()
+    self._workers[index] = _Worker(self._context, self._initializer, self._initargs)
+
+  def _run(self) -> None:
+    while True:
+      self._dispatch()
+      busy = [worker for worker in self._workers if worker.future is not None]
+      if self._closed and not busy and not self._tasks:
+        return
+      starting = [worker for worker in self._workers if not worker.ready]
+      timeout = None
+      if busy:
+        timeout = max(0.0, min(worker.deadline for worker in busy) - time.monotonic())
+      watched = [self._wake_reader] + [worker.conn for worker in busy + starting]
+      ready = connection.wait(watched, timeout)
+      for conn in ready:
+        if conn is self._wake_reader:
+          while self._wake_reader.poll():
+            self._wake_reader.recv_bytes()
+          continue
+        index = next(i for i, worker in enumerate(self._workers) if worker.conn is conn)
+        worker = self._workers[index]
+        if not worker.ready:
+          try:
+            conn.recv()
+            worker.ready = True
+          except (EOFError, OSError):
+            # The initializer failed; fail the queued work instead of respawning forever.
+            self._fail_all(RuntimeError("worker process failed to start"))
+            return
+          continue
+        future, worker.future = worker.future, None
+        try:
+          ok, value = conn.recv()
+        except (EOFError, OSError):
+          future.set_exception(RuntimeError("worker process exited unexpectedly"))
+          self._replace(index)
+          continue
+        if ok:
+          future.set_result(value)
+        else:
+          future.set_exception(value)
+      now = time.monotonic()
+      for index, worker in enumerate(self._workers):
+        if worker.future is not None and worker.deadline <= now:
+          future, worker.future = worker.future, None
+          self.timeouts += 1
+          future.set_exception(TaskTimeout(f"task exceeded {self.time_budget:g}s"))
+          self._replace(index)
+
+  def _fail_all(self, exc: Exception) -> None:
+    with self._lock:
+      self._closed = True
+      while self._tasks:
+        self._tasks.popleft()[0].set_exception(exc)
+    for worker in self._workers:
+      if worker.future is not None:
+        worker.future.set_exception(exc)
+        worker.future = None
+
+  def shutdown(self, cancel_futures: bool = False) -> None:
+    with self._lock:
+      self._closed = True
+      if cancel_futures:
+        while self._tasks:
+          self._tasks.popleft()[0].cancel()
+    self._wake()
+    self._thread.join()
+    for worker in self._workers:
+      try:
+        worker.conn.close()
+      except OSError:
+        pass
+      worker.process.join(timeout=5)
+      if worker.process.is_alive():
+        worker.process.kill()
+        worker.process.join()
+    self._wake_reader.close()
+    self._wake_writer.close()
+
+  def __enter__(self) -> "BudgetedProcessPool":
+    return self
+
+  def __exit__(self, *exc_info: Any) -> None:
+    self.shutdown(cancel_futures=exc_info[0] is not None)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import os
+import gzip
+import tempfile
+from typing import Any, List, Optional, Tuple
+from PyPDF2 import PdfReader
+from tools.hub import offload
+from tools.parallel import BudgetedProcessPool, TaskTimeout, worker_count
+
+
+PDF_PAGE_TIMEOUT = float(os.environ.get("PDF_PAGE_TIMEOUT", "20"))
+# Below this many pages, spawning workers costs more than it saves.
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "16"))
+TEXT_CACHE_DIR_NAME = "pdf_text_cache"
+
+# Worker-side: the reader for the file this worker last saw, so a worker
+# handed many pages of one manual parses its cross-reference table once.
+_reader: Optional[Tuple[Tuple[str, int, int], PdfReader]] = None
+
+
+def default_text_cache_path(raw_dir: str) -> str:
+  """The cache lives next to the raw directory so rebuilding the knowledge base keeps it."""
+  return os.path.join(os.path.dirname(os.path.abspath(raw_dir)), TEXT_CACHE_DIR_NAME)
+
+
+def _page_text(path: str, index: int) -> str:
+  global _reader
+  stat = os.stat(path)
+  # Spool paths can be reused, so the file's identity includes size and mtime.
+  key = (path, stat.st_size, stat.st_mtime_ns)
+  if _reader is None or _reader[0] != key:
+    _reader = (key, PdfReader(path))
+  return _reader[1].pages[index].extract_text() or ""
+
+
+def _read_pdf(path: str, parallel_min_pages: int) -> Tuple[int, Optional[List[str]]]:
+  """Page count, plus the page texts when the file is too small to split up."""
+  reader = PdfReader(path)
+  page_count = len(reader.pages)
+  if page_count >= parallel_min_pages:
+    return page_count, None
+  return page_count, [page.extract_text() or "" for page in reader.pages]
+
+
+class PdfTextExtractor:
+  """
+  Extracts PDF text, caching it by the file's ``content_hash`` so a file seen
+  before is never parsed again. Large files are split into one task per page
+  on a ``BudgetedProcessPool`` (started on first use and shared by every file
+  this extractor handles); a page that runs past ``page_timeout`` seconds is
+  dropped rather than stalling the upload.
+  """
+
+  def __init__(
+    self,
+    cache_dir: Optional[str],
+    workers: Optional[int] = None,
+    page_timeout: float = PDF_PAGE_TIMEOUT,
+    parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES
+  ):
+    self.cache_dir = cache_dir
+    if workers is None and not os.environ.get("PDF_EXTRACT_WORKERS"):
+      # The caller just waits on the pages, so every core can extract.
+      workers = os.cpu_count() or 1
+    self.workers = worker_count(workers, "PDF_EXTRACT_WORKERS")
+    self.page_timeout = page_timeout
+    self.parallel_min_pages = parallel_min_pages
+    self.cache_hits = 0
+    self.pages = 0
+    self.timeouts = 0
+    self._pool: Optional[BudgetedProcessPool] = None
+
+  def __enter__(self) -> "PdfTextExtractor":
+    return self
+
+  def __exit__(self, *exc: Any) -> None:
+    self.close()
+
+  def _cache_path(self, content_hash: str) -> Optional[str]:
+    if not self.cache_dir or not content_hash:
+      return None
+    return os.path.join(self.cache_dir, f"{content_hash}.txt.gz")
+
+  def _cached(self, content_hash: str) -> Optional[str]:
+    path = self._cache_path(content_hash)
+    if not path or not os.path.exists(path):
+      return None
+    try:
+      with gzip.open(path, "rt", encoding="utf-8") as handle:
+        return handle.read()
+    except (OSError, EOFError, ValueError):
+      return None
+
+  def _store(self, content_hash: str, text: str) -> None:
+    path = self._cache_path(content_hash)
+    if not path:
+      return
+    os.makedirs(self.cache_dir, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+    try:
+      with os.fdopen(handle, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as cache_file:
+        cache_file.write(text)
+      os.replace(temp_path, path)
+    except OSError:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+  def _extract_parallel(self, path: str, page_count: int) -> List[str]:
+    if self._pool is None:
+      self._pool = BudgetedProcessPool(self.workers, self.page_timeout)
+    futures = [self._pool.submit(_page_text, path, index) for index in range(page_count)]
+    parts: List[str] = []
+    for future in futures:
+      try:
+        parts.append(future.result())
+      except TaskTimeout:
+        self.timeouts += 1
+        parts.append("")
+    return parts
+
+  def extract(self, path: str, content_hash: str = "") -> str:
+    """Text of the PDF at ``path``, pages joined by newlines."""
+    cached = self._cached(content_hash)
+    if cached is not None:
+      self.cache_hits += 1
+      return cached
+
+    # Parsing in this process happens on a native thread, off the eventlet hub.
+    page_count, parts = offload(_read_pdf, path, self.parallel_min_pages)
+    self.pages += page_count
+    timeouts = self.timeouts
+    if parts is None:
+      parts = self._extract_parallel(path, page_count)
+    text = "\n".join(parts)
+    # Text missing timed-out pages is used for this upload but not cached,
+    # so the next upload of the file tries those pages again.
+    if self.timeouts == timeouts:
+      self._store(content_hash, text)
+    return text
+
+  def close(self) -> None:
+    if self._pool is not None:
+      self._pool.shutdown(cancel_futures=True)
+      self._pool = None
@@ -1,128 +1,224 @@
 import os
 import io
-import json
+import shutil
 import hashlib
 import datetime
-from typing import Iterable, Dict, Any, List, Union
+import tempfile
+from typing import Iterable, Dict, Any, List, Union, Optional, Callable, BinaryIO, NamedTuple, Tuple
 from werkzeug.utils import secure_filename
-from PyPDF2 import PdfReader
+from tools.doc_store import DocumentStore
+from tools.pdf_extract import PdfTextExtractor, default_text_cache_path
 
 
 UPLOAD_DIR_DEFAULT = "kb/uploads"
+STREAM_CHUNK_SIZE = 1024 * 1024
 
 
 def _normalize_text(text: str) -> str:
   return " ".join(text.split())
 
 
-def _save_payload(raw_dir: str, payload: Dict[str, Any]) -> None:
-  os.makedirs(raw_dir, exist_ok=True)
-  doc_hash = payload["content_hash"]
-  path = os.path.join(raw_dir, f"{doc_hash}.json")
-  with open(path, "w", encoding="utf-8") as handle:
-    json.dump(payload, handle, ensure_ascii=False, indent=2)
+def _save_payload(store: DocumentStore, payload: Dict[str, Any]) -> None:
+  store.put(payload["content_hash"], payload)
 
 
-def _store_upload(upload_dir: str, stored_filename: str, content: bytes) -> str:
+def _store_upload(upload_dir: str, stored_filename: str, spooled_path: str, keep_spooled: bool = False) -> str:
+  """Move a spooled upload into the upload directory, or copy it when the spool file must outlive the run."""
   os.makedirs(upload_dir, exist_ok=True)
   stored_path = os.path.join(upload_dir, stored_filename)
-  with open(stored_path, "wb") as upload_file:
-    upload_file.write(content)
+  if not keep_spooled:
+    shutil.move(spooled_path, stored_path)
+    return stored_path
+  handle, temp_path = tempfile.mkstemp(dir=upload_dir, suffix=".tmp")
+  os.close(handle)
+  try:
+    shutil.copyfile(spooled_path, temp_path)
+    os.replace(temp_path, stored_path)
+  except BaseException:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+    raise
   return stored_path
 
 
-def _extract_pdf_text(data: bytes) -> str:
-  reader = PdfReader(io.BytesIO(data))
-  parts: List[str] = []
-  for page in reader.pages:
-    extracted = page.extract_text() or ""
-    parts.append(extracted)
-  combined = "\n".join(parts)
-  return combined
+class SpooledUpload(NamedTuple):
+  """An uploaded file copied to disk, with the SHA-1 of its bytes."""
+  filename: str
+  path: str
+  content_hash: str
+  size: int
+
+
+def spool_upload(filename: str, stream: BinaryIO, spool_dir: Optional[str] = None) -> SpooledUpload:
+  """
+  Copy an upload stream to a temporary file in ``STREAM_CHUNK_SIZE`` pieces,
+  hashing as it goes, so neither the request nor a background task ever holds
+  the whole file in memory. The file is removed once it has been processed
+  (see ``process_uploaded_documents``) or by ``discard_uploads``.
+  """
+  if spool_dir:
+    os.makedirs(spool_dir, exist_ok=True)
+  digest = hashlib.sha1()
+  size = 0
+  handle, path = tempfile.mkstemp(prefix="upload-", dir=spool_dir)
+  try:
+    with os.fdopen(handle, "wb") as spool:
+      while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+          break
+        if isinstance(chunk, str):
+          chunk = chunk.encode("utf-8")
+        digest.update(chunk)
+        spool.write(chunk)
+        size += len(chunk)
+  except BaseException:
+    os.remove(path)
+    raise
+  return SpooledUpload(filename or "", path, digest.hexdigest(), size)
+
+
+def discard_uploads(uploads: Iterable[SpooledUpload]) -> None:
+  """Remove spooled files that were never processed, e.g. after a failed run."""
+  for upload in uploads:
+    try:
+      os.remove(upload.path)
+    except OSError:
+      pass
+
+
+def require_spooled(uploads: Iterable[SpooledUpload]) -> None:
+  """Raise ``FileNotFoundError`` naming every upload whose spool file is gone."""
+  missing = [upload.filename for upload in uploads if not os.path.exists(upload.path)]
+  if missing:
+    raise FileNotFoundError(f"Spooled upload(s) missing: {', '.join(missing)}")
+
+
+def _as_spooled(file_obj: Union[SpooledUpload, Dict[str, Any], Any]) -> Optional[SpooledUpload]:
+  if isinstance(file_obj, SpooledUpload):
+    return file_obj
+  if isinstance(file_obj, dict):
+    filename = file_obj.get("filename")
+    content = file_obj.get("content")
+    if isinstance(content, str):
+      content = content.encode("utf-8")
+    stream = io.BytesIO(content) if content else None
+  else:
+    filename = getattr(file_obj, "filename", None)
+    stream = getattr(file_obj, "stream", file_obj) if hasattr(file_obj, "read") else None
+  if not filename or stream is None:
+    return None
+  return spool_upload(filename, stream)
+
+
+def _process_upload(
+  store: DocumentStore,
+  pdf_extractor: PdfTextExtractor,
+  upload: SpooledUpload,
+  upload_dir: str,
+  url_prefix: str,
+  timestamp: str,
+  keep_spooled: bool = False
+) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+  filename = upload.filename
+  if not filename or not upload.size:
+    return None
+
+  extension = os.path.splitext(filename)[1].lower()
+  content_type = "application/octet-stream"
+  text_content = ""
+
+  try:
+    if extension == ".md":
+      content_type = "text/markdown"
+      with open(upload.path, "rb") as handle:
+        text_content = handle.read().decode("utf-8", errors="ignore")
+    elif extension == ".pdf":
+      content_type = "application/pdf"
+      text_content = pdf_extractor.extract(upload.path, upload.content_hash)
+    else:
+      print(f"Unsupported file type: {filename}")
+      return None
+  except Exception as exc:
+    print(f"Error processing {filename}: {exc}")
+    return None
+
+  clean_text = text_content.strip()
+  if not clean_text:
+    print(f"Skipped {filename}: no extractable text")
+    return None
+
+  content_hash = upload.content_hash
+  safe_name = secure_filename(filename) or f"document_{content_hash}"
+  stored_filename = f"{content_hash}_{safe_name}"
+  _store_upload(upload_dir, stored_filename, upload.path, keep_spooled)
+
+  preview = " ".join(clean_text.split())
+  meta_description = preview[:280]
+
+  payload = {
+    "url": f"{url_prefix}/{stored_filename}",
+    "label": filename,
+    "title": os.path.splitext(filename)[0],
+    "meta_description": meta_description,
+    "headings": {},
+    "text": clean_text,
+    "content_hash": content_hash,
+    "source_type": "upload",
+    "content_type": content_type,
+    "extracted_at": timestamp,
+    "status_code": 200
+  }
+  _save_payload(store, payload)
+  print(f"Processed document: {filename} ({len(clean_text)} chars, stored as {stored_filename})")
+
+  return {
+    "filename": filename,
+    "stored_filename": stored_filename,
+    "hash": content_hash,
+    "chars": len(clean_text)
+  }, payload
 
 
 def process_uploaded_documents(
-  files: Iterable[Union[Dict[str, Any], Any]],
+  files: Iterable[Union[SpooledUpload, Dict[str, Any], Any]],
   raw_dir: str = "kb/raw",
   upload_dir: str = UPLOAD_DIR_DEFAULT,
-  url_prefix: str = "/uploads"
+  url_prefix: str = "/uploads",
+  document_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+  text_cache_dir: Optional[str] = None,
+  keep_spooled: bool = False
 ) -> List[Dict[str, Any]]:
   """
   Extract text from uploaded files (PDF or Markdown) and persist structured payloads.
+  ``files`` are ``SpooledUpload``s, ``{"filename", "content"}`` dicts or file
+  objects; the latter two are spooled to disk first. Each spooled file is moved
+  into ``upload_dir`` or deleted, unless ``keep_spooled`` is set: then given
+  ``SpooledUpload``s are copied and left for the caller to discard, so a
+  re-run can process them again. ``document_callback`` receives each payload
+  once it is stored. PDF text is cached by content hash in ``text_cache_dir``
+  (by default next to ``raw_dir``), so re-uploaded files are not parsed again.
   """
   processed: List[Dict[str, Any]] = []
   timestamp = datetime.datetime.utcnow().isoformat() + "Z"
 
-  for file_obj in files:
-    if isinstance(file_obj, dict):
-      filename = file_obj.get("filename")
-      file_content = file_obj.get("content")
-    else:
-      filename = getattr(file_obj, "filename", None)
-      file_content = file_obj.read() if hasattr(file_obj, "read") else None
-
-    if not filename or not file_content:
-      continue
-
-    extension = os.path.splitext(filename)[1].lower()
-    content_type = "application/octet-stream"
-    text_content = ""
-
-    try:
-      if extension == ".md":
-        content_type = "text/markdown"
-        if isinstance(file_content, bytes):
-          text_content = file_content.decode("utf-8", errors="ignore")
-        else:
-          text_content = str(file_content)
-          file_content = text_content.encode("utf-8")
-      elif extension == ".pdf":
-        content_type = "application/pdf"
-        if isinstance(file_content, str):
-          file_content = file_content.encode("utf-8")
-        text_content = _extract_pdf_text(file_content)
-      else:
-        print(f"Unsupported file type: {filename}")
+  cache_dir = text_cache_dir or default_text_cache_path(raw_dir)
+  with DocumentStore(raw_dir) as store, PdfTextExtractor(cache_dir) as pdf_extractor:
+    for file_obj in files:
+      upload = _as_spooled(file_obj)
+      if upload is None:
+        continue
+      keep = keep_spooled and isinstance(file_obj, SpooledUpload)
+      try:
+        item = _process_upload(store, pdf_extractor, upload, upload_dir, url_prefix, timestamp, keep)
+      finally:
+        if not keep and os.path.exists(upload.path):
+          os.remove(upload.path)
+      if item is None:
         continue
-    except Exception as exc:
-      print(f"Error processing {filename}: {exc}")
-      continue
-
-    clean_text = text_content.strip()
-    if not clean_text:
-      print(f"Skipped {filename}: no extractable text")
-      continue
-
-    content_bytes = file_content if isinstance(file_content, (bytes, bytearray)) else clean_text.encode("utf-8")
-    content_hash = hashlib.sha1(content_bytes).hexdigest()
-    safe_name = secure_filename(filename) or f"document_{content_hash}"
-    stored_filename = f"{content_hash}_{safe_name}"
-    _store_upload(upload_dir, stored_filename, content_bytes)
-
-    preview = " ".join(clean_text.split())
-    meta_description = preview[:280]
-
-    payload = {
-      "url": f"{url_prefix}/{stored_filename}",
-      "label": filename,
-      "title": os.path.splitext(filename)[0],
-      "meta_description": meta_description,
-      "headings": {},
-      "text": clean_text,
-      "content_hash": content_hash,
-      "source_type": "upload",
-      "content_type": content_type,
-      "extracted_at": timestamp,
-      "status_code": 200
-    }
-    _save_payload(raw_dir, payload)
-
-    processed.append({
-      "filename": filename,
-      "stored_filename": stored_filename,
-      "hash": content_hash,
-      "chars": len(clean_text)
-    })
-    print(f"Processed document: {filename} ({len(clean_text)} chars, stored as {stored_filename})")
+      item, payload = item
+      if document_callback:
+        document_callback(payload)
+      processed.append(item)
 
   return processed
@@ -1,10 +1,10 @@
 import os
 import json
-import glob
 import datetime
 from typing import Optional, Callable, Dict, Any
 import yaml
 from openai import OpenAI
+from tools.doc_store import DocumentStore
 
 
 ProgressCallback = Optional[Callable[[str, str], None]]
@@ -16,23 +16,15 @@ def _notify(callback: ProgressCallback, msg_type: str, message: str) -> None:
 
 
 def _collect_samples(raw_dir: str, limit: int = 8) -> str:
-  doc_paths = sorted(
-    glob.glob(os.path.join(raw_dir, "*.json")),
-    key=lambda path: os.path.getsize(path),
-    reverse=True
-  )[:limit]
+  with DocumentStore(raw_dir) as store:
+    documents = store.largest(limit)
   snippets = []
-  for path in doc_paths:
-    try:
-      with open(path, "r", encoding="utf-8") as handle:
-        data = json.load(handle)
-      text = (data.get("text") or "")[:1200]
-      if not text.strip():
-        continue
-      source = data.get("url") or data.get("label") or os.path.basename(path)
-      snippets.append(f"Source: {source}\n{text.strip()}")
-    except Exception:
+  for key, data in documents:
+    text = (data.get("text") or "")[:1200]
+    if not text.strip():
       continue
+    source = data.get("url") or data.get("label") or key
+    snippets.append(f"Source: {source}\n{text.strip()}")
   return "\n\n---\n\n".join(snippets)
 
 
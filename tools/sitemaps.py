@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import io
+import gzip
+import datetime
+import collections
+import xml.etree.ElementTree as ET
+from typing import Optional, Iterable, Iterator, List, NamedTuple, Tuple
+import requests
+
+
+# Guards against sitemap indexes that fan out endlessly or point at each other.
+MAX_SITEMAPS = 500
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class SitemapEntry(NamedTuple):
+  url: str
+  priority: Optional[float]
+  lastmod: Optional[float]
+
+
+def parse_lastmod(value: Optional[str]) -> Optional[float]:
+  """Parse a W3C datetime (``2024-05-01``, ``2024-05-01T10:00:00Z``...) to a UTC timestamp."""
+  if not value:
+    return None
+  try:
+    parsed = datetime.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+  except ValueError:
+    return None
+  if parsed.tzinfo is None:
+    parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+  return parsed.timestamp()
+
+
+def _parse_priority(value: Optional[str]) -> Optional[float]:
+  if not value:
+    return None
+  try:
+    return min(1.0, max(0.0, float(value)))
+  except ValueError:
+    return None
+
+
+def _local_name(tag: str) -> str:
+  return tag.rsplit("}", 1)[-1]
+
+
+def _child_text(elem: ET.Element, name: str) -> Optional[str]:
+  for child in elem:
+    if _local_name(child.tag) == name and child.text:
+      return child.text.strip()
+  return None
+
+
+def parse_sitemap(data: bytes) -> Tuple[List[SitemapEntry], List[str]]:
+  """
+  Parse a ``<urlset>`` or ``<sitemapindex>`` document (optionally gzipped).
+  Returns the page entries and the child sitemap URLs.
+  """
+  if data[:2] == GZIP_MAGIC:
+    try:
+      with gzip.GzipFile(fileobj=io.BytesIO(data)) as handle:
+        data = handle.read(MAX_SITEMAP_BYTES + 1)
+    except (OSError, EOFError):
+      return [], []
+    if len(data) > MAX_SITEMAP_BYTES:
+      return [], []
+  entries: List[SitemapEntry] = []
+  children: List[str] = []
+  try:
+    for _, elem in ET.iterparse(io.BytesIO(data), events=("end",)):
+      name = _local_name(elem.tag)
+      if name == "url":
+        loc = _child_text(elem, "loc")
+        if loc:
+          entries.append(SitemapEntry(
+            loc,
+            _parse_priority(_child_text(elem, "priority")),
+            parse_lastmod(_child_text(elem, "lastmod"))
+          ))
+        elem.clear()
+      elif name == "sitemap":
+        loc = _child_text(elem, "loc")
+        if loc:
+          children.append(loc)
+        elem.clear()
+  except ET.ParseError:
+    pass
+  return entries, children
+
+
+def iter_sitemap_entries(
+  sitemap_urls: Iterable[str],
+  session: requests.Session,
+  timeout: int,
+  max_sitemaps: int = MAX_SITEMAPS
+) -> Iterator[SitemapEntry]:
+  """Fetch sitemaps breadth-first, following sitemap indexes, and yield every page entry."""
+  pending = collections.deque(sitemap_urls)
+  visited = set()
+  while pending and len(visited) < max_sitemaps:
+    sitemap_url = pending.popleft()
+    if sitemap_url in visited:
+      continue
+    visited.add(sitemap_url)
+    try:
+      response = session.get(sitemap_url, timeout=timeout)
+    except requests.RequestException:
+      continue
+    if response.status_code != 200 or len(response.content) > MAX_SITEMAP_BYTES:
+      continue
+    entries, children = parse_sitemap(response.content)
+    pending.extend(children)
+    yield from entries
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+
+ProgressCallback = Optional[Callable[[str, str], None]]
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def _notify(callback: ProgressCallback, kind: str, message: str) -> None:
+  if callback:
+    callback(kind, message)
+
+
+class _Stage(NamedTuple):
+  name: str
+  func: Callable[[], Any]
+  requires: Sequence[str]
+  retries: int
+  retry_delay: float
+  optional: bool
+
+
+class StageResult(NamedTuple):
+  status: str
+  value: Any = None
+  error: Optional[Exception] = None
+  attempts: int = 0
+  seconds: float = 0.0
+
+
+class StageGraph:
+  """
+  Runs a workflow as a dependency graph: a stage starts as soon as every stage
+  it ``requires`` has finished, so independent stages (an LLM call and
+  embedding, say) run side by side. A failing stage is retried ``retries``
+  times. If it still fails, stages that require it are skipped, unless it was
+  added as ``optional``, in which case they run regardless. Stage starts,
+  timings, retries and failures are reported through ``progress_callback``.
+
+  An exception of a type in ``abort_on`` (a job's cancellation, say) is not
+  retried: no further stages start, running ones are waited for, and ``run``
+  raises it.
+  """
+
+  def __init__(
+    self,
+    progress_callback: ProgressCallback = None,
+    abort_on: Tuple[Type[BaseException], ...] = ()
+  ):
+    self.progress_callback = progress_callback
+    self.abort_on = tuple(abort_on)
+    self.stages: Dict[str, _Stage] = {}
+    self.results: Dict[str, StageResult] = {}
+
+  def add(
+    self,
+    name: str,
+    func: Callable[[], Any],
+    requires: Sequence[str] = (),
+    retries: int = 0,
+    retry_delay: float = 2.0,
+    optional: bool = False
+  ) -> None:
+    """Add a stage. Requirements must already be added, which keeps the graph acyclic."""
+    if name in self.stages:
+      raise ValueError(f"Duplicate stage: {name}")
+    unknown = [dep for dep in requires if dep not in self.stages]
+    if unknown:
+      raise ValueError(f"Stage {name} requires unknown stage(s): {', '.join(unknown)}")
+    self.stages[name] = _Stage(name, func, tuple(requires), max(0, retries), retry_delay, optional)
+
+  def _attempt(self, stage: _Stage) -> StageResult:
+    started = time.monotonic()
+    attempts = 0
+    while True:
+      attempts += 1
+      try:
+        value = stage.func()
+      except self.abort_on:
+        raise
+      except Exception as exc:
+        if attempts <= stage.retries:
+          _notify(
+            self.progress_callback,
+            "warning",
+            f"Stage {stage.name} failed (attempt {attempts} of {stage.retries + 1}): {exc}; retrying"
+          )
+          time.sleep(stage.retry_delay * attempts)
+          continue
+        seconds = round(time.monotonic() - started, 2)
+        _notify(
+          self.progress_callback,
+          "warning" if stage.optional else "error",
+          f"Stage {stage.name} failed after {attempts} attempt(s) in {seconds}s: {exc}"
+        )
+        return StageResult(FAILED, error=exc, attempts=attempts, seconds=seconds)
+      seconds = round(time.monotonic() - started, 2)
+      _notify(self.progress_callback, "info", f"Stage {stage.name} finished in {seconds}s")
+      return StageResult(SUCCEEDED, value=value, attempts=attempts, seconds=seconds)
+
+  def _blocking(self, stage: _Stage) -> List[str]:
+    return [
+      dep for dep in stage.requires
+      if self.results[dep].status != SUCCEEDED and not self.stages[dep].optional
+    ]
+
+  def run(self) -> Dict[str, StageResult]:
+    """Run every stage and return their results; stage failures are reported, not raised."""
+    pending = dict(self.stages)
+    running: Dict[Future, str] = {}
+    aborted: Optional[BaseException] = None
+    with ThreadPoolExecutor(max_workers=max(1, len(self.stages))) as executor:
+      while pending or running:
+        if aborted is not None:
+          for name in pending:
+            self.results[name] = StageResult(SKIPPED)
+          pending.clear()
+        ready = aborted is None
+        while ready:
+          # Skipping a stage can settle its dependents, so rescan until stable.
+          ready = False
+          for name, stage in list(pending.items()):
+            if not all(dep in self.results for dep in stage.requires):
+              continue
+            del pending[name]
+            ready = True
+            blocked = self._blocking(stage)
+            if blocked:
+              self.results[name] = StageResult(SKIPPED)
+              _notify(self.progress_callback, "warning", f"Stage {name} skipped: {', '.join(blocked)} did not succeed")
+              continue
+            _notify(self.progress_callback, "info", f"Stage {name} started")
+            running[executor.submit(self._attempt, stage)] = name
+        if not running:
+          break
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+          name = running.pop(future)
+          try:
+            self.results[name] = future.result()
+          except self.abort_on as exc:
+            self.results[name] = StageResult(FAILED, error=exc)
+            if aborted is None:
+              aborted = exc
+    if aborted is not None:
+      raise aborted
+    return self.results
+
+  def value(self, name: str, default: Any = None) -> Any:
+    result = self.results.get(name)
+    return result.value if result and result.status == SUCCEEDED else default
+
+  def error(self, name: str) -> Optional[Exception]:
+    """Why a stage did not succeed: its own error, or that of the requirement that blocked it."""
+    result = self.results.get(name)
+    if result is None:
+      return None
+    if result.error is not None:
+      return result.error
+    if result.status == SKIPPED:
+      for dep in self._blocking(self.stages[name]):
+        error = self.error(dep)
+        if error is not None:
+          return error
+    return None
+
+  def failures(self) -> List[str]:
+    return [name for name, result in self.results.items() if result.status != SUCCEEDED]
+
+  def report(self) -> Dict[str, Dict[str, Any]]:
+    """JSON-friendly per-stage status, attempts, timing and error."""
+    return {
+      name: {
+        "status": result.status,
+        "attempts": result.attempts,
+        "seconds": result.seconds,
+        "error": str(result.error) if result.error else None
+      }
+      for name, result in self.results.items()
+    }
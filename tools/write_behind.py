@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import time
+import threading
+import collections
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+
+BatchWriter = Callable[[List[Any]], None]
+ErrorCallback = Optional[Callable[[List[Any], Exception], None]]
+
+
+class WriteBehindQueue:
+  """
+  Buffers items and hands them to ``write_batch`` from a background thread,
+  so callers never wait on the write itself. A batch goes out once
+  ``batch_size`` items are waiting or the oldest has waited ``max_delay``
+  seconds. At most ``max_pending`` items are buffered: ``put`` blocks while
+  the buffer is full, which slows producers down to the writer's pace
+  instead of growing memory without bound.
+
+  ``flush`` writes everything put so far before it returns, so readers that
+  need to see recent items (and shutdown) call it first. A batch that fails
+  is passed to ``on_error`` and dropped.
+  """
+
+  def __init__(
+    self,
+    write_batch: BatchWriter,
+    batch_size: int = 50,
+    max_delay: float = 0.2,
+    max_pending: int = 2000,
+    on_error: ErrorCallback = None,
+    name: str = "write-behind"
+  ):
+    self.write_batch = write_batch
+    self.batch_size = max(1, batch_size)
+    self.max_delay = max(0.0, max_delay)
+    self.max_pending = max(self.batch_size, max_pending)
+    self.on_error = on_error
+    self.name = name
+    self.written = 0
+    self.failed = 0
+    self.rejected = 0
+    self.batches = 0
+    self._pending: Deque[Tuple[float, Any]] = collections.deque()
+    self._cond = threading.Condition()
+    # Held while a batch is taken and written, so flush() also waits for
+    # a batch the background thread has already taken.
+    self._write_lock = threading.Lock()
+    self._closed = False
+    self._thread: Optional[threading.Thread] = None
+
+  def start(self) -> "WriteBehindQueue":
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+      self._thread.start()
+    return self
+
+  def put(self, item: Any, timeout: Optional[float] = None) -> bool:
+    """Queue ``item``; False if the buffer stayed full for ``timeout`` seconds or the queue is closed."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with self._cond:
+      while len(self._pending) >= self.max_pending and not self._closed:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+          self.rejected += 1
+          return False
+        self._cond.wait(remaining)
+      if self._closed:
+        self.rejected += 1
+        return False
+      self._pending.append((time.monotonic(), item))
+      if len(self._pending) >= self.batch_size:
+        self._cond.notify_all()
+    return True
+
+  def _take(self, limit: int) -> List[Any]:
+    with self._cond:
+      batch = [self._pending.popleft()[1] for _ in range(min(limit, len(self._pending)))]
+      if batch:
+        self._cond.notify_all()
+      return batch
+
+  def _write(self, batch: List[Any]) -> None:
+    try:
+      self.write_batch(batch)
+    except Exception as exc:
+      self.failed += len(batch)
+      if self.on_error:
+        self.on_error(batch, exc)
+      return
+    self.written += len(batch)
+    self.batches += 1
+
+  def _run(self) -> None:
+    while True:
+      with self._cond:
+        while not self._pending and not self._closed:
+          self._cond.wait()
+        if self._closed:
+          return
+        # Give the batch until its oldest item is max_delay old to fill up.
+        while len(self._pending) < self.batch_size and not self._closed:
+          remaining = self._pending[0][0] + self.max_delay - time.monotonic()
+          if remaining <= 0:
+            break
+          self._cond.wait(remaining)
+      with self._write_lock:
+        batch = self._take(self.batch_size)
+        if batch:
+          self._write(batch)
+
+  def flush(self) -> int:
+    """Write everything queued so far; returns how many items were written by this call."""
+    count = 0
+    with self._write_lock:
+      while True:
+        batch = self._take(self.batch_size)
+        if not batch:
+          return count
+        self._write(batch)
+        count += len(batch)
+
+  def close(self) -> None:
+    """Stop the background thread and write whatever is still queued."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+    self.flush()
+
+  def __len__(self) -> int:
+    return len(self._pending)
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "pending": len(self._pending),
+      "written": self.written,
+      "batches": self.batches,
+      "failed": self.failed,
+      "rejected": self.rejected
+    }